@@ -87,6 +87,17 @@ static void help_encoder(void)
 	puts("  encoder off                    - disable encoder");
 	puts("  encoder quality <quality>      - select quality");
 	puts("  encoder fps <fps>              - configure target fps");
+	puts("  encoder skip <on/off>          - skip unchanged frames");
+	puts("  encoder partial <on/off>       - only encode changed tiles rows");
+#ifdef CSR_ENCODER_RAW_BASE
+	puts("  encoder raw <on/off>           - stream uncompressed (YUY2) frames");
+#endif
+#ifdef CSR_ENCODER_RATE_CONTROL_BASE
+	puts("  encoder rate <kB/s>            - configure target rate (0: off)");
+#endif
+#ifdef CSR_ENCODER_STATS_BASE
+	puts("  encoder stats                  - show encoder pipeline statistics");
+#endif
 }
 #endif
 
@@ -160,6 +171,9 @@ static void status_disable(void)
 }
 
 static void debug_ddr(void);
+#ifdef CSR_SDRAM_QOS_UPDATE_ADDR
+static void debug_sdram_qos(void);
+#endif
 
 static void status_print(void)
 {
@@ -191,6 +205,18 @@ static void status_print(void)
 	else
 		printf("off");
 	printf("\r\n");
+#ifdef CSR_HDMI_OUT0_PREFETCH_MIN_LEVEL_ADDR
+	if(hdmi_out0_fi_enable_read()) {
+		printf(
+			"output0 prefetch: %d/%d words (min: %d), underflows: %u",
+			hdmi_out0_prefetch_level_read(),
+			hdmi_out0_prefetch_depth_read(),
+			hdmi_out0_prefetch_min_level_read(),
+			hdmi_out0_underflows_read());
+		hdmi_out0_prefetch_min_level_clear_write(1);
+		printf("\r\n");
+	}
+#endif
 #endif
 
 #ifdef CSR_HDMI_OUT1_BASE
@@ -205,6 +231,18 @@ static void status_print(void)
 	else
 		printf("off");
 	printf("\r\n");
+#ifdef CSR_HDMI_OUT1_PREFETCH_MIN_LEVEL_ADDR
+	if(hdmi_out1_fi_enable_read()) {
+		printf(
+			"output1 prefetch: %d/%d words (min: %d), underflows: %u",
+			hdmi_out1_prefetch_level_read(),
+			hdmi_out1_prefetch_depth_read(),
+			hdmi_out1_prefetch_min_level_read(),
+			hdmi_out1_underflows_read());
+		hdmi_out1_prefetch_min_level_clear_write(1);
+		printf("\r\n");
+	}
+#endif
 #endif
 
 #ifdef ENCODER_BASE
@@ -222,9 +260,23 @@ static void status_print(void)
 	} else
 		printf("off");
 	printf("\r\n");
+#endif
+#ifdef CSR_ENCODER_BUFFER_STATUS_BASE
+	if(encoder_enabled) {
+		printf(
+			"encoder buffer: %d blocks (max: %d)",
+			encoder_buffer_status_level_read(),
+			encoder_buffer_status_max_level_read());
+		encoder_buffer_status_max_level_clear_write(1);
+		printf("\r\n");
+	}
 #endif
 	printf("ddr: ");
 	debug_ddr();
+#ifdef CSR_SDRAM_QOS_UPDATE_ADDR
+	printf("ddr denied cycles: ");
+	debug_sdram_qos();
+#endif
 }
 
 static void status_service(void)
@@ -266,6 +318,10 @@ static void video_matrix_list(void)
 #endif
 	printf("pattern (p):\r\n");
 	printf("  Video pattern\r\n");
+#if defined(CSR_ENCODER_STREAMER_FRAME_SOURCES_PUSH_ADDR)
+	printf("both (b):\r\n");
+	printf("  Alternate frames of input0 and input1 (encoder only)\r\n");
+#endif
 	puts(" ");
 	printf("Video sinks:\r\n");
 #ifdef CSR_HDMI_OUT0_BASE
@@ -285,7 +341,9 @@ static void video_matrix_list(void)
 
 static void video_matrix_connect(int source, int sink)
 {
-	if(source >= 0 && source <= VIDEO_IN_PATTERN)
+	if(source == VIDEO_IN_HDMI_IN0_IN1 && sink != VIDEO_OUT_ENCODER)
+		printf("Both inputs can only be connected to the encoder\r\n");
+	else if(source >= 0 && source <= VIDEO_IN_HDMI_IN0_IN1)
 	{
 		if(sink >= 0 && sink <= VIDEO_OUT_HDMI_OUT1) {
 			printf("Connecting %s to output%d\r\n", processor_get_source_name(source), sink);
@@ -306,8 +364,8 @@ static void video_matrix_connect(int source, int sink)
 #ifdef ENCODER_BASE
 		else if(sink == VIDEO_OUT_ENCODER) {
 			printf("Connecting %s to encoder\r\n", processor_get_source_name(source));
-			processor_set_encoder_source(source);
-			processor_update();
+			if(processor_set_encoder_source(source))
+				processor_update();
 		}
 #endif
 	}
@@ -409,11 +467,92 @@ static void encoder_configure_fps(int fps)
 	encoder_set_fps(fps);
 }
 
+#ifdef CSR_ENCODER_RATE_CONTROL_BASE
+static void encoder_configure_rate(int rate)
+{
+	if(rate > 0)
+		printf("Setting encoder target rate to %dkB/s\r\n", rate);
+	else
+		printf("Disabling encoder rate control\r\n");
+	encoder_set_rate(rate);
+}
+#endif
+
+static void encoder_configure_skip(int enable)
+{
+	if(encoder_skip_enable(enable)) {
+		if(enable)
+			printf("Skipping unchanged frames\r\n");
+		else
+			printf("Encoding all frames\r\n");
+	}
+}
+
+static void encoder_configure_partial(int enable)
+{
+	if(encoder_partial_enable(enable)) {
+		if(enable)
+			printf("Encoding changed tiles rows only\r\n");
+		else
+			printf("Encoding full frames\r\n");
+	}
+}
+
+static void encoder_configure_raw(int enable)
+{
+	if(encoder_raw_enable(enable)) {
+		if(enable)
+			printf("Streaming uncompressed frames\r\n");
+		else
+			printf("Streaming jpeg frames\r\n");
+	}
+}
+
 static void encoder_off(void)
 {
 	printf("Disabling encoder\r\n");
 	encoder_enable(0);
 }
+
+#ifdef CSR_ENCODER_STATS_BASE
+static unsigned int percent(unsigned int value, unsigned int total)
+{
+	if(total < 100)
+		return 0;
+	return value/(total/100);
+}
+
+#define encoder_stats_print_stage(name) \
+	printf("  %-8s valid: %3d%%  stalled: %3d%%  %d bytes/frame\r\n", #name, \
+		percent(encoder_stats_##name##_valid_read(), encoder_stats_##name##_cycles_read()), \
+		percent(encoder_stats_##name##_stall_read(), encoder_stats_##name##_cycles_read()), \
+		encoder_stats_##name##_frame_bytes_read())
+
+static void encoder_stats(void)
+{
+	encoder_stats_snapshot_write(1);
+	printf("encoder pipeline:\r\n");
+#ifdef CSR_ENCODER_STATS_READER_CYCLES_ADDR
+	encoder_stats_print_stage(reader);
+	encoder_stats_print_stage(cdc);
+	encoder_stats_print_stage(buffer);
+	encoder_stats_print_stage(fifo);
+#endif
+#ifdef CSR_ENCODER_STATS_READER1_CYCLES_ADDR
+	encoder_stats_print_stage(reader1);
+	encoder_stats_print_stage(cdc1);
+	encoder_stats_print_stage(buffer1);
+	encoder_stats_print_stage(fifo1);
+#endif
+	encoder_stats_print_stage(output);
+	printf("encode latency: %d cycles\r\n", encoder_stats_latency_read());
+#ifdef CSR_USB_STREAMER_BASE
+	printf("usb streamer: %d bytes buffered, %d underruns\r\n",
+		usb_streamer_level_read(), usb_streamer_underruns_read());
+#endif
+	encoder_stats_clear_write(1);
+}
+#endif
 #endif
 
 static void debug_pll(void)
@@ -445,6 +584,35 @@ static void debug_ddr(void)
 	printf("read:%5dMbps  write:%5dMbps  all:%5dMbps\r\n", rdb, wrb, rdb + wrb);
 }
 
+#ifdef CSR_SDRAM_QOS_UPDATE_ADDR
+static void debug_sdram_qos(void)
+{
+	/* masters 0-3: hdmi_in0, hdmi_in1, hdmi_out0, hdmi_out1 */
+	sdram_qos_update_write(1);
+	printf("in0:%u  in1:%u  out0:%u  out1:%u",
+		sdram_qos_master0_denied_read(),
+		sdram_qos_master1_denied_read(),
+		sdram_qos_master2_denied_read(),
+		sdram_qos_master3_denied_read());
+#ifdef CSR_SDRAM_QOS_MASTER4_DENIED_ADDR
+	printf("  m4:%u", sdram_qos_master4_denied_read());
+#endif
+#ifdef CSR_SDRAM_QOS_MASTER5_DENIED_ADDR
+	printf("  m5:%u", sdram_qos_master5_denied_read());
+#endif
+#ifdef CSR_SDRAM_QOS_MASTER6_DENIED_ADDR
+	printf("  m6:%u", sdram_qos_master6_denied_read());
+#endif
+#ifdef CSR_SDRAM_QOS_MASTER7_DENIED_ADDR
+	printf("  m7:%u", sdram_qos_master7_denied_read());
+#endif
+#ifdef CSR_SDRAM_QOS_MASTER8_DENIED_ADDR
+	printf("  m8:%u", sdram_qos_master8_denied_read());
+#endif
+	printf("\r\n");
+}
+#endif
+
 #if defined(CSR_HDMI_IN0_BASE) || defined(CSR_HDMI_IN1_BASE)
 static void debug_input(unsigned int channels, unsigned int change, unsigned int state)
 {
@@ -589,6 +757,9 @@ void ci_service(void)
 			else if((strcmp(token, "pattern") == 0) || (strcmp(token, "p") == 0)) {
 				source = VIDEO_IN_PATTERN;
 			}
+			else if((strcmp(token, "both") == 0) || (strcmp(token, "b") == 0)) {
+				source = VIDEO_IN_HDMI_IN0_IN1;
+			}
 			else {
 				printf("Unknown video source: '%s'\r\n", token);
 			}
@@ -669,6 +840,20 @@ void ci_service(void)
 			encoder_configure_quality(atoi(get_token(&str)));
 		else if(strcmp(token, "fps") == 0)
 			encoder_configure_fps(atoi(get_token(&str)));
+		else if(strcmp(token, "skip") == 0)
+			encoder_configure_skip(strcmp(get_token(&str), "on") == 0);
+		else if(strcmp(token, "partial") == 0)
+			encoder_configure_partial(strcmp(get_token(&str), "on") == 0);
+		else if(strcmp(token, "raw") == 0)
+			encoder_configure_raw(strcmp(get_token(&str), "on") == 0);
+#ifdef CSR_ENCODER_RATE_CONTROL_BASE
+		else if(strcmp(token, "rate") == 0)
+			encoder_configure_rate(atoi(get_token(&str)));
+#endif
+#ifdef CSR_ENCODER_STATS_BASE
+		else if(strcmp(token, "stats") == 0)
+			encoder_stats();
+#endif
 		else
 			help_encoder();
 	}
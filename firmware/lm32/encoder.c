@@ -5,16 +5,22 @@
 #include <stdio.h>
 #include <console.h>
 #include <time.h>
+#include <irq.h>
+#include <hw/flags.h>
 
 #include "processor.h"
 #include "encoder.h"
+#include "framebuffer.h"
+
+/* core the registers accesses are routed to */
+static int encoder_core;
 
 void encoder_write_reg(unsigned int adr, unsigned int value) {
-		MMPTR(ENCODER_BASE+adr) = value;
+		MMPTR(ENCODER_BASE+encoder_core*ENCODER_CORE_SIZE+adr) = value;
 }
 
 unsigned int encoder_read_reg(unsigned int adr) {
-		return MMPTR(ENCODER_BASE+adr);
+		return MMPTR(ENCODER_BASE+encoder_core*ENCODER_CORE_SIZE+adr);
 }
 
 const char luma_rom_100[64] = {
@@ -132,17 +138,412 @@ void encoder_init(int quality) {
 	}
 }
 
+/* frames started on core 0, to match the frames encoder_reader (that feeds
+ * core 0) started in block order */
+static unsigned int encoder_block_frames;
+
 void encoder_start(short resx, short resy) {
 	encoder_write_reg(ENCODER_IMAGE_SIZE_REG, (resx << 16) | resy);
 	encoder_write_reg(ENCODER_START_REG, 7); /* RGB, SOF */
+	if(encoder_core == 0)
+		encoder_block_frames++;
 }
 
 int encoder_done(void) {
 	return (encoder_read_reg(ENCODER_STS_REG) & 0x1) == 0;
 }
 
+static int encoder_cores_done(void) {
+	int core;
+
+	for(core=0;core<ENCODER_CORES;core++)
+		if(MMPTR(ENCODER_BASE+core*ENCODER_CORE_SIZE+ENCODER_STS_REG) & 0x1)
+			return 0;
+	return 1;
+}
+
+static unsigned int encoder_reader_base;
+
+void encoder_reader_set_base(unsigned int base) {
+	encoder_reader_base = base;
+}
+
+unsigned int encoder_reader_get_base(void) {
+	return encoder_reader_base;
+}
+
+/* dual: frames of both inputs are read alternately. Only slot0 is used so
+ * that the source of each frame read is known, the source is given to the
+ * streamer before starting the frame. */
+#define ENCODER_SOURCES 4
+#define ENCODER_SOURCES_MASK (ENCODER_SOURCES - 1)
+
+static unsigned int encoder_dual_bases[2];
+static int encoder_dual_next;
+static int encoder_sources[ENCODER_SOURCES];
+static int encoder_sources_produce, encoder_sources_consume;
+
+void encoder_reader_set_dual_bases(unsigned int base0, unsigned int base1) {
+	encoder_reader_base = base0;
+	encoder_dual_bases[0] = base0;
+	encoder_dual_bases[1] = base1;
+}
+
+static void encoder_reader_load_dual(void) {
+	encoder_sources[encoder_sources_produce] = encoder_dual_next;
+	encoder_sources_produce = (encoder_sources_produce + 1) & ENCODER_SOURCES_MASK;
+
+	encoder_reader_slot0_address_write(encoder_dual_bases[encoder_dual_next]);
+	encoder_reader_slot0_status_write(DVISAMPLER_SLOT_LOADED);
+	encoder_dual_next = !encoder_dual_next;
+}
+
+/* signature of the latest frame of the selected source (0: unknown) */
+static unsigned int encoder_frame_crc;
+
+void encoder_set_frame_crc(unsigned int crc) {
+	encoder_frame_crc = crc;
+}
+
+/* full frames: signatures of the frames queued in the reader, latched with
+ * their address when a slot is loaded. The slots are read alternately, so
+ * frames are read (and encoded) in the order they are queued.
+ * When skipping unchanged frames, a slot is left empty instead of being
+ * loaded with a frame identical to the last queued (or encoded) one, it is
+ * loaded again from encoder_service when the content changes. */
+#define ENCODER_FRAMES 4
+#define ENCODER_FRAMES_MASK (ENCODER_FRAMES - 1)
+
+static unsigned int encoder_frame_crcs[ENCODER_FRAMES];
+static int encoder_frames_produce, encoder_frames_consume;
+/* signature of the last frame encoded */
+static unsigned int encoder_last_crc;
+/* slots left empty (bit n: slot n) */
+static int encoder_idle_slots;
+
+static void encoder_reader_load_frame(int slot) {
+	unsigned int last_crc;
+
+	if(encoder_skip_enabled && !encoder_raw_enabled && (encoder_frame_crc != 0)) {
+		if(encoder_frames_produce != encoder_frames_consume)
+			last_crc = encoder_frame_crcs[(encoder_frames_produce - 1) & ENCODER_FRAMES_MASK];
+		else
+			last_crc = encoder_last_crc;
+		if(encoder_frame_crc == last_crc) {
+			if(slot == 0)
+				encoder_reader_slot0_status_write(DVISAMPLER_SLOT_EMPTY);
+			else
+				encoder_reader_slot1_status_write(DVISAMPLER_SLOT_EMPTY);
+			encoder_idle_slots |= 1 << slot;
+			return;
+		}
+	}
+
+	encoder_frame_crcs[encoder_frames_produce] = encoder_frame_crc;
+	encoder_frames_produce = (encoder_frames_produce + 1) & ENCODER_FRAMES_MASK;
+	encoder_idle_slots &= ~(1 << slot);
+	if(slot == 0) {
+		encoder_reader_slot0_address_write(encoder_reader_base);
+		encoder_reader_slot0_status_write(DVISAMPLER_SLOT_LOADED);
+	} else {
+		encoder_reader_slot1_address_write(encoder_reader_base);
+		encoder_reader_slot1_status_write(DVISAMPLER_SLOT_LOADED);
+	}
+}
+
+int encoder_skip_enable(char enable) {
+#if ENCODER_CORES > 1
+	/* the signatures are only known for the frames of encoder_reader */
+	if(enable) {
+		printf("Skipping unchanged frames is not supported with multiple cores\r\n");
+		return 0;
+	}
+#endif
+	encoder_skip_enabled = enable;
+	return 1;
+}
+
+/* partial frames: regions (first line, number of lines) of the frames
+ * queued in the reader. Only slot0 is used so that the region of each
+ * frame can be given to the reader before it starts reading it. */
+#define ENCODER_REGIONS 4
+#define ENCODER_REGIONS_MASK (ENCODER_REGIONS - 1)
+
+static int encoder_region_first[ENCODER_REGIONS];
+static int encoder_region_lines[ENCODER_REGIONS];
+static int encoder_region_produce, encoder_region_consume;
+
+static void encoder_reader_load_region(int full) {
+	int first, last, lines;
+
+	if(full) {
+		first = 0;
+		last = (processor_v_active + 15)/16 - 1;
+	} else if(!processor_encoder_dirty_rows(&first, &last)) {
+		/* nothing changed: nothing to encode, slot0 is loaded again
+		 * from encoder_service when the content changes */
+		encoder_reader_slot0_status_write(DVISAMPLER_SLOT_EMPTY);
+		encoder_idle_slots |= 1;
+		return;
+	}
+	encoder_idle_slots &= ~1;
+	first *= 16;
+	lines = (last + 1)*16;
+	if(lines > processor_v_active)
+		lines = processor_v_active;
+	lines -= first;
+
+	encoder_region_first[encoder_region_produce] = first;
+	encoder_region_lines[encoder_region_produce] = lines;
+	encoder_region_produce = (encoder_region_produce + 1) & ENCODER_REGIONS_MASK;
+
+	encoder_reader_v_width_write(lines);
+	encoder_reader_slot0_address_write(encoder_reader_base + first*processor_h_active*2);
+	encoder_reader_slot0_status_write(DVISAMPLER_SLOT_LOADED);
+}
+
+/* load the empty slots if the content has changed */
+static void encoder_reader_load_idle(void) {
+	unsigned int mask;
+
+	mask = irq_getmask();
+	irq_setmask(mask & ~(1 << ENCODER_READER_INTERRUPT));
+	if(encoder_partial_enabled) {
+		if(encoder_idle_slots & 1)
+			encoder_reader_load_region(0);
+	} else {
+		if(encoder_idle_slots & 1)
+			encoder_reader_load_frame(0);
+		if(encoder_idle_slots & 2)
+			encoder_reader_load_frame(1);
+	}
+	irq_setmask(mask);
+}
+
+void encoder_reader_isr(void) {
+	if(encoder_dual_enabled) {
+		if(encoder_reader_slot0_status_read() == DVISAMPLER_SLOT_PENDING)
+			encoder_reader_load_dual();
+		return;
+	}
+	if(encoder_partial_enabled) {
+		if(encoder_reader_slot0_status_read() == DVISAMPLER_SLOT_PENDING)
+			encoder_reader_load_region(0);
+		return;
+	}
+
+	/* Reload released slots with the latest frame of the selected source */
+	if(encoder_reader_slot0_status_read() == DVISAMPLER_SLOT_PENDING)
+		encoder_reader_load_frame(0);
+	if(encoder_reader_slot1_status_read() == DVISAMPLER_SLOT_PENDING)
+		encoder_reader_load_frame(1);
+}
+
+#ifdef CSR_ENCODER_READER1_BASE
+void encoder_reader1_isr(void) {
+	if(encoder_reader1_slot0_status_read() == DVISAMPLER_SLOT_PENDING) {
+		encoder_reader1_slot0_address_write(encoder_reader_base);
+		encoder_reader1_slot0_status_write(DVISAMPLER_SLOT_LOADED);
+	}
+	if(encoder_reader1_slot1_status_read() == DVISAMPLER_SLOT_PENDING) {
+		encoder_reader1_slot1_address_write(encoder_reader_base);
+		encoder_reader1_slot1_status_write(DVISAMPLER_SLOT_LOADED);
+	}
+}
+#endif
+
+static void encoder_reader_init(void) {
+	unsigned int mask;
+
+	encoder_reader_h_width_write(processor_h_active);
+	encoder_reader_v_width_write(processor_v_active);
+
+	if(encoder_dual_enabled) {
+		encoder_sources_produce = encoder_sources_consume = 0;
+		encoder_dual_next = 0;
+		encoder_reader_load_dual();
+	} else if(encoder_partial_enabled) {
+		encoder_region_produce = encoder_region_consume = 0;
+		encoder_idle_slots = 0;
+		encoder_reader_load_region(1);
+	} else {
+		encoder_frames_produce = encoder_frames_consume = 0;
+		encoder_last_crc = 0;
+		encoder_idle_slots = 0;
+		encoder_reader_load_frame(0);
+		encoder_reader_load_frame(1);
+	}
+
+	encoder_reader_ev_pending_write(encoder_reader_ev_pending_read());
+	encoder_reader_ev_enable_write(0x3);
+	mask = irq_getmask();
+	mask |= 1 << ENCODER_READER_INTERRUPT;
+	irq_setmask(mask);
+
+#ifdef CSR_ENCODER_READER1_BASE
+	encoder_reader1_h_width_write(processor_h_active);
+	encoder_reader1_v_width_write(processor_v_active);
+
+	encoder_reader1_slot0_address_write(encoder_reader_base);
+	encoder_reader1_slot0_status_write(DVISAMPLER_SLOT_LOADED);
+	encoder_reader1_slot1_address_write(encoder_reader_base);
+	encoder_reader1_slot1_status_write(DVISAMPLER_SLOT_LOADED);
+
+	encoder_reader1_ev_pending_write(encoder_reader1_ev_pending_read());
+	encoder_reader1_ev_enable_write(0x3);
+	mask = irq_getmask();
+	mask |= 1 << ENCODER_READER1_INTERRUPT;
+	irq_setmask(mask);
+#endif
+}
+
+static void encoder_reader_disable(void) {
+	unsigned int mask;
+
+	mask = irq_getmask();
+	mask &= ~(1 << ENCODER_READER_INTERRUPT);
+#ifdef CSR_ENCODER_READER1_BASE
+	mask &= ~(1 << ENCODER_READER1_INTERRUPT);
+#endif
+	irq_setmask(mask);
+
+	encoder_reader_slot0_status_write(DVISAMPLER_SLOT_EMPTY);
+	encoder_reader_slot1_status_write(DVISAMPLER_SLOT_EMPTY);
+#ifdef CSR_ENCODER_READER1_BASE
+	encoder_reader1_slot0_status_write(DVISAMPLER_SLOT_EMPTY);
+	encoder_reader1_slot1_status_write(DVISAMPLER_SLOT_EMPTY);
+#endif
+}
+
+#if ENCODER_CORES > 1
+#if ENCODER_CORES > ENCODER_MERGER_RINGS
+#error "not enough encoder merger rings"
+#endif
+#if defined(MAIN_RAM_SIZE) && (ENCODER_MERGER_BASE + ENCODER_MERGER_RINGS*ENCODER_MERGER_RING_SIZE > MAIN_RAM_SIZE)
+#error "encoder merger rings do not fit in main_ram"
+#endif
+
+static void encoder_merger_init(void) {
+	/* one sdram ring per core to store its encoded frames */
+	encoder_merger_stager0_base_write(ENCODER_MERGER_BASE);
+	encoder_merger_stager0_size_write(ENCODER_MERGER_RING_SIZE);
+	encoder_merger_stager1_base_write(ENCODER_MERGER_BASE + ENCODER_MERGER_RING_SIZE);
+	encoder_merger_stager1_size_write(ENCODER_MERGER_RING_SIZE);
+}
+#endif
+
 void encoder_enable(char enable) {
 	encoder_enabled = enable;
+	if(enable) {
+#ifdef CSR_ENCODER_READER_BLOCK_FRAMES_ADDR
+		encoder_block_frames = encoder_reader_block_frames_read();
+#endif
+#if ENCODER_CORES > 1
+		encoder_merger_init();
+#endif
+		encoder_reader_init();
+	}
+	else
+		encoder_reader_disable();
+}
+
+int encoder_partial_enable(char enable) {
+#if ENCODER_CORES > 1
+	if(enable) {
+		printf("Partial frames are not supported with multiple cores\r\n");
+		return 0;
+	}
+#endif
+	if(enable && (encoder_raw_enabled || encoder_dual_enabled)) {
+		printf("Partial frames are not supported with raw frames or both inputs\r\n");
+		return 0;
+	}
+	if(encoder_enabled)
+		encoder_reader_disable();
+	encoder_partial_enabled = enable;
+	if(encoder_enabled)
+		encoder_reader_init();
+	return 1;
+}
+
+/* raw frames: the reader reads the frames in raster order and they bypass
+ * the jpeg cores, no core is started. */
+int encoder_raw_enable(char enable) {
+#ifdef CSR_ENCODER_RAW_BASE
+	int start;
+
+#if ENCODER_CORES > 1
+	/* encoder_reader1 has no raw path */
+	if(enable) {
+		printf("Raw frames are not supported with multiple cores\r\n");
+		return 0;
+	}
+#endif
+	if(enable && (encoder_partial_enabled || encoder_dual_enabled)) {
+		printf("Raw frames are not supported with partial frames or both inputs\r\n");
+		return 0;
+	}
+	if(encoder_enabled)
+		encoder_reader_disable();
+	/* only switch between frames: the frame being read is completed,
+	 * a core is started for it if the reader started it in block order,
+	 * then the reader, the cores and the output have to be drained. The
+	 * output is not drained if the host does not read the stream: give up
+	 * after one second and keep the current mode. */
+	elapsed(&start, -1);
+	while(1) {
+		if(elapsed(&start, identifier_frequency_read())) {
+			printf("Encoder not drained, raw mode not changed\r\n");
+			if(encoder_enabled)
+				encoder_reader_init();
+			return 0;
+		}
+		if(((int)(encoder_reader_block_frames_read() - encoder_block_frames) > 0) &&
+		   encoder_done()) {
+			encoder_init(encoder_quality);
+			encoder_start(processor_h_active, processor_v_active);
+			encoder_core = (encoder_core + 1) % ENCODER_CORES;
+		}
+		if(encoder_reader_idle_read() && encoder_cores_done() &&
+		   encoder_raw_idle_read() &&
+		   (encoder_reader_block_frames_read() == encoder_block_frames))
+			break;
+	}
+	encoder_raw_enable_write(enable);
+	encoder_raw_enabled = enable;
+	if(encoder_enabled)
+		encoder_reader_init();
+	return 1;
+#else
+	if(enable) {
+		printf("Raw frames are not supported by this target\r\n");
+		return 0;
+	}
+	return 1;
+#endif
+}
+
+int encoder_dual_enable(char enable) {
+#if defined(CSR_ENCODER_STREAMER_FRAME_SOURCES_PUSH_ADDR) && (ENCODER_CORES == 1)
+	if(enable && (encoder_partial_enabled || encoder_raw_enabled)) {
+		printf("Both inputs are not supported with partial or raw frames\r\n");
+		return 0;
+	}
+	if(enable == encoder_dual_enabled)
+		return 1;
+	if(encoder_enabled)
+		encoder_reader_disable();
+	encoder_dual_enabled = enable;
+	if(encoder_enabled)
+		encoder_reader_init();
+	return 1;
+#else
+	if(enable) {
+		printf("Both inputs are not supported by this target\r\n");
+		return 0;
+	}
+	return 1;
+#endif
 }
 
 int encoder_set_quality(int quality) {
@@ -160,6 +561,26 @@ int encoder_set_quality(int quality) {
 	return 1;
 }
 
+#ifdef CSR_ENCODER_RATE_CONTROL_BASE
+/* quality of each quantization table bank, from finest to coarsest */
+static const int encoder_rate_control_banks[4] = {100, 85, 75, 50};
+
+void encoder_set_rate(int kbytes_per_sec) {
+	unsigned int frame_bytes;
+
+	if(kbytes_per_sec <= 0) {
+		encoder_rate_control_enable_write(0);
+		return;
+	}
+	frame_bytes = kbytes_per_sec*1000/encoder_target_fps;
+	encoder_rate_control_target_write(kbytes_per_sec*1000);
+	/* allow one frame of backlog before lowering quality */
+	encoder_rate_control_high_level_write(frame_bytes);
+	encoder_rate_control_low_level_write(frame_bytes/4);
+	encoder_rate_control_enable_write(1);
+}
+#endif
+
 int encoder_set_fps(int fps) {
 	if(encoder_target_fps > 0 && encoder_target_fps <= 60) {
 		encoder_target_fps = fps;
@@ -171,27 +592,83 @@ int encoder_set_fps(int fps) {
 	}
 }
 
+static void encoder_start_partial(void) {
+	int first, lines;
+
+	/* region of the next frame of the reader */
+	first = encoder_region_first[encoder_region_consume];
+	lines = encoder_region_lines[encoder_region_consume];
+	encoder_region_consume = (encoder_region_consume + 1) & ENCODER_REGIONS_MASK;
+
+	/* tell the host where the update goes before sending it */
+	if(lines != processor_v_active) {
+		encoder_update_write(first);
+		while(encoder_marker_pending_read());
+	}
+	encoder_start(processor_h_active, lines);
+}
+
 void encoder_service(void) {
 
 	static int last_event;
 	static int last_fps_event;
 	static int frame_cnt;
 	static int can_start;
+	int full;
 
 	if(encoder_enabled) {
 		if(elapsed(&last_event, identifier_frequency_read()/encoder_target_fps))
 			can_start = 1;
-		if(can_start & encoder_done()) {
-			encoder_init(encoder_quality);
-			encoder_start(processor_h_active, processor_v_active);
+		full = !encoder_partial_enabled & !encoder_dual_enabled;
+		if((full | encoder_partial_enabled) && encoder_idle_slots)
+			encoder_reader_load_idle();
+		/* cores encode alternate frames: frames are merged back in the
+		 * order the cores have been started. The frames queue is the one
+		 * of encoder_reader, that only feeds core 0 (encoder_reader1 is
+		 * always loaded and feeds core 1). */
+		if(can_start & encoder_done() & !encoder_raw_enabled &
+		   (!encoder_partial_enabled | (encoder_region_consume != encoder_region_produce)) &
+		   (!encoder_dual_enabled | (encoder_sources_consume != encoder_sources_produce)) &
+		   (!full | (encoder_core != 0) | (encoder_frames_consume != encoder_frames_produce) | (encoder_idle_slots != 0))) {
+			if(full && (encoder_core == 0) && (encoder_frames_consume == encoder_frames_produce)) {
+				/* no new frame queued (unchanged content): only send
+				 * a repeat marker */
+				encoder_repeat_write(1);
+			} else {
+#ifdef CSR_ENCODER_RATE_CONTROL_BASE
+				if(encoder_rate_control_enable_read())
+					encoder_quality = encoder_rate_control_banks[encoder_rate_control_bank_read()];
+#endif
+				encoder_init(encoder_quality);
+#ifdef CSR_ENCODER_STREAMER_FRAME_SOURCES_PUSH_ADDR
+				if(encoder_dual_enabled) {
+					/* frames are read in the order their sources were queued */
+					encoder_streamer_frame_sources_push_write(encoder_sources[encoder_sources_consume]);
+					encoder_sources_consume = (encoder_sources_consume + 1) & ENCODER_SOURCES_MASK;
+				}
+#endif
+				if(encoder_partial_enabled)
+					encoder_start_partial();
+				else
+					encoder_start(processor_h_active, processor_v_active);
+				if(full && (encoder_core == 0)) {
+					/* frame read next by the reader */
+					encoder_last_crc = encoder_frame_crcs[encoder_frames_consume];
+					encoder_frames_consume = (encoder_frames_consume + 1) & ENCODER_FRAMES_MASK;
+				}
+				encoder_core = (encoder_core + 1) % ENCODER_CORES;
+			}
 			can_start = 0;
 			frame_cnt++;
 		}
-		if(encoder_reader_done_read()) {
-			encoder_reader_h_width_write(processor_h_active);
+		/* latched by the readers at the start of each frame */
+		encoder_reader_h_width_write(processor_h_active);
+		if(!encoder_partial_enabled)
 			encoder_reader_v_width_write(processor_v_active);
-			encoder_reader_start_write(1);
-		}
+#ifdef CSR_ENCODER_READER1_BASE
+		encoder_reader1_h_width_write(processor_h_active);
+		encoder_reader1_v_width_write(processor_v_active);
+#endif
 		if(elapsed(&last_fps_event, identifier_frequency_read())) {
 			encoder_fps = frame_cnt;
 			frame_cnt = 0;
@@ -1,6 +1,11 @@
 #ifndef __ENCODER_H
 #define __ENCODER_H
 
+#ifndef ENCODER_CORES
+#define ENCODER_CORES 1
+#endif
+#define ENCODER_CORE_SIZE          0x400
+
 #define ENCODER_START_REG          0x0
 #define ENCODER_IMAGE_SIZE_REG     0x4
 #define ENCODER_RAM_ACCESS_REG     0x8
@@ -23,6 +28,10 @@ const char chroma_rom_75[64];
 const char chroma_rom_50[64];
 
 char encoder_enabled;
+char encoder_skip_enabled;
+char encoder_partial_enabled;
+char encoder_raw_enabled;
+char encoder_dual_enabled;
 int encoder_target_fps;
 int encoder_fps;
 int encoder_quality;
@@ -32,9 +41,20 @@ unsigned int encoder_read_reg(unsigned int adr);
 void encoder_init(int encoder_quality);
 void encoder_start(short resx, short resy);
 int encoder_done(void);
+void encoder_reader_set_base(unsigned int base);
+void encoder_reader_set_dual_bases(unsigned int base0, unsigned int base1);
+unsigned int encoder_reader_get_base(void);
+void encoder_reader_isr(void);
+void encoder_set_frame_crc(unsigned int crc);
+int encoder_skip_enable(char enable);
+int encoder_partial_enable(char enable);
+int encoder_raw_enable(char enable);
+int encoder_dual_enable(char enable);
+void encoder_reader1_isr(void);
 void encoder_enable(char enable);
 int encoder_set_quality(int quality);
 int encoder_set_fps(int fps);
+void encoder_set_rate(int kbytes_per_sec);
 void encoder_service(void);
 
 #endif
\ No newline at end of file
@@ -0,0 +1,40 @@
+#ifndef __FRAMEBUFFER_H
+#define __FRAMEBUFFER_H
+
+#include <generated/mem.h>
+
+/* sdram layout (offsets from MAIN_RAM_BASE), also parsed by
+ * test/hdmi2ethernet/snapshot.py */
+
+#define FRAMEBUFFER_COUNT 4
+#define FRAMEBUFFER_MASK (FRAMEBUFFER_COUNT - 1)
+
+#define HDMI_IN0_FRAMEBUFFERS_BASE 0x01000000
+/* table of the line crcs written by the DMA after each frame */
+#define HDMI_IN0_LINE_CRCS_SIZE (2048*4)
+#define HDMI_IN0_FRAMEBUFFERS_SIZE (1920*1080*2 + HDMI_IN0_LINE_CRCS_SIZE)
+
+#define HDMI_IN1_FRAMEBUFFERS_BASE 0x02000000
+#define HDMI_IN1_LINE_CRCS_SIZE (2048*4)
+#define HDMI_IN1_FRAMEBUFFERS_SIZE (1920*1080*2 + HDMI_IN1_LINE_CRCS_SIZE)
+
+#define PATTERN_FRAMEBUFFER_BASE 0x03000000
+#define PATTERN_FRAMEBUFFER_SIZE (1920*1080*2)
+
+/* encoded frames staging (multi core only): one ring per core after the
+ * framebuffers */
+#define ENCODER_MERGER_BASE 0x04000000
+#define ENCODER_MERGER_RING_SIZE 0x00400000
+#define ENCODER_MERGER_RINGS 2
+
+#if HDMI_IN0_FRAMEBUFFERS_BASE + FRAMEBUFFER_COUNT*HDMI_IN0_FRAMEBUFFERS_SIZE > HDMI_IN1_FRAMEBUFFERS_BASE
+#error "hdmi_in0 framebuffers overlap hdmi_in1 framebuffers"
+#endif
+#if HDMI_IN1_FRAMEBUFFERS_BASE + FRAMEBUFFER_COUNT*HDMI_IN1_FRAMEBUFFERS_SIZE > PATTERN_FRAMEBUFFER_BASE
+#error "hdmi_in1 framebuffers overlap the pattern framebuffer"
+#endif
+#if PATTERN_FRAMEBUFFER_BASE + PATTERN_FRAMEBUFFER_SIZE > ENCODER_MERGER_BASE
+#error "pattern framebuffer overlaps the encoder merger rings"
+#endif
+
+#endif
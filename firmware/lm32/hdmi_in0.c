@@ -13,16 +13,11 @@
 #ifdef CSR_HDMI_IN0_BASE
 
 #include "hdmi_in0.h"
+#include "framebuffer.h"
 
 int hdmi_in0_debug;
 int hdmi_in0_fb_index;
 
-#define FRAMEBUFFER_COUNT 4
-#define FRAMEBUFFER_MASK (FRAMEBUFFER_COUNT - 1)
-
-#define HDMI_IN0_FRAMEBUFFERS_BASE 0x01000000
-#define HDMI_IN0_FRAMEBUFFERS_SIZE 1920*1080*2
-
 //#define CLEAN_COMMUTATION
 //#define DEBUG
 
@@ -30,9 +25,62 @@ unsigned int hdmi_in0_framebuffer_base(char n) {
 	return HDMI_IN0_FRAMEBUFFERS_BASE + n*HDMI_IN0_FRAMEBUFFERS_SIZE;
 }
 
+/* signature (crc) of the frame stored in each framebuffer */
+static unsigned int hdmi_in0_fb_crcs[FRAMEBUFFER_COUNT];
+
+unsigned int hdmi_in0_framebuffer_crc(char n) {
+	return hdmi_in0_fb_crcs[n];
+}
+
+static int hdmi_in0_hres, hdmi_in0_vres;
+
+/* address of the line crcs table of a framebuffer (0 if not available) */
+unsigned int hdmi_in0_framebuffer_line_crcs(char n) {
+#ifdef CSR_HDMI_IN0_DMA_LINE_SIZE_ADDR
+	return hdmi_in0_framebuffer_base(n) + hdmi_in0_hres*hdmi_in0_vres*2;
+#else
+	return 0;
+#endif
+}
+
 static int hdmi_in0_fb_slot_indexes[2];
 static int hdmi_in0_next_fb_index;
-static int hdmi_in0_hres, hdmi_in0_vres;
+
+/* 16x16 tiles rows changed since the last call of hdmi_in0_dirty_rows */
+#define DIRTY_TILES_WORDS_PER_ROW 4
+
+static int hdmi_in0_dirty_first, hdmi_in0_dirty_last = -1;
+
+static void hdmi_in0_update_dirty_rows(void)
+{
+	int row, word;
+
+	for(row=0; row<(hdmi_in0_vres + 15)/16; row++) {
+		if((row >= hdmi_in0_dirty_first) && (row <= hdmi_in0_dirty_last))
+			continue;
+		for(word=0; word<DIRTY_TILES_WORDS_PER_ROW; word++) {
+			hdmi_in0_tiles_adr_write(row*DIRTY_TILES_WORDS_PER_ROW + word);
+			if(hdmi_in0_tiles_dat_read() != 0) {
+				if((hdmi_in0_dirty_last < 0) || (row < hdmi_in0_dirty_first))
+					hdmi_in0_dirty_first = row;
+				if(row > hdmi_in0_dirty_last)
+					hdmi_in0_dirty_last = row;
+				break;
+			}
+		}
+	}
+}
+
+int hdmi_in0_dirty_rows(int *first, int *last)
+{
+	if(hdmi_in0_dirty_last < 0)
+		return 0;
+	*first = hdmi_in0_dirty_first;
+	*last = hdmi_in0_dirty_last;
+	hdmi_in0_dirty_first = 0;
+	hdmi_in0_dirty_last = -1;
+	return 1;
+}
 
 extern void processor_update(void);
 
@@ -69,6 +117,9 @@ void hdmi_in0_isr(void)
 #endif
 
 	expected_length = hdmi_in0_hres*hdmi_in0_vres*2;
+#ifdef CSR_HDMI_IN0_DMA_LINE_SIZE_ADDR
+	expected_length += hdmi_in0_vres*4;
+#endif
 	if(hdmi_in0_dma_slot0_status_read() == DVISAMPLER_SLOT_PENDING) {
 		length = hdmi_in0_dma_slot0_address_read() - (hdmi_in0_framebuffer_base(hdmi_in0_fb_slot_indexes[0]) & 0x0fffffff);
 		if(length == expected_length) {
@@ -98,8 +149,11 @@ void hdmi_in0_isr(void)
 		hdmi_in0_dma_slot1_status_write(DVISAMPLER_SLOT_LOADED);
 	}
 
-	if(fb_index != -1)
+	if(fb_index != -1) {
+		hdmi_in0_fb_crcs[fb_index] = hdmi_in0_dma_frame_crc_read();
+		hdmi_in0_update_dirty_rows();
 		hdmi_in0_fb_index = fb_index;
+	}
 	processor_update();
 }
 
@@ -115,6 +169,11 @@ void hdmi_in0_init_video(int hres, int vres)
 	hdmi_in0_hres = hres; hdmi_in0_vres = vres;
 
 	hdmi_in0_dma_frame_size_write(hres*vres*2);
+#ifdef CSR_HDMI_IN0_DMA_LINE_SIZE_ADDR
+	hdmi_in0_dma_line_size_write(hres*2);
+#endif
+	hdmi_in0_tiles_h_width_write(hres);
+	hdmi_in0_tiles_v_width_write(vres);
 	hdmi_in0_fb_slot_indexes[0] = 0;
 	hdmi_in0_dma_slot0_address_write(hdmi_in0_framebuffer_base(0));
 	hdmi_in0_dma_slot0_status_write(DVISAMPLER_SLOT_LOADED);
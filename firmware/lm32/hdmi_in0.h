@@ -5,6 +5,9 @@ extern int hdmi_in0_debug;
 extern int hdmi_in0_fb_index;
 
 unsigned int hdmi_in0_framebuffer_base(char n);
+unsigned int hdmi_in0_framebuffer_crc(char n);
+unsigned int hdmi_in0_framebuffer_line_crcs(char n);
+int hdmi_in0_dirty_rows(int *first, int *last);
 
 void hdmi_in0_isr(void);
 void hdmi_in0_init_video(int hres, int vres);
@@ -5,6 +5,9 @@ extern int hdmi_in1_debug;
 extern int hdmi_in1_fb_index;
 
 unsigned int hdmi_in1_framebuffer_base(char n);
+unsigned int hdmi_in1_framebuffer_crc(char n);
+unsigned int hdmi_in1_framebuffer_line_crcs(char n);
+int hdmi_in1_dirty_rows(int *first, int *last);
 
 void hdmi_in1_isr(void);
 void hdmi_in1_init_video(int hres, int vres);
@@ -67,3 +67,47 @@ void hdmi_out0_print_edid(void) {
 }
 
 #endif
+
+#ifdef HDMI_OUT0_INTERRUPT
+#include <stdio.h>
+#include <irq.h>
+#include <time.h>
+#include "hdmi_out0.h"
+
+static int hdmi_out0_underflow_pending;
+
+void hdmi_out0_isr(void)
+{
+	/* an underflow is raised at most once per service period */
+	hdmi_out0_ev_enable_write(0);
+	hdmi_out0_ev_pending_write(hdmi_out0_ev_pending_read());
+	hdmi_out0_underflow_pending = 1;
+}
+
+void hdmi_out0_underflow_init(void)
+{
+	unsigned int mask;
+
+	hdmi_out0_underflow_pending = 0;
+	hdmi_out0_ev_pending_write(hdmi_out0_ev_pending_read());
+	hdmi_out0_ev_enable_write(1);
+	mask = irq_getmask();
+	mask |= 1 << HDMI_OUT0_INTERRUPT;
+	irq_setmask(mask);
+}
+
+void hdmi_out0_service(void)
+{
+	static int last_event;
+
+	if(elapsed(&last_event, identifier_frequency_read())) {
+		if(hdmi_out0_underflow_pending) {
+			printf("hdmi_out0: underflow (total: %u)\r\n", hdmi_out0_underflows_read());
+			hdmi_out0_underflow_pending = 0;
+			hdmi_out0_ev_pending_write(hdmi_out0_ev_pending_read());
+			hdmi_out0_ev_enable_write(1);
+		}
+	}
+}
+
+#endif
@@ -4,4 +4,12 @@
 void hdmi_out0_i2c_init(void);
 void hdmi_out0_print_edid(void);
 
-#endif
\ No newline at end of file
+#endif
+
+#ifdef HDMI_OUT0_INTERRUPT
+
+void hdmi_out0_isr(void);
+void hdmi_out0_underflow_init(void);
+void hdmi_out0_service(void);
+
+#endif
@@ -4,4 +4,12 @@
 void hdmi_out1_i2c_init(void);
 void hdmi_out1_print_edid(void);
 
-#endif
\ No newline at end of file
+#endif
+
+#ifdef HDMI_OUT1_INTERRUPT
+
+void hdmi_out1_isr(void);
+void hdmi_out1_underflow_init(void);
+void hdmi_out1_service(void);
+
+#endif
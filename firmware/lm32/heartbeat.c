@@ -10,6 +10,7 @@
 #include "hdmi_in0.h"
 #include "hdmi_in1.h"
 #include "pattern.h"
+#include "encoder.h"
 
 static bool heartbeat_status = false;
 
@@ -58,7 +59,7 @@ void hb_fill(bool color_v, int sink)
 #endif
 #ifdef ENCODER_BASE
 	if (sink == VIDEO_OUT_ENCODER) {
-		framebuffer = (unsigned int *)(MAIN_RAM_BASE + encoder_reader_base_read());
+		framebuffer = (unsigned int *)(MAIN_RAM_BASE + encoder_reader_get_base());
 	}
 #endif
 	/*
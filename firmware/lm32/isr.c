@@ -4,6 +4,9 @@
 
 #include "hdmi_in0.h"
 #include "hdmi_in1.h"
+#include "hdmi_out0.h"
+#include "hdmi_out1.h"
+#include "encoder.h"
 
 void isr(void);
 void isr(void)
@@ -22,4 +25,20 @@ void isr(void)
 	if(irqs & (1 << HDMI_IN1_INTERRUPT))
 		hdmi_in1_isr();
 #endif
+#ifdef HDMI_OUT0_INTERRUPT
+	if(irqs & (1 << HDMI_OUT0_INTERRUPT))
+		hdmi_out0_isr();
+#endif
+#ifdef HDMI_OUT1_INTERRUPT
+	if(irqs & (1 << HDMI_OUT1_INTERRUPT))
+		hdmi_out1_isr();
+#endif
+#ifdef CSR_ENCODER_READER_BASE
+	if(irqs & (1 << ENCODER_READER_INTERRUPT))
+		encoder_reader_isr();
+#endif
+#ifdef CSR_ENCODER_READER1_BASE
+	if(irqs & (1 << ENCODER_READER1_INTERRUPT))
+		encoder_reader1_isr();
+#endif
 }
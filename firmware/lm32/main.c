@@ -48,6 +48,12 @@ int main(void)
 	processor_set_hdmi_out1_source(VIDEO_IN_PATTERN);
 #endif
 	processor_update();
+#ifdef HDMI_OUT0_INTERRUPT
+	hdmi_out0_underflow_init();
+#endif
+#ifdef HDMI_OUT1_INTERRUPT
+	hdmi_out1_underflow_init();
+#endif
 
 	// Reboot the FX2 chip into HDMI2USB mode
 #ifdef CSR_FX2_RESET_OUT_ADDR
@@ -64,6 +70,12 @@ int main(void)
 	while(1) {
 		processor_service();
 		ci_service();
+#ifdef HDMI_OUT0_INTERRUPT
+		hdmi_out0_service();
+#endif
+#ifdef HDMI_OUT1_INTERRUPT
+		hdmi_out1_service();
+#endif
 
 #ifdef CSR_FX2_RESET_OUT_ADDR
 		fx2_service(true);
@@ -7,11 +7,10 @@
 #include <system.h>
 #include <time.h>
 
+#include "framebuffer.h"
 #include "pattern.h"
 #include "processor.h"
 
-#define PATTERN_FRAMEBUFFER_BASE 0x03000000
-
 unsigned int pattern_framebuffer_base(void) {
 	return PATTERN_FRAMEBUFFER_BASE;
 }
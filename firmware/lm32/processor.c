@@ -492,14 +492,36 @@ void processor_set_hdmi_out1_source(int source) {
 	processor_hdmi_out1_source = source;
 }
 
-void processor_set_encoder_source(int source) {
+int processor_set_encoder_source(int source) {
+#ifdef ENCODER_BASE
+	if(!encoder_dual_enable(source == VIDEO_IN_HDMI_IN0_IN1))
+		return 0;
+#endif
 	processor_encoder_source = source;
+	return 1;
+}
+
+int processor_encoder_dirty_rows(int *first, int *last) {
+#ifdef CSR_HDMI_IN0_BASE
+	if(processor_encoder_source == VIDEO_IN_HDMI_IN0)
+		return hdmi_in0_dirty_rows(first, last);
+#endif
+#ifdef CSR_HDMI_IN1_BASE
+	if(processor_encoder_source == VIDEO_IN_HDMI_IN1)
+		return hdmi_in1_dirty_rows(first, last);
+#endif
+	/* pattern: whole frame */
+	*first = 0;
+	*last = (processor_v_active + 15)/16 - 1;
+	return 1;
 }
 
 char * processor_get_source_name(int source) {
 	memset(processor_buffer, 0, 16);
 	if(source == VIDEO_IN_PATTERN)
 		sprintf(processor_buffer, "pattern");
+	else if(source == VIDEO_IN_HDMI_IN0_IN1)
+		sprintf(processor_buffer, "input0+input1");
 	else
 		sprintf(processor_buffer, "input%d", source);
 	return processor_buffer;
@@ -543,16 +565,27 @@ void processor_update(void)
 	/*  encoder */
 #ifdef CSR_HDMI_IN0_BASE
 	if(processor_encoder_source == VIDEO_IN_HDMI_IN0) {
-		encoder_reader_base_write((hdmi_in0_framebuffer_base(hdmi_in0_fb_index)));
+		encoder_reader_set_base(hdmi_in0_framebuffer_base(hdmi_in0_fb_index));
+		encoder_set_frame_crc(hdmi_in0_framebuffer_crc(hdmi_in0_fb_index));
 	}
 #endif
 #ifdef CSR_HDMI_IN1_BASE
 	if(processor_encoder_source == VIDEO_IN_HDMI_IN1) {
-		encoder_reader_base_write((hdmi_in1_framebuffer_base(hdmi_in1_fb_index)));
+		encoder_reader_set_base(hdmi_in1_framebuffer_base(hdmi_in1_fb_index));
+		encoder_set_frame_crc(hdmi_in1_framebuffer_crc(hdmi_in1_fb_index));
+	}
+#endif
+	if(processor_encoder_source == VIDEO_IN_PATTERN) {
+		encoder_reader_set_base(pattern_framebuffer_base());
+		encoder_set_frame_crc(0);
+	}
+#if defined(CSR_HDMI_IN0_BASE) && defined(CSR_HDMI_IN1_BASE)
+	if(processor_encoder_source == VIDEO_IN_HDMI_IN0_IN1) {
+		encoder_reader_set_dual_bases(hdmi_in0_framebuffer_base(hdmi_in0_fb_index),
+			hdmi_in1_framebuffer_base(hdmi_in1_fb_index));
+		encoder_set_frame_crc(0);
 	}
 #endif
-	if(processor_encoder_source == VIDEO_IN_PATTERN)
-		encoder_reader_base_write(pattern_framebuffer_base());
 
 	hb_service(VIDEO_OUT_ENCODER);
 #endif
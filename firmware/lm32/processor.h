@@ -7,7 +7,8 @@
 enum {
 	VIDEO_IN_HDMI_IN0=0,
 	VIDEO_IN_HDMI_IN1,
-	VIDEO_IN_PATTERN
+	VIDEO_IN_PATTERN,
+	VIDEO_IN_HDMI_IN0_IN1	/* encoder only: alternate frames of both inputs */
 };
 
 enum {
@@ -30,7 +31,8 @@ void processor_init(void);
 void processor_start(int mode);
 void processor_set_hdmi_out0_source(int source);
 void processor_set_hdmi_out1_source(int source);
-void processor_set_encoder_source(int source);
+int processor_set_encoder_source(int source);
+int processor_encoder_dirty_rows(int *first, int *last);
 char * processor_get_source_name(int source);
 void processor_update(void);
 void processor_service(void);
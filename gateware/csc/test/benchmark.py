@@ -0,0 +1,327 @@
+"""Throughput and backpressure benchmark of streaming actors
+
+An actor is driven by a StreamDriver presenting items on a random fraction
+(stb duty cycle) of the cycles and drained by a StreamMonitor accepting them
+on a random fraction (ack duty cycle) of the cycles. For each pair of duty
+cycles we report:
+- the sustained input and output rates (items/cycle, after a warmup),
+- the latency distribution (cycles from the acceptance of an input item to
+  the acceptance of the corresponding output item, for actors with a fixed
+  input/output ratio),
+- the fractions of cycles the input is stalled, the output is blocked by
+  the monitor and the output is idle while the monitor is ready,
+- the stall propagation: fraction of the output backpressure bursts that
+  reach the input and median delay (cycles) before they do.
+
+Usage: python3 benchmark.py [actors] [--stb 100,50] [--ack 100,50] [--json]
+Results can be saved (--json) and used as a baseline (--baseline): rates
+dropping by more than --tolerance are reported as regressions.
+"""
+import argparse
+import json
+import random
+import sys
+
+from migen.fhdl.std import *
+from migen.sim.generic import run_simulation
+from migen.flow.actor import Sink, Source
+from migen.genlib.record import *
+
+from gateware.csc.test.common import randn
+
+
+def random_payload(description):
+    """Items with random values on all the payload fields"""
+    fields = [(name, width) for name, width in description.payload_layout]
+    while True:
+        yield {name: randn(2**width) for name, width in fields}
+
+
+class StreamDriver(Module):
+    def __init__(self, description, duty=100, payload=None, packet_length=64):
+        self.source = Source(description)
+        self.duty = duty
+        self.payload = random_payload(description) if payload is None else payload
+        self.packet_length = packet_length
+
+        # # #
+
+        self.cycle = 0
+        self.count = 0
+        self.accepted = []
+        self.stalled = []
+
+    def do_simulation(self, selfp):
+        stb = selfp.source.stb
+        ack = selfp.source.ack
+        self.stalled.append(bool(stb and not ack))
+        if stb and ack:
+            self.accepted.append(self.cycle)
+            self.count += 1
+        if not stb or ack:
+            if randn(100) < self.duty:
+                for name, value in next(self.payload).items():
+                    setattr(selfp.source, name, value)
+                if self.source.description.packetized:
+                    selfp.source.sop = (self.count % self.packet_length) == 0
+                    selfp.source.eop = (self.count % self.packet_length) == self.packet_length - 1
+                selfp.source.stb = 1
+            else:
+                selfp.source.stb = 0
+        self.cycle += 1
+
+
+class StreamMonitor(Module):
+    def __init__(self, description, duty=100):
+        self.sink = Sink(description)
+        self.duty = duty
+
+        # # #
+
+        self.cycle = 0
+        self.accepted = []
+        self.blocked = []
+        self.idle = []
+
+    def do_simulation(self, selfp):
+        stb = selfp.sink.stb
+        ack = selfp.sink.ack
+        self.blocked.append(bool(stb and not ack))
+        self.idle.append(bool(ack and not stb))
+        if stb and ack:
+            self.accepted.append(self.cycle)
+        selfp.sink.ack = randn(100) < self.duty
+        self.cycle += 1
+
+
+class TB(Module):
+    def __init__(self, actor, stb_duty, ack_duty, payload=None, packet_length=64):
+        self.submodules.actor = actor
+        self.submodules.driver = StreamDriver(actor.sink.description, stb_duty, payload, packet_length)
+        self.submodules.monitor = StreamMonitor(actor.source.description, ack_duty)
+        self.comb += [
+            Record.connect(self.driver.source, actor.sink),
+            Record.connect(actor.source, self.monitor.sink)
+        ]
+
+
+def _rate(accepted, start, stop):
+    return sum(start <= c < stop for c in accepted)/(stop - start)
+
+
+def _percentile(values, p):
+    return values[min(len(values) - 1, int(p*len(values)/100))]
+
+
+def _latency(accepted_in, accepted_out, ratio):
+    if ratio is None:
+        return None
+    n_in, n_out = ratio
+    latencies = []
+    for n, cycle in enumerate(accepted_out):
+        k = n*n_in//n_out
+        if k < len(accepted_in):
+            latencies.append(cycle - accepted_in[k])
+    if not latencies:
+        return None
+    latencies.sort()
+    return {
+        "min": latencies[0],
+        "mean": sum(latencies)/len(latencies),
+        "p50": _percentile(latencies, 50),
+        "p99": _percentile(latencies, 99),
+        "max": latencies[-1]
+    }
+
+
+def _propagation(blocked, stalled):
+    """(bursts reaching the input / bursts, median delay) of output backpressure"""
+    bursts = 0
+    delays = []
+    t = 0
+    while t < len(blocked):
+        if blocked[t]:
+            bursts += 1
+            start = t
+            propagated = False
+            while t < len(blocked) and blocked[t]:
+                if stalled[t] and not propagated:
+                    delays.append(t - start)
+                    propagated = True
+                t += 1
+        t += 1
+    if not bursts:
+        return 0., None
+    delays.sort()
+    return len(delays)/bursts, _percentile(delays, 50) if delays else None
+
+
+def benchmark(name, stb_duty=100, ack_duty=100, ncycles=4096, warmup=256, seed=0):
+    random.seed(seed)
+    actor, payload, packet_length, ratio = actors[name]()
+    tb = TB(actor, stb_duty, ack_duty, payload, packet_length)
+    run_simulation(tb, ncycles=ncycles)
+
+    driver, monitor = tb.driver, tb.monitor
+    cycles = len(driver.stalled)
+    window = slice(warmup, cycles)
+    stalled, blocked, idle = driver.stalled[window], monitor.blocked[window], monitor.idle[window]
+    propagated, delay = _propagation(blocked, stalled)
+    return {
+        "actor": name,
+        "stb_duty": stb_duty,
+        "ack_duty": ack_duty,
+        "cycles": cycles,
+        "in_rate": _rate(driver.accepted, warmup, cycles),
+        "out_rate": _rate(monitor.accepted, warmup, cycles),
+        "latency": _latency(driver.accepted, monitor.accepted, ratio),
+        "in_stalled": sum(stalled)/len(stalled),
+        "out_blocked": sum(blocked)/len(blocked),
+        "out_idle": sum(idle)/len(idle),
+        "propagated": propagated,
+        "propagation_delay": delay
+    }
+
+
+# actors: name -> () -> (actor, payload, packet length, (inputs, outputs) ratio)
+
+def _ymodulator():
+    from gateware.csc.ymodulator import YModulator
+    return YModulator(), None, 64, (1, 1)
+
+
+def _rgb2ycbcr():
+    from gateware.csc.rgb2ycbcr import RGB2YCbCr
+    return RGB2YCbCr(), None, 64, (1, 1)
+
+
+def _ycbcr2rgb():
+    from gateware.csc.ycbcr2rgb import YCbCr2RGB
+    return YCbCr2RGB(), None, 64, (1, 1)
+
+
+def _ycbcr444to422():
+    from gateware.csc.ycbcr444to422 import YCbCr444to422
+    return YCbCr444to422(), None, 64, (1, 1)
+
+
+def _ycbcr422to444():
+    from gateware.csc.ycbcr422to444 import YCbCr422to444
+    return YCbCr422to444(), None, 64, (1, 1)
+
+
+def _encoder_buffer():
+    from gateware.encoder.buffer import EncoderBuffer
+    # 8 lines of 8 pixels per block in, 64 pixels out
+    return EncoderBuffer(), None, 8, (1, 8)
+
+
+def _jpeg_bytes(scan_length=512):
+    """Bytes of minimal JFIF frames (random scan data)"""
+    header = [0xff, 0xd8]
+    header += [0xff, 0xdb, 0x00, 2 + 2*65]
+    for n in range(2):
+        header += [n] + [randn(256) & 0x7f for i in range(64)]
+    header += [0xff, 0xc0, 0x00, 17, 8, 0x00, 0x40, 0x00, 0x40, 3,
+               1, 0x21, 0, 2, 0x11, 1, 3, 0x11, 1]
+    header += [0xff, 0xda, 0x00, 12, 3, 1, 0x00, 2, 0x11, 3, 0x11, 0, 63, 0]
+    while True:
+        for data in header:
+            yield data, 0
+        for i in range(scan_length):
+            yield randn(255), 0
+        yield 0xff, 0
+        yield 0xd9, 1
+
+
+def _udp_streamer():
+    from gateware.streamer import UDPStreamer
+    def payload():
+        for data, eof in _jpeg_bytes():
+            yield {"data": data, "raw": 0, "eof": eof}
+    return RenameClockDomains(UDPStreamer(0xc0a8012a, 8000), {"encoder": "sys"}), payload(), 64, (1, 1)
+
+
+def _rtp_jpeg_sender():
+    from gateware.streamer.rtp import RTPJPEGSender
+    def payload():
+        for data, eof in _jpeg_bytes():
+            yield {"data": data}
+    # headers are stripped and added: no fixed ratio
+    return RenameClockDomains(RTPJPEGSender(0xc0a8012a, 8000, 100*1000000), {"encoder": "sys"}), payload(), 64, None
+
+
+actors = {
+    "rgb2ycbcr": _rgb2ycbcr,
+    "ycbcr2rgb": _ycbcr2rgb,
+    "ycbcr444to422": _ycbcr444to422,
+    "ycbcr422to444": _ycbcr422to444,
+    "ymodulator": _ymodulator,
+    "encoder_buffer": _encoder_buffer,
+    "udp_streamer": _udp_streamer,
+    "rtp_jpeg_sender": _rtp_jpeg_sender
+}
+
+
+def print_table(results):
+    print("{:<16} {:>4} {:>4} {:>8} {:>8} {:>7} {:>7} {:>7} {:>8} {:>8} {:>8} {:>11}".format(
+        "actor", "stb", "ack", "in/cyc", "out/cyc", "lat_min", "lat_p50", "lat_max",
+        "in_stall", "out_blk", "out_idle", "propagated"))
+    for r in results:
+        latency = r["latency"] or {}
+        delay = r["propagation_delay"]
+        print("{:<16} {:>4} {:>4} {:>8.3f} {:>8.3f} {:>7} {:>7} {:>7} {:>8.3f} {:>8.3f} {:>8.3f} {:>11}".format(
+            r["actor"], r["stb_duty"], r["ack_duty"], r["in_rate"], r["out_rate"],
+            latency.get("min", "-"), latency.get("p50", "-"), latency.get("max", "-"),
+            r["in_stalled"], r["out_blocked"], r["out_idle"],
+            "{:.2f}/{}".format(r["propagated"], "-" if delay is None else delay)))
+
+
+def regressions(results, baseline, tolerance):
+    """Results whose rates dropped by more than tolerance against the baseline"""
+    reference = {(r["actor"], r["stb_duty"], r["ack_duty"]): r for r in baseline}
+    found = []
+    for r in results:
+        b = reference.get((r["actor"], r["stb_duty"], r["ack_duty"]))
+        if b is None:
+            continue
+        for rate in ["in_rate", "out_rate"]:
+            if r[rate] < b[rate]*(1 - tolerance):
+                found.append((r["actor"], r["stb_duty"], r["ack_duty"], rate, b[rate], r[rate]))
+    return found
+
+
+def _get_args():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("actors", nargs="*", help="actors to benchmark ({})".format(", ".join(sorted(actors))))
+    parser.add_argument("--stb", default="100,75,50", help="stb duty cycles (%%)")
+    parser.add_argument("--ack", default="100,75,50", help="ack duty cycles (%%)")
+    parser.add_argument("--ncycles", default=4096, type=int, help="simulated cycles")
+    parser.add_argument("--warmup", default=256, type=int, help="cycles ignored for the rates")
+    parser.add_argument("--seed", default=0, type=int, help="random seed")
+    parser.add_argument("--json", default=None, help="write the results to a json file")
+    parser.add_argument("--baseline", default=None, help="json results to compare against")
+    parser.add_argument("--tolerance", default=0.02, type=float, help="allowed rate drop")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = _get_args()
+    names = args.actors if args.actors else sorted(actors)
+    results = []
+    for name in names:
+        for stb_duty in [int(d) for d in args.stb.split(",")]:
+            for ack_duty in [int(d) for d in args.ack.split(",")]:
+                results.append(benchmark(name, stb_duty, ack_duty, args.ncycles, args.warmup, args.seed))
+    print_table(results)
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for actor, stb_duty, ack_duty, rate, before, after in found:
+            print("regression: {} stb {} ack {}: {} {:.3f} -> {:.3f}".format(
+                actor, stb_duty, ack_duty, rate, before, after))
+        if found:
+            sys.exit(1)
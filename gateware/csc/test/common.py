@@ -1,4 +1,5 @@
 from PIL import Image
+import numpy as np
 
 import random
 import copy
@@ -160,6 +161,11 @@ class AckRandomizer(Module):
 
 
 class RAWImage:
+    """Image with RGB and YCbCr channels stored in numpy arrays
+
+    Channels are flat int arrays (raster order), data is the list of packed
+    24-bit pixels exchanged with the testbenches.
+    """
     def __init__(self, coefs, filename=None, size=None):
         self.r = None
         self.g = None
@@ -173,6 +179,8 @@ class RAWImage:
 
         self.coefs = coefs
         self.size = size
+        self.width = None
+        self.height = None
         self.length = None
 
         if filename is not None:
@@ -180,125 +188,105 @@ class RAWImage:
 
 
     def open(self, filename):
-        img = Image.open(filename)
+        img = Image.open(filename).convert("RGB")
         if self.size is not None:
-            img = img.resize((self.size, self.size), Image.ANTIALIAS)
-        r, g, b = zip(*list(img.getdata()))
-        self.set_rgb(r, g, b)
+            img = img.resize((self.size, self.size), Image.LANCZOS)
+        self.width, self.height = img.size
+        rgb = np.asarray(img, dtype=np.int64).reshape(-1, 3)
+        self.set_rgb(rgb[:, 0], rgb[:, 1], rgb[:, 2])
 
 
     def save(self, filename):
-        img = Image.new("RGB" ,(self.size, self.size))
-        img.putdata(list(zip(self.r, self.g, self.b)))
-        img.save(filename)
+        rgb = np.zeros((self.width*self.height, 3), dtype=np.int64)
+        n = min(self.length, self.width*self.height)
+        rgb[:n] = np.stack([self.r, self.g, self.b], axis=-1)[:n]
+        rgb = np.clip(rgb, 0, 255).astype(np.uint8).reshape(self.height, self.width, 3)
+        Image.fromarray(rgb, "RGB").save(filename)
 
 
     def set_rgb(self, r, g, b):
-        self.r = r
-        self.g = g
-        self.b = b
-        self.length = len(r)
+        self.r = np.asarray(r, dtype=np.int64)
+        self.g = np.asarray(g, dtype=np.int64)
+        self.b = np.asarray(b, dtype=np.int64)
+        self.length = len(self.r)
 
 
     def set_ycbcr(self, y, cb, cr):
-        self.y = y
-        self.cb = cb
-        self.cr = cr
-        self.length = len(y)
+        self.y = np.asarray(y, dtype=np.int64)
+        self.cb = np.asarray(cb, dtype=np.int64)
+        self.cr = np.asarray(cr, dtype=np.int64)
+        self.length = len(self.y)
 
 
     def set_data(self, data):
         self.data = data
 
 
+    @staticmethod
+    def _pack(c0, c1, c2):
+        return ((c0 & 0xff) << 16) | ((c1 & 0xff) << 8) | ((c2 & 0xff) << 0)
+
+
+    @staticmethod
+    def _unpack(data):
+        data = np.asarray(data, dtype=np.int64)
+        return (data >> 16) & 0xff, (data >> 8) & 0xff, (data >> 0) & 0xff
+
+
     def pack_rgb(self):
-        self.data = []
-        for i in range(self.length):
-            data = (self.r[i] & 0xff) << 16
-            data |= (self.g[i] & 0xff) << 8
-            data |= (self.b[i] & 0xff) << 0
-            self.data.append(data)
+        self.data = self._pack(self.r, self.g, self.b).tolist()
         return self.data
 
 
     def pack_ycbcr(self):
-        self.data = []
-        for i in range(self.length):
-            data = (self.y[i] & 0xff) << 16
-            data |= (self.cb[i] & 0xff) << 8
-            data |= (self.cr[i] & 0xff) << 0
-            self.data.append(data)
+        self.data = self._pack(self.y, self.cb, self.cr).tolist()
         return self.data
 
 
     def unpack_rgb(self):
-        self.r = []
-        self.g = []
-        self.b = []
-        for data in self.data:
-            self.r.append((data >> 16) & 0xff)
-            self.g.append((data >> 8) & 0xff)
-            self.b.append((data >> 0) & 0xff)
+        self.set_rgb(*self._unpack(self.data))
         return self.r, self.g, self.b
 
 
     def unpack_ycbcr(self):
-        self.y = []
-        self.cb = []
-        self.cr = []
-        for data in self.data:
-            self.y.append((data >> 16) & 0xff)
-            self.cb.append((data >> 8) & 0xff)
-            self.cr.append((data >> 0) & 0xff)
+        self.set_ycbcr(*self._unpack(self.data))
         return self.y, self.cb, self.cr
 
 
     # Model for our implementation
     def rgb2ycbcr_model(self):
-        self.y  = []
-        self.cb = []
-        self.cr = []
-        for r, g, b in zip(self.r, self.g, self.b):
-            yraw = self.coefs["ca"]*(r-g) + self.coefs["cb"]*(b-g) + g
-            self.y.append(int(yraw + self.coefs["yoffset"]))
-            self.cb.append(int(self.coefs["cc"]*(b-yraw) + self.coefs["coffset"]))
-            self.cr.append(int(self.coefs["cd"]*(r-yraw) + self.coefs["coffset"]))
+        r, g, b = self.r, self.g, self.b
+        yraw = self.coefs["ca"]*(r-g) + self.coefs["cb"]*(b-g) + g
+        self.set_ycbcr((yraw + self.coefs["yoffset"]).astype(np.int64),
+                       (self.coefs["cc"]*(b-yraw) + self.coefs["coffset"]).astype(np.int64),
+                       (self.coefs["cd"]*(r-yraw) + self.coefs["coffset"]).astype(np.int64))
         return self.y, self.cb, self.cr
 
 
     # Wikipedia implementation used as reference
     def rgb2ycbcr(self):
-        self.y = []
-        self.cb = []
-        self.cr = []
-        for r, g, b in zip(self.r, self.g, self.b):
-            self.y.append(int(0.299*r + 0.587*g + 0.114*b))
-            self.cb.append(int(-0.1687*r - 0.3313*g + 0.5*b + 128))
-            self.cr.append(int(0.5*r - 0.4187*g - 0.0813*b + 128))
+        r, g, b = self.r, self.g, self.b
+        self.set_ycbcr((0.299*r + 0.587*g + 0.114*b).astype(np.int64),
+                       (-0.1687*r - 0.3313*g + 0.5*b + 128).astype(np.int64),
+                       (0.5*r - 0.4187*g - 0.0813*b + 128).astype(np.int64))
         return self.y, self.cb, self.cr
 
 
     # Model for our implementation
     def ycbcr2rgb_model(self):
-        self.r = []
-        self.g = []
-        self.b = []
-        for y, cb, cr in zip(self.y, self.cb, self.cr):
-            self.r.append(int(y - self.coefs["yoffset"] + (cr - self.coefs["coffset"])*self.coefs["acoef"]))
-            self.g.append(int(y - self.coefs["yoffset"] + (cb - self.coefs["coffset"])*self.coefs["bcoef"] + (cr - self.coefs["coffset"])*self.coefs["ccoef"]))
-            self.b.append(int(y - self.coefs["yoffset"] + (cb - self.coefs["coffset"])*self.coefs["dcoef"]))
+        y = self.y - self.coefs["yoffset"]
+        cb = self.cb - self.coefs["coffset"]
+        cr = self.cr - self.coefs["coffset"]
+        self.set_rgb((y + cr*self.coefs["acoef"]).astype(np.int64),
+                     (y + cb*self.coefs["bcoef"] + cr*self.coefs["ccoef"]).astype(np.int64),
+                     (y + cb*self.coefs["dcoef"]).astype(np.int64))
         return self.r, self.g, self.b
 
 
     # Wikipedia implementation used as reference
     def ycbcr2rgb(self):
-        self.r = []
-        self.g = []
-        self.b = []
-        for y, cb, cr in zip(self.y, self.cb, self.cr):
-            self.r.append(int(y + (cr - 128) *  1.402))
-            self.g.append(int(y + (cb - 128) * -0.34414 + (cr - 128) * -0.71414))
-            self.b.append(int(y + (cb - 128) *  1.772))
+        y, cb, cr = self.y, self.cb - 128, self.cr - 128
+        self.set_rgb((y + cr*1.402).astype(np.int64),
+                     (y + cb*-0.34414 + cr*-0.71414).astype(np.int64),
+                     (y + cb*1.772).astype(np.int64))
         return self.r, self.g, self.b
-
-
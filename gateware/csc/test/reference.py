@@ -0,0 +1,160 @@
+"""Bit-exact models of the CSC datapaths
+
+Each model reproduces the fixed point arithmetic of the datapath: exact
+integer operations, truncation of each pipeline register to its width
+(wrap) and slices of the products (floor). Inputs are numpy arrays (any
+shape), the resampling models work on lines (last axis, even length).
+
+The slices of the products (x[n:]) are unsigned in the datapaths, but since
+the sums they feed are truncated to fewer bits, an arithmetic shift (x >> n)
+gives the same result and keeps the overflow reports meaningful.
+
+Run this file to sweep all the RGB and YCbCr inputs: intermediate overflows
+and the error against the floating point models are reported.
+"""
+import numpy as np
+
+from gateware.csc.rgb2ycbcr import rgb2ycbcr_coefs
+from gateware.csc.ycbcr2rgb import ycbcr2rgb_coefs
+
+
+def wrap(x, bits, signed=True):
+    """Value of x stored in a register of bits bits"""
+    x = np.asarray(x, dtype=np.int64) & (2**bits - 1)
+    if signed:
+        x = np.where(x >= 2**(bits-1), x - 2**bits, x)
+    return x
+
+
+def saturate(x, minimum, maximum):
+    return np.clip(x, minimum, maximum)
+
+
+def rgb2ycbcr(r, g, b, rgb_w=8, ycbcr_w=8, coef_w=8, overflows=None):
+    """RGB2YCbCrDatapath
+
+    When overflows is a dict, the number of values that do not fit in each
+    intermediate register is added to it.
+    """
+    coefs = rgb2ycbcr_coefs(ycbcr_w, coef_w)
+    r, g, b = [np.asarray(c, dtype=np.int64) for c in (r, g, b)]
+
+    def reg(name, x, bits, signed=True):
+        w = wrap(x, bits, signed)
+        if overflows is not None:
+            overflows[name] = overflows.get(name, 0) + int(np.count_nonzero(w != x))
+        return w
+
+    r_minus_g = reg("r_minus_g", r - g, rgb_w + 1)
+    b_minus_g = reg("b_minus_g", b - g, rgb_w + 1)
+    ca_mult_rg = reg("ca_mult_rg", r_minus_g*coefs["ca"], rgb_w + coef_w + 1)
+    cb_mult_bg = reg("cb_mult_bg", b_minus_g*coefs["cb"], rgb_w + coef_w + 1)
+    carg_plus_cbbg = reg("carg_plus_cbbg", ca_mult_rg + cb_mult_bg, rgb_w + coef_w + 9)
+    yraw = reg("yraw", (carg_plus_cbbg >> coef_w) + g, rgb_w + 3)
+    b_minus_yraw = reg("b_minus_yraw", b - yraw, rgb_w + 4)
+    r_minus_yraw = reg("r_minus_yraw", r - yraw, rgb_w + 4)
+    cc_mult_ryraw = reg("cc_mult_ryraw", b_minus_yraw*coefs["cc"], rgb_w + coef_w + 4)
+    cd_mult_byraw = reg("cd_mult_byraw", r_minus_yraw*coefs["cd"], rgb_w + coef_w + 4)
+    y = reg("y", yraw + coefs["yoffset"], rgb_w + 3)
+    cb = reg("cb", (cc_mult_ryraw >> coef_w) + coefs["coffset"], rgb_w + 4)
+    cr = reg("cr", (cd_mult_byraw >> coef_w) + coefs["coffset"], rgb_w + 4)
+    return (saturate(y, coefs["ymin"], coefs["ymax"]),
+            saturate(cb, coefs["cmin"], coefs["cmax"]),
+            saturate(cr, coefs["cmin"], coefs["cmax"]))
+
+
+def ycbcr2rgb(y, cb, cr, ycbcr_w=8, rgb_w=8, coef_w=8, overflows=None):
+    """YCbCr2RGBDatapath"""
+    coefs = ycbcr2rgb_coefs(rgb_w, coef_w)
+    y, cb, cr = [np.asarray(c, dtype=np.int64) for c in (y, cb, cr)]
+
+    def reg(name, x, bits, signed=True):
+        w = wrap(x, bits, signed)
+        if overflows is not None:
+            overflows[name] = overflows.get(name, 0) + int(np.count_nonzero(w != x))
+        return w
+
+    mult_w = ycbcr_w + coef_w + 4
+    cb_minus_coffset = reg("cb_minus_coffset", cb - coefs["coffset"], ycbcr_w + 1)
+    cr_minus_coffset = reg("cr_minus_coffset", cr - coefs["coffset"], ycbcr_w + 1)
+    y_minus_yoffset = reg("y_minus_yoffset", y - coefs["yoffset"], ycbcr_w + 1)
+    acoef = reg("cr_minus_coffset_mult_acoef", cr_minus_coffset*coefs["acoef"], mult_w)
+    bcoef = reg("cb_minus_coffset_mult_bcoef", cb_minus_coffset*coefs["bcoef"], mult_w)
+    ccoef = reg("cr_minus_coffset_mult_ccoef", cr_minus_coffset*coefs["ccoef"], mult_w)
+    dcoef = reg("cb_minus_coffset_mult_dcoef", cb_minus_coffset*coefs["dcoef"], mult_w)
+    r = reg("r", y_minus_yoffset + (acoef >> coef_w-2), ycbcr_w + 4)
+    g = reg("g", y_minus_yoffset + (bcoef >> coef_w-2) + (ccoef >> coef_w-2), ycbcr_w + 4)
+    b = reg("b", y_minus_yoffset + (dcoef >> coef_w-2), ycbcr_w + 4)
+    return (saturate(r, 0, 2**rgb_w-1),
+            saturate(g, 0, 2**rgb_w-1),
+            saturate(b, 0, 2**rgb_w-1))
+
+
+def ycbcr444to422(y, cb, cr):
+    """YCbCr444to422Datapath: mean (floor) of the chroma of each pair of pixels"""
+    y, cb, cr = [np.asarray(c, dtype=np.int64) for c in (y, cb, cr)]
+    cb_mean = (cb[..., 0::2] + cb[..., 1::2]) >> 1
+    cr_mean = (cr[..., 0::2] + cr[..., 1::2]) >> 1
+    cb_cr = np.empty_like(y)
+    cb_cr[..., 0::2] = cb_mean
+    cb_cr[..., 1::2] = cr_mean
+    return y, cb_cr
+
+
+def ycbcr422to444(y, cb_cr):
+    """YCbCr422to444Datapath: chroma of each pair of pixels repeated"""
+    y, cb_cr = [np.asarray(c, dtype=np.int64) for c in (y, cb_cr)]
+    cb = np.repeat(cb_cr[..., 0::2], 2, axis=-1)
+    cr = np.repeat(cb_cr[..., 1::2], 2, axis=-1)
+    return y, cb, cr
+
+
+def ymodulator(y, cb, cr, value, dw=8):
+    """YModulatorDatapath"""
+    y, cb, cr = [np.asarray(c, dtype=np.int64) for c in (y, cb, cr)]
+    y_modulated = wrap(y*value, 2*dw, False)
+    return saturate(y_modulated >> dw, 16, 235), cb, cr
+
+
+def _sweep():
+    import time
+
+    def report(name, overflows, error, elapsed):
+        print("{}: {:.2f}s, max error vs float model: {}".format(name, elapsed, error))
+        for register, n in sorted(overflows.items()):
+            if n:
+                print("  {}: {} overflows".format(register, n))
+
+    # all the 2**24 rgb values, by blocks of 2**16
+    start = time.time()
+    overflows = {}
+    error = 0
+    coefs = rgb2ycbcr_coefs(8)
+    gb = np.arange(2**16)
+    for r in range(256):
+        g, b = gb >> 8, gb & 0xff
+        y, cb, cr = rgb2ycbcr(np.full_like(gb, r), g, b, overflows=overflows)
+        yraw = coefs["ca"]*(r-g) + coefs["cb"]*(b-g) + g
+        for c, f in [(y, yraw + coefs["yoffset"]),
+                     (cb, coefs["cc"]*(b-yraw) + coefs["coffset"]),
+                     (cr, coefs["cd"]*(r-yraw) + coefs["coffset"])]:
+            error = max(error, int(np.max(np.abs(c - np.clip(f, 0, 255)))))
+    report("rgb2ycbcr", overflows, error, time.time() - start)
+
+    start = time.time()
+    overflows = {}
+    error = 0
+    coefs = ycbcr2rgb_coefs(8)
+    cbcr = np.arange(2**16)
+    for y in range(256):
+        cb, cr = cbcr >> 8, cbcr & 0xff
+        r, g, b = ycbcr2rgb(np.full_like(cbcr, y), cb, cr, overflows=overflows)
+        y0, cb0, cr0 = y - coefs["yoffset"], cb - coefs["coffset"], cr - coefs["coffset"]
+        for c, f in [(r, y0 + cr0*coefs["acoef"]),
+                     (g, y0 + cb0*coefs["bcoef"] + cr0*coefs["ccoef"]),
+                     (b, y0 + cb0*coefs["dcoef"])]:
+            error = max(error, int(np.max(np.abs(c - np.clip(f, 0, 255)))))
+    report("ycbcr2rgb", overflows, error, time.time() - start)
+
+if __name__ == "__main__":
+    _sweep()
@@ -6,6 +6,7 @@ from gateware.csc.common import *
 from gateware.csc.rgb2ycbcr import rgb2ycbcr_coefs, RGB2YCbCr
 
 from gateware.csc.test.common import *
+from gateware.csc.test import reference
 
 
 class TB(Module):
@@ -40,9 +41,13 @@ class TB(Module):
         # convert image using rgb2ycbcr implementation
         raw_image = RAWImage(rgb2ycbcr_coefs(8), "lena.png", 64)
         raw_image.pack_rgb()
+        reference_data = RAWImage._pack(*reference.rgb2ycbcr(*RAWImage._unpack(raw_image.data))).tolist()
         packet = Packet(raw_image.data)
         self.streamer.send(packet)
         yield from self.logger.receive()
+        shift, length, errors = check(reference_data, self.logger.packet)
+        print("bit-exact check: shift {}, length {}, errors {}".format(shift, length, errors))
+        assert errors == 0 and length == len(reference_data), "output differs from the reference model"
         raw_image.set_data(self.logger.packet)
         raw_image.unpack_ycbcr()
         raw_image.ycbcr2rgb()
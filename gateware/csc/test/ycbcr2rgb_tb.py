@@ -6,6 +6,7 @@ from gateware.csc.common import *
 from gateware.csc.ycbcr2rgb import ycbcr2rgb_coefs, YCbCr2RGB
 
 from gateware.csc.test.common import *
+from gateware.csc.test import reference
 
 class TB(Module):
     def __init__(self):
@@ -39,9 +40,13 @@ class TB(Module):
         raw_image = RAWImage(ycbcr2rgb_coefs(8), "lena.png", 64)
         raw_image.rgb2ycbcr()
         raw_image.pack_ycbcr()
+        reference_data = RAWImage._pack(*reference.ycbcr2rgb(*RAWImage._unpack(raw_image.data))).tolist()
         packet = Packet(raw_image.data)
         self.streamer.send(packet)
         yield from self.logger.receive()
+        shift, length, errors = check(reference_data, self.logger.packet)
+        print("bit-exact check: shift {}, length {}, errors {}".format(shift, length, errors))
+        assert errors == 0 and length == len(reference_data), "output differs from the reference model"
         raw_image.set_data(self.logger.packet)
         raw_image.unpack_rgb()
         raw_image.save("lena_ycbcr2rgb.png")
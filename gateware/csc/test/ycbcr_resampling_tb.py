@@ -7,6 +7,7 @@ from gateware.csc.ycbcr444to422 import YCbCr444to422
 from gateware.csc.ycbcr422to444 import YCbCr422to444
 
 from gateware.csc.test.common import *
+from gateware.csc.test import reference
 
 
 class TB(Module):
@@ -39,9 +40,14 @@ class TB(Module):
         raw_image = RAWImage(None, "lena.png", 64)
         raw_image.rgb2ycbcr()
         raw_image.pack_ycbcr()
+        y, cb_cr = reference.ycbcr444to422(*RAWImage._unpack(raw_image.data))
+        reference_data = RAWImage._pack(*reference.ycbcr422to444(y, cb_cr)).tolist()
         packet = Packet(raw_image.data)
         self.streamer.send(packet)
         yield from self.logger.receive()
+        shift, length, errors = check(reference_data, self.logger.packet)
+        print("bit-exact check: shift {}, length {}, errors {}".format(shift, length, errors))
+        assert errors == 0 and length == len(reference_data), "output differs from the reference model"
         raw_image.set_data(self.logger.packet)
         raw_image.unpack_ycbcr()
         raw_image.ycbcr2rgb()
@@ -7,11 +7,15 @@ from migen.bank.description import *
 from migen.flow.actor import *
 from migen.actorlib.fifo import SyncFIFO
 from migen.actorlib import structuring, spi
+from migen.genlib.cdc import MultiReg, PulseSynchronizer
+from migen.genlib.fsm import FSM, NextState
 from migen.bank.eventmanager import *
 
 from misoclib.mem.sdram.frontend import dma_lasmi
 
 from gateware.csc.ycbcr422to444 import YCbCr422to444
+from gateware.encoder.buffer import _gray_encode, _gray_decode
+from gateware.encoder.merger import EncoderMerger
 
 
 class EncoderBandwidth(Module, AutoCSR):
@@ -20,44 +24,172 @@ class EncoderBandwidth(Module, AutoCSR):
         self.nbytes_clear = CSR()
         self.nbytes = CSRStatus(32)
 
+        # free running count of output bytes (sys domain)
+        self.count = Signal(32)
+
         # # #
 
+        # count in the encoder clock domain, the counter only increments by
+        # one at a time: gray code it to cross clock domains
+        nbytes = Signal(32)
+        nbytes_gray = Signal(32)
+        self.sync.encoder += [
+            If(self.nbytes_inc,
+                nbytes.eq(nbytes + 1)
+            ),
+            nbytes_gray.eq(_gray_encode(nbytes))
+        ]
+        sys_nbytes_gray = Signal(32)
+        self.specials += MultiReg(nbytes_gray, sys_nbytes_gray)
+        self.comb += _gray_decode(sys_nbytes_gray, self.count)
+
         nbytes_clear = self.nbytes_clear.re & self.nbytes_clear.r
-        nbytes = self.nbytes.status
+        nbytes_offset = Signal(32)
+        self.sync += If(nbytes_clear, nbytes_offset.eq(self.count))
+        self.comb += self.nbytes.status.eq(self.count - nbytes_offset)
+
 
+# markers are minimal jpeg streams (SOI, COM tag + 16-bit argument, EOI):
+# - REPEAT: sent instead of a frame identical to the previous one
+# - UPDATE: sent before a frame only covering part of the image, the argument
+#           is the first line of the update
+marker_tags = ["REPEAT", "UPDATE"]
+marker_length = 16
+
+
+def _marker_bytes(tag, arg):
+    return [0xff, 0xd8, 0xff, 0xfe, 0x00, 0x0a] + [ord(c) for c in tag] + \
+           [arg[8:16], arg[0:8], 0xff, 0xd9]
+
+
+class MarkerInserter(Module):
+    def __init__(self):
+        self.sink = sink = Sink([("data", 8)])
+        self.source = source = Source([("data", 8)])
+        self.insert = Signal()
+        self.kind = Signal(max=len(marker_tags))
+        self.arg = Signal(16)
+        self.pending = Signal()
+        # the source carries a marker
+        self.marker = Signal()
+
+        # # #
+
+        # markers are only inserted between frames, once the frames already
+        # in the pipeline have been sent
+        last_ff = Signal()
+        in_frame = Signal()
         self.sync += \
-            If(nbytes_clear,
-                nbytes.eq(0)
-            ).Elif(self.nbytes_inc ,
-                nbytes.eq(nbytes + 1)
+            If(sink.stb & sink.ack,
+                last_ff.eq(sink.data == 0xff),
+                in_frame.eq(~(last_ff & (sink.data == 0xd9)))
+            )
+
+        kind = Signal(max=len(marker_tags))
+        arg = Signal(16)
+        done = Signal()
+        self.sync += \
+            If(self.insert,
+                self.pending.eq(1),
+                kind.eq(self.kind),
+                arg.eq(self.arg)
+            ).Elif(done,
+                self.pending.eq(0)
+            )
+
+        index_clr = Signal()
+        index_inc = Signal()
+        index = Signal(max=marker_length)
+        self.sync += \
+            If(index_clr,
+                index.eq(0)
+            ).Elif(index_inc,
+                index.eq(index + 1)
+            )
+        marker_data = Signal(8)
+        self.comb += Case(kind, {
+            n: Case(index, {i: marker_data.eq(v) for i, v in enumerate(_marker_bytes(tag, arg))})
+                for n, tag in enumerate(marker_tags)
+        })
+
+        self.submodules.fsm = fsm = FSM(reset_state="PASS")
+        fsm.act("PASS",
+            index_clr.eq(1),
+            If(self.pending & ~in_frame & ~sink.stb,
+                NextState("MARKER")
+            ).Else(
+                Record.connect(sink, source)
             )
+        )
+        fsm.act("MARKER",
+            self.marker.eq(1),
+            source.stb.eq(1),
+            source.data.eq(marker_data),
+            If(source.ack,
+                If(index == marker_length - 1,
+                    done.eq(1),
+                    NextState("PASS")
+                ).Else(
+                    index_inc.eq(1)
+                )
+            )
+        )
+
+
+# each core has its own 1KB register space
+core_window_bits = 8 # in 32-bit words
 
 
 class Encoder(Module, AutoCSR):
-    def __init__(self, platform):
-        self.sink = Sink(EndpointDescription([("data", 16)], packetized=True))
+    def __init__(self, platform, ncores=1, lasmims=None):
+        self.sinks = [Sink(EndpointDescription([("data", 16)], packetized=True)) for i in range(ncores)]
+        self.sink = self.sinks[0]
         self.source = Source([("data", 8)])
         self.bus = wishbone.Interface()
+        # a core has been started / end of an encoded image, markers
+        # excluded (encoder domain)
+        self.start = Signal()
+        self.eoi = Signal()
+
+        self._repeat = CSR()
+        self._update = CSR(16)
+        self._marker_pending = CSRStatus()
 
         # # #
 
-        # chroma upsampler
-        chroma_upsampler = RenameClockDomains(YCbCr422to444(), "encoder")
-        self.submodules += chroma_upsampler
-        self.comb += [
-            Record.connect(self.sink, chroma_upsampler.sink, leave_out=["data"]),
-            chroma_upsampler.sink.y.eq(self.sink.data[:8]),
-            chroma_upsampler.sink.cb_cr.eq(self.sink.data[8:])
+        # markers (sent in place of an unchanged frame or before a partial one)
+        self.submodules.marker_inserter = RenameClockDomains(MarkerInserter(), "encoder")
+        marker_kind = Signal(max=len(marker_tags))
+        marker_arg = Signal(16)
+        self.sync += [
+            If(self._repeat.re,
+                marker_kind.eq(marker_tags.index("REPEAT")),
+                marker_arg.eq(0)
+            ).Elif(self._update.re,
+                marker_kind.eq(marker_tags.index("UPDATE")),
+                marker_arg.eq(self._update.r)
+            )
         ]
-
-        # output fifo
-        output_fifo_almost_full = Signal()
-        output_fifo = RenameClockDomains(SyncFIFO([("data", 8)], 1024), "encoder")
-        self.submodules += output_fifo
+        # kind/arg are stable when the pulse reaches the encoder domain
+        marker_insert = PulseSynchronizer("sys", "encoder")
+        self.submodules += marker_insert
         self.comb += [
-            output_fifo_almost_full.eq(output_fifo.fifo.level > 1024-128),
-            Record.connect(output_fifo.source, self.source)
+            marker_insert.i.eq(self._repeat.re | self._update.re),
+            self.marker_inserter.insert.eq(marker_insert.o),
+            self.marker_inserter.kind.eq(marker_kind),
+            self.marker_inserter.arg.eq(marker_arg),
+            Record.connect(self.marker_inserter.source, self.source)
         ]
+        marker_pending = Signal()
+        self.specials += MultiReg(self.marker_inserter.pending, marker_pending)
+        marker_requested = Signal()
+        self.sync += \
+            If(self._repeat.re | self._update.re,
+                marker_requested.eq(1)
+            ).Elif(marker_pending,
+                marker_requested.eq(0)
+            )
+        self.comb += self._marker_pending.status.eq(marker_requested | marker_pending)
 
         # Wishbone cross domain crossing
         jpeg_bus = wishbone.Interface()
@@ -88,22 +220,105 @@ class Encoder(Module, AutoCSR):
                             i_wbs_rty_i=0,
                             o_wbs_cyc_o=jpeg_bus.cyc)
 
+        self.comb += self.start.eq(jpeg_bus.stb & jpeg_bus.cyc & jpeg_bus.we & jpeg_bus.ack &
+                                   (jpeg_bus.adr[:core_window_bits] == 0)) # start register
+
+        # cores
+        core_buses = []
+        core_sources = []
+        for i in range(ncores):
+            core_bus, core_source = self.add_core(self.sinks[i])
+            core_buses.append(core_bus)
+            core_sources.append(core_source)
+
+        if ncores == 1:
+            self.comb += [
+                jpeg_bus.connect(core_buses[0]),
+                Record.connect(core_sources[0], self.marker_inserter.sink)
+            ]
+        else:
+            # select core from address
+            core_sel = Signal(max=ncores)
+            self.comb += core_sel.eq(jpeg_bus.adr[core_window_bits:])
+            for n, core_bus in enumerate(core_buses):
+                self.comb += [
+                    core_bus.adr.eq(jpeg_bus.adr),
+                    core_bus.dat_w.eq(jpeg_bus.dat_w),
+                    core_bus.sel.eq(jpeg_bus.sel),
+                    core_bus.we.eq(jpeg_bus.we),
+                    core_bus.stb.eq(jpeg_bus.stb & (core_sel == n)),
+                    core_bus.cyc.eq(jpeg_bus.cyc & (core_sel == n))
+                ]
+            self.comb += [
+                jpeg_bus.dat_r.eq(Array(core_bus.dat_r for core_bus in core_buses)[core_sel]),
+                jpeg_bus.ack.eq(Array(core_bus.ack for core_bus in core_buses)[core_sel]),
+                jpeg_bus.err.eq(Array(core_bus.err for core_bus in core_buses)[core_sel])
+            ]
+
+            # cores encode alternate frames, merge their outputs in order
+            self.submodules.merger = EncoderMerger(lasmims[:-1], lasmims[-1])
+            for n, core_source in enumerate(core_sources):
+                self.comb += Record.connect(core_source, self.merger.sinks[n])
+            self.comb += Record.connect(self.merger.source, self.marker_inserter.sink)
+
+        # add vhdl sources
+        platform.add_source_dir(os.path.join(platform.soc_ext_path, "gateware", "encoder", "vhdl"))
+
+        # add verilog sources
+        platform.add_source(os.path.join(platform.soc_ext_path, "gateware", "encoder", "verilog", "wb_async_reg.v"))
+
+        # end of image marker (FF D9) of the encoded frames: the REPEAT and
+        # UPDATE markers are also jpeg streams but must not be seen as frames
+        # by the rate control
+        last_ff = Signal()
+        self.sync.encoder += \
+            If(self.source.stb & self.source.ack,
+                last_ff.eq(self.source.data == 0xff)
+            )
+        self.comb += self.eoi.eq(self.source.stb & self.source.ack & last_ff & (self.source.data == 0xd9) &
+                                 ~self.marker_inserter.marker)
+
+        # bandwidth
+        self.submodules.bandwidth = EncoderBandwidth()
+        self.comb += self.bandwidth.nbytes_inc.eq(self.source.stb & self.source.ack)
+
+    def add_core(self, sink):
+        bus = wishbone.Interface()
+        source = Source([("data", 8)])
+
+        # chroma upsampler
+        chroma_upsampler = RenameClockDomains(YCbCr422to444(), "encoder")
+        self.submodules += chroma_upsampler
+        self.comb += [
+            Record.connect(sink, chroma_upsampler.sink, leave_out=["data"]),
+            chroma_upsampler.sink.y.eq(sink.data[:8]),
+            chroma_upsampler.sink.cb_cr.eq(sink.data[8:])
+        ]
+
+        # output fifo
+        output_fifo_almost_full = Signal()
+        output_fifo = RenameClockDomains(SyncFIFO([("data", 8)], 1024), "encoder")
+        self.submodules += output_fifo
+        self.comb += [
+            output_fifo_almost_full.eq(output_fifo.fifo.level > 1024-128),
+            Record.connect(output_fifo.source, source)
+        ]
 
         # encoder
         self.specials += Instance("JpegEnc",
                             i_CLK=ClockSignal("encoder"),
                             i_RST=ResetSignal("encoder"),
 
-                            i_OPB_ABus=Cat(Signal(2), jpeg_bus.adr) & 0x3ff,
-                            i_OPB_BE=jpeg_bus.sel,
-                            i_OPB_DBus_in=jpeg_bus.dat_w,
-                            i_OPB_RNW=~jpeg_bus.we,
-                            i_OPB_select=jpeg_bus.stb & jpeg_bus.cyc,
-                            o_OPB_DBus_out=jpeg_bus.dat_r,
-                            o_OPB_XferAck=jpeg_bus.ack,
+                            i_OPB_ABus=Cat(Signal(2), bus.adr) & 0x3ff,
+                            i_OPB_BE=bus.sel,
+                            i_OPB_DBus_in=bus.dat_w,
+                            i_OPB_RNW=~bus.we,
+                            i_OPB_select=bus.stb & bus.cyc,
+                            o_OPB_DBus_out=bus.dat_r,
+                            o_OPB_XferAck=bus.ack,
                             #o_OPB_retry=,
                             #o_OPB_toutSup=,
-                            o_OPB_errAck=jpeg_bus.err,
+                            o_OPB_errAck=bus.err,
 
                             i_fdct_ack=chroma_upsampler.source.ack,
                             i_fdct_stb=chroma_upsampler.source.stb,
@@ -116,12 +331,5 @@ class Encoder(Module, AutoCSR):
                             #o_ram_wraddr=,
                             #o_frame_size=,
                             i_outif_almost_full=output_fifo_almost_full)
-        # add vhdl sources
-        platform.add_source_dir(os.path.join(platform.soc_ext_path, "gateware", "encoder", "vhdl"))
 
-        # add verilog sources
-        platform.add_source(os.path.join(platform.soc_ext_path, "gateware", "encoder", "verilog", "wb_async_reg.v"))
-
-        # bandwidth
-        self.submodules.bandwidth = EncoderBandwidth() # XXX add CDC
-        self.comb += self.bandwidth.nbytes_inc.eq(self.source.stb & self.source.ack)
+        return bus, source
@@ -2,33 +2,76 @@ from migen.fhdl.std import *
 from migen.genlib.record import *
 from migen.genlib.fsm import FSM, NextState
 from migen.genlib.misc import chooser
+from migen.genlib.cdc import MultiReg
+from migen.bank.description import *
 from migen.flow.actor import *
 
+
+def _gray_encode(b):
+    return b ^ (b >> 1)
+
+
+def _gray_decode(g, o):
+    return [o[i].eq(optree("^", [g[j] for j in range(i, flen(g))])) for i in range(flen(g))]
+
+
 class EncoderBuffer(Module):
-    def __init__(self):
+    """Ring of 8x8 blocks between the encoder reader and the jpeg core
+
+    Blocks are written one 8 pixels line per word and read one pixel per
+    word. The reader already outputs the blocks in the order the core
+    encodes them (reads in 8x8 blocks order, or reorders bands of 8 lines
+    in its own memory with line_prefetch), so the ring does not need to hold
+    an MCU row (160 blocks at 720p): it only rides through the sdram latency
+    (refresh, other masters). The targets use 64 blocks: 4096 encoder cycles
+    (one pixel per cycle) of reads, the encoder wait of the system
+    simulation (gateware/encoder/test/system_tb.py) tells if the reader
+    keeps up under a given memory load.
+    """
+    def __init__(self, nblocks=2):
         self.sink = sink = Sink(EndpointDescription([("data", 128)], packetized=True))
         self.source = source = Source(EndpointDescription([("data", 16)], packetized=True))
 
+        # number of 8x8 blocks stored in the ring
+        self.nblocks = nblocks
+        self.level = Signal(max=nblocks+1)
+        self.almost_full_level = Signal(max=nblocks+1, reset=nblocks)
+        self.almost_full = Signal()
+
         # # #
 
-        # mem
-        mem = Memory(128, 16)
+        # mem (ring of nblocks 8x8 blocks)
+        mem = Memory(128, 8*nblocks)
         write_port = mem.get_port(write_capable=True)
-        read_port = mem.get_port(async_read=True)
+        read_port = mem.get_port()
         self.specials += mem, write_port, read_port
 
-        write_sel = Signal()
-        write_swap = Signal()
-        read_sel = Signal(reset=1)
-        read_swap = Signal()
+        write_ptr = Signal(max=nblocks)
+        write_done = Signal()
+        read_ptr = Signal(max=nblocks)
+        read_done = Signal()
         self.sync += [
-            If(write_swap,
-                write_sel.eq(~write_sel)
+            If(write_done,
+                If(write_ptr == nblocks - 1,
+                    write_ptr.eq(0)
+                ).Else(
+                    write_ptr.eq(write_ptr + 1)
+                )
+            ),
+            If(read_done,
+                If(read_ptr == nblocks - 1,
+                    read_ptr.eq(0)
+                ).Else(
+                    read_ptr.eq(read_ptr + 1)
+                )
             ),
-            If(read_swap,
-                read_sel.eq(~read_sel)
+            If(write_done & ~read_done,
+                self.level.eq(self.level + 1)
+            ).Elif(read_done & ~write_done,
+                self.level.eq(self.level - 1)
             )
         ]
+        self.comb += self.almost_full.eq(self.level >= self.almost_full_level)
 
 
         # write path
@@ -43,8 +86,7 @@ class EncoderBuffer(Module):
             )
 
         self.comb += [
-            write_port.adr.eq(v_write),
-            write_port.adr[-1].eq(write_sel),
+            write_port.adr.eq(Cat(v_write, write_ptr)),
             write_port.dat_w.eq(sink.data),
             write_port.we.eq(sink.stb & sink.ack)
         ]
@@ -52,7 +94,7 @@ class EncoderBuffer(Module):
         self.submodules.write_fsm = write_fsm = FSM(reset_state="IDLE")
         write_fsm.act("IDLE",
             v_write_clr.eq(1),
-            If(write_sel != read_sel,
+            If(self.level != nblocks,
                 NextState("WRITE")
             )
         )
@@ -60,7 +102,7 @@ class EncoderBuffer(Module):
             sink.ack.eq(1),
             If(sink.stb,
                 If(v_write == 7,
-                    write_swap.eq(1),
+                    write_done.eq(1),
                     NextState("IDLE")
                 ).Else(
                     v_write_inc.eq(1)
@@ -82,6 +124,7 @@ class EncoderBuffer(Module):
         v_read_clr = Signal()
         v_read_inc = Signal()
         v_read = Signal(3)
+        v_read_next = Signal(3)
         self.sync += \
             If(v_read_clr,
                 v_read.eq(0)
@@ -89,9 +132,14 @@ class EncoderBuffer(Module):
                 v_read.eq(v_read + 1)
             )
 
+        # memory is read synchronously: present the address of the next line
         self.comb += [
-            read_port.adr.eq(v_read),
-            read_port.adr[-1].eq(read_sel),
+            If(v_read_clr,
+                v_read_next.eq(0)
+            ).Else(
+                v_read_next.eq(v_read + v_read_inc)
+            ),
+            read_port.adr.eq(Cat(v_read_next, read_ptr)),
             chooser(read_port.dat_r, h_read, source.data, reverse=True)
         ]
 
@@ -99,8 +147,7 @@ class EncoderBuffer(Module):
         read_fsm.act("IDLE",
             h_read_clr.eq(1),
             v_read_clr.eq(1),
-            If(read_sel == write_sel,
-                read_swap.eq(1),
+            If(self.level != 0,
                 NextState("READ")
             )
         )
@@ -112,6 +159,7 @@ class EncoderBuffer(Module):
                 If(h_read == 7,
                     h_read_clr.eq(1),
                     If(v_read == 7,
+                        read_done.eq(1),
                         NextState("IDLE")
                     ).Else(
                         v_read_inc.eq(1)
@@ -121,3 +169,36 @@ class EncoderBuffer(Module):
                 )
             )
         )
+
+
+class EncoderBufferStatus(Module, AutoCSR):
+    def __init__(self, buffer):
+        nbits = flen(buffer.level)
+        self.level = CSRStatus(nbits)
+        self.max_level = CSRStatus(nbits)
+        self.max_level_clear = CSR()
+        self.almost_full_level = CSRStorage(nbits, reset=buffer.nblocks)
+        self.almost_full = CSRStatus()
+
+        # # #
+
+        # level only changes by one block at a time: gray code it to cross
+        # clock domains
+        level_gray = Signal(nbits)
+        self.sync.encoder += level_gray.eq(_gray_encode(buffer.level))
+        sys_level_gray = Signal(nbits)
+        self.specials += MultiReg(level_gray, sys_level_gray)
+        self.comb += _gray_decode(sys_level_gray, self.level.status)
+
+        max_level_clear = self.max_level_clear.re & self.max_level_clear.r
+        self.sync += \
+            If(max_level_clear,
+                self.max_level.status.eq(0)
+            ).Elif(self.level.status > self.max_level.status,
+                self.max_level.status.eq(self.level.status)
+            )
+
+        self.specials += [
+            MultiReg(self.almost_full_level.storage, buffer.almost_full_level, "encoder"),
+            MultiReg(buffer.almost_full, self.almost_full.status)
+        ]
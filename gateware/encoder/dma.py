@@ -10,38 +10,254 @@ from migen.actorlib import structuring, spi
 
 from misoclib.mem.sdram.frontend import dma_lasmi
 
+from gateware.hdmi_in.dma import _SlotArray
 
-class EncoderDMAReader(Module, AutoCSR):
-    def __init__(self, lasmim):
+
+class _MCUReorderBuffer(Module):
+    """Reorder bands of 8 lines in 8x8 blocks order
+
+    Lines are written in raster order (8 pixels per word) in one of the two
+    bands of the buffer while the other one is read in 8x8 blocks order
+    (8 words per block, one for each line of the block).
+    """
+    def __init__(self, max_h_width):
+        self.sink = sink = Sink([("data", 128)])
+        self.source = source = Source([("data", 128)])
+        self.h_width = Signal(16)
+        self.band_done = Signal()
+
+        # # #
+
+        # 8 lines of h_width pixels fit in h_width words of 8 pixels
+        band_words = max_h_width
+        mem = Memory(128, 2*band_words)
+        write_port = mem.get_port(write_capable=True)
+        read_port = mem.get_port(has_re=True)
+        self.specials += mem, write_port, read_port
+
+        h_words = Signal(16)
+        self.comb += h_words.eq(self.h_width[3:])
+
+        band_written = Signal()
+        bands_ready = Signal(max=3)
+        self.sync += \
+            If(band_written & ~self.band_done,
+                bands_ready.eq(bands_ready + 1)
+            ).Elif(self.band_done & ~band_written,
+                bands_ready.eq(bands_ready - 1)
+            )
+
+        # write path
+        write_sel = Signal()
+        write_offset = Signal(max=band_words)
+        self.comb += [
+            sink.ack.eq(1),
+            write_port.adr.eq(write_offset + Mux(write_sel, band_words, 0)),
+            write_port.dat_w.eq(sink.data),
+            write_port.we.eq(sink.stb)
+        ]
+        self.sync += \
+            If(sink.stb,
+                If(write_offset == self.h_width - 1,
+                    write_offset.eq(0),
+                    write_sel.eq(~write_sel)
+                ).Else(
+                    write_offset.eq(write_offset + 1)
+                )
+            )
+        self.comb += band_written.eq(sink.stb & (write_offset == self.h_width - 1))
+
+        # read path
+        read_sel = Signal()
+        read_issue = Signal()
+        read_advance = Signal()
+        self.comb += [
+            read_port.re.eq(~source.stb | source.ack),
+            read_advance.eq(read_issue & read_port.re),
+            source.data.eq(read_port.dat_r)
+        ]
+        self.sync += If(read_port.re, source.stb.eq(read_issue))
+
+        h_read_clr = Signal()
+        h_read_inc = Signal()
+        h_read = Signal(16)
+        self.sync += \
+            If(h_read_clr,
+                h_read.eq(0)
+            ).Elif(h_read_inc,
+                h_read.eq(h_read + 1)
+            )
+
+        v_read_clr = Signal()
+        v_read_inc = Signal()
+        v_read = Signal(3)
+        self.sync += \
+            If(v_read_clr,
+                v_read.eq(0)
+            ).Elif(v_read_inc,
+                v_read.eq(v_read + 1)
+            )
+
+        # offset of the current line in the band (avoids a multiplier)
+        line_offset = Signal(max=band_words)
+        self.sync += \
+            If(v_read_clr,
+                line_offset.eq(0)
+            ).Elif(v_read_inc,
+                line_offset.eq(line_offset + h_words)
+            )
+
+        self.comb += read_port.adr.eq(line_offset + h_read + Mux(read_sel, band_words, 0))
+
+        self.submodules.read_fsm = read_fsm = FSM(reset_state="IDLE")
+        read_fsm.act("IDLE",
+            h_read_clr.eq(1),
+            v_read_clr.eq(1),
+            If(bands_ready != 0,
+                NextState("READ")
+            )
+        )
+        read_fsm.act("READ",
+            read_issue.eq(1),
+            If(read_advance,
+                If(v_read == 7,
+                    v_read_clr.eq(1),
+                    If(h_read == h_words - 1,
+                        self.band_done.eq(1),
+                        NextState("IDLE")
+                    ).Else(
+                        h_read_inc.eq(1)
+                    )
+                ).Else(
+                    v_read_inc.eq(1)
+                )
+            )
+        )
+        self.sync += If(self.band_done, read_sel.eq(~read_sel))
+
+
+class EncoderDMAReader(Module):
+    def __init__(self, lasmim, nslots=2, line_prefetch=False, max_h_width=1920):
         self.source = source = Source(EndpointDescription([("data", 128)]))
-        self.base = CSRStorage(32)
         self.h_width = CSRStorage(16)
         self.v_width = CSRStorage(16)
-        self.start = CSR()
-        self.done = CSRStatus()
+        # read frames in raster order (uncompressed streaming)
+        self.raster = Signal()
+        # bytes of the frame being read
+        self.frame_size = Signal(32)
+        # no frame being read and no data in flight, frames started in
+        # block order (to be encoded)
+        self.idle = CSRStatus()
+        self.block_frames = CSRStatus(32)
 
-        # # #
-
-        pixel_bits = 16 # ycbcr 4:2:2
-        burst_pixels = lasmim.dw//pixel_bits
         alignment_bits = bits_for(lasmim.dw//8) - 1
 
+        # frames to read are queued in slots, a slot is released (and an
+        # event raised) once the whole frame has been requested from sdram
+        self.submodules._slot_array = _SlotArray(nslots, lasmim.aw, alignment_bits)
+        self.ev = self._slot_array.ev
+
+        # # #
+
         self.submodules.reader = reader = dma_lasmi.Reader(lasmim)
         self.submodules.converter = structuring.Converter(EndpointDescription([("data", lasmim.dw)]),
                                                           EndpointDescription([("data", 128)]),
                                                           reverse=True)
         self.comb += [
             Record.connect(reader.data, self.converter.sink, leave_out=set(["d"])),
-            self.converter.sink.data.eq(reader.data.d),
-            Record.connect(self.converter.source, source)
+            self.converter.sink.data.eq(reader.data.d)
         ]
 
-        base = Signal(32)
-        h_width = self.h_width.storage
-        v_width = self.v_width.storage
-        start = self.start.r & self.start.re
-        done = self.done.status
-        self.sync += If(start, base.eq(self.base.storage))
+        # latch frame parameters at the start of each frame so that they can
+        # be updated by the cpu at any time
+        base = Signal(lasmim.aw)
+        h_width = Signal(16)
+        v_width = Signal(16)
+        raster = Signal()
+        start = Signal()
+        self.sync += \
+            If(start,
+                base.eq(self._slot_array.address),
+                h_width.eq(self.h_width.storage),
+                v_width.eq(self.v_width.storage),
+                raster.eq(self.raster),
+                self.frame_size.eq(self.h_width.storage*self.v_width.storage*2)
+            )
+
+        self.submodules.fsm = fsm = FSM(reset_state="IDLE")
+        if line_prefetch:
+            self._line_prefetch(lasmim, fsm, base, h_width, v_width, raster, start, max_h_width)
+        else:
+            self.comb += Record.connect(self.converter.source, source)
+            self._block_read(lasmim, fsm, base, h_width, v_width, start)
+        self._raster_read(lasmim, fsm, base, h_width, v_width)
+        fsm.act("EOF",
+            If(~reader.busy,
+                self._slot_array.address_done.eq(1),
+                NextState("IDLE")
+            )
+        )
+
+        fsm_idle = Signal()
+        fsm.act("IDLE", fsm_idle.eq(1))
+        self.comb += self.idle.status.eq(fsm_idle & ~reader.busy & ~reader.data.stb &
+                                         ~self.converter.source.stb)
+        self.sync += \
+            If(start & ~self.raster,
+                self.block_frames.status.eq(self.block_frames.status + 1)
+            )
+
+        # report the address following the last requested word
+        address_reached = Signal(lasmim.aw)
+        self.sync += \
+            If(reader.address.stb & reader.address.ack,
+                address_reached.eq(reader.address.a + 1)
+            )
+        self.comb += self._slot_array.address_reached.eq(address_reached)
+
+    def _raster_read(self, lasmim, fsm, base, h_width, v_width):
+        # read the frame linearly
+        reader = self.reader
+        pixel_bits = 16 # ycbcr 4:2:2
+        burst_pixels = lasmim.dw//pixel_bits
+
+        frame_words = Signal(lasmim.aw)
+        self.comb += frame_words.eq((h_width*v_width)[log2_int(burst_pixels):])
+
+        word_clr = Signal()
+        word_inc = Signal()
+        word = Signal(lasmim.aw)
+        self.sync += \
+            If(word_clr,
+                word.eq(0)
+            ).Elif(word_inc,
+                word.eq(word + 1)
+            )
+
+        fsm.act("RASTER_START",
+            word_clr.eq(1),
+            NextState("RASTER")
+        )
+        raster_read = Signal()
+        fsm.act("RASTER",
+            raster_read.eq(1),
+            reader.address.stb.eq(1),
+            If(reader.address.ack,
+                word_inc.eq(1),
+                If(word == frame_words - 1,
+                    NextState("EOF")
+                )
+            )
+        )
+        # overrides the address of the other read orders
+        self.comb += If(raster_read, reader.address.a.eq(base + word))
+
+    def _block_read(self, lasmim, fsm, base, h_width, v_width, start):
+        # read the frame in 8x8 blocks order, one short burst per block line
+        reader = self.reader
+        pixel_bits = 16 # ycbcr 4:2:2
+        burst_pixels = lasmim.dw//pixel_bits
+        alignment_bits = bits_for(lasmim.dw//8) - 1
 
         h_clr = Signal()
         h_clr_lsb = Signal()
@@ -72,14 +288,16 @@ class EncoderDMAReader(Module, AutoCSR):
                 v.eq(v - 7)
             )
 
-        self.submodules.fsm = fsm = FSM(reset_state="IDLE")
         fsm.act("IDLE",
             h_clr.eq(1),
             v_clr.eq(1),
-            If(start,
-                NextState("READ")
-            ).Else(
-                done.eq(1)
+            If(self._slot_array.address_valid,
+                start.eq(1),
+                If(self.raster,
+                    NextState("RASTER_START")
+                ).Else(
+                    NextState("READ")
+                )
             )
         )
         fsm.act("READ",
@@ -95,7 +313,7 @@ class EncoderDMAReader(Module, AutoCSR):
                             v_inc.eq(1),
                             # last line
                             If(v >= v_width - 1,
-                                NextState("IDLE")
+                                NextState("EOF")
                             )
                         ).Else(
                             h_inc.eq(1),
@@ -114,6 +332,105 @@ class EncoderDMAReader(Module, AutoCSR):
         read_address = Signal(lasmim.aw + alignment_bits)
         self.comb += [
             read_address.eq(v * h_width + h),
-            reader.address.a.eq(base[alignment_bits:] +
-            	                read_address[alignment_bits - log2_int(pixel_bits//8):])
+            reader.address.a.eq(base + read_address[alignment_bits - log2_int(pixel_bits//8):])
+        ]
+
+    def _line_prefetch(self, lasmim, fsm, base, h_width, v_width, raster, start, max_h_width):
+        # read the frame linearly in bands of 8 lines (long sequential bursts)
+        # and reorder the bands in 8x8 blocks order in on-chip memory
+        reader = self.reader
+
+        self.submodules.reorder = reorder = _MCUReorderBuffer(max_h_width)
+        self.comb += [
+            reorder.h_width.eq(h_width),
+            If(raster,
+                Record.connect(self.converter.source, self.source)
+            ).Else(
+                Record.connect(self.converter.source, reorder.sink),
+                Record.connect(reorder.source, self.source)
+            )
         ]
+
+        # sdram words in a band of 8 lines
+        band_words = Signal(lasmim.aw)
+        if lasmim.dw <= 128:
+            self.comb += band_words.eq(h_width*(128//lasmim.dw))
+        else:
+            self.comb += band_words.eq(h_width[log2_int(lasmim.dw//128):])
+
+        # a band can only be requested when a band of the reorder buffer is free
+        credit_take = Signal()
+        credits = Signal(max=3, reset=2)
+        self.sync += \
+            If(credit_take & ~reorder.band_done,
+                credits.eq(credits - 1)
+            ).Elif(reorder.band_done & ~credit_take,
+                credits.eq(credits + 1)
+            )
+
+        word_clr = Signal()
+        word_inc = Signal()
+        word = Signal(lasmim.aw)
+        band_word = Signal(lasmim.aw)
+        self.sync += \
+            If(word_clr,
+                word.eq(0)
+            ).Elif(word_inc,
+                word.eq(word + 1)
+            )
+
+        band_clr = Signal()
+        band_inc = Signal()
+        band = Signal(13)
+        self.sync += [
+            If(band_clr | credit_take,
+                band_word.eq(0)
+            ).Elif(word_inc,
+                band_word.eq(band_word + 1)
+            ),
+            If(band_clr,
+                band.eq(0)
+            ).Elif(band_inc,
+                band.eq(band + 1)
+            )
+        ]
+
+        fsm.act("IDLE",
+            word_clr.eq(1),
+            band_clr.eq(1),
+            If(self._slot_array.address_valid,
+                start.eq(1),
+                If(self.raster,
+                    NextState("RASTER_START")
+                ).Else(
+                    NextState("WAIT_BAND")
+                )
+            )
+        )
+        fsm.act("WAIT_BAND",
+            If(credits != 0,
+                credit_take.eq(1),
+                NextState("READ")
+            )
+        )
+        fsm.act("READ",
+            reader.address.stb.eq(1),
+            If(reader.address.ack,
+                word_inc.eq(1),
+                # last word of the band
+                If(band_word == band_words - 1,
+                    band_inc.eq(1),
+                    # last band of the frame
+                    If(band == v_width[3:] - 1,
+                        NextState("EOF")
+                    ).Else(
+                        NextState("WAIT_BAND")
+                    )
+                )
+            )
+        )
+
+        self.comb += reader.address.a.eq(base + word)
+
+    def get_csrs(self):
+        return [self.h_width, self.v_width, self.idle, self.block_frames] + self._slot_array.get_csrs()
@@ -0,0 +1,253 @@
+from migen.fhdl.std import *
+from migen.genlib.record import *
+from migen.genlib.fsm import FSM, NextState
+from migen.bank.description import *
+from migen.flow.actor import *
+from migen.actorlib.fifo import SyncFIFO, AsyncFIFO
+
+from misoclib.mem.sdram.frontend import dma_lasmi
+
+
+class _FrameStager(Module, AutoCSR):
+    """Store the JPEG frames produced by a core in a SDRAM ring
+
+    Frames are delimited on EOI markers and padded to a memory word, the
+    length (in bytes) of each stored frame is queued on self.length.
+    """
+    def __init__(self, lasmim, max_frames):
+        self.sink = sink = Sink([("data", 8)])
+        self.length = Source([("bytes", 32)])
+        self.read_address = Signal(lasmim.aw)
+        self.read_inc = Signal()
+        self.release = Signal()
+
+        alignment_bits = bits_for(lasmim.dw//8) - 1
+        self._base = CSRStorage(lasmim.aw + alignment_bits, alignment_bits=alignment_bits)
+        self._size = CSRStorage(lasmim.aw + alignment_bits, alignment_bits=alignment_bits)
+
+        ###
+
+        nbytes = lasmim.dw//8
+        base = self._base.storage
+        size = self._size.storage
+
+        self.submodules.writer = writer = dma_lasmi.Writer(lasmim)
+        self.submodules.length_fifo = length_fifo = SyncFIFO([("bytes", 32)], max_frames)
+        self.comb += Record.connect(length_fifo.source, self.length)
+
+        # ring pointers (in memory words)
+        write_ptr = Signal(lasmim.aw)
+        write_inc = Signal()
+        read_ptr = Signal(lasmim.aw)
+        level = Signal(lasmim.aw + 1)
+        self.sync += [
+            If(write_inc,
+                If(write_ptr == size - 1,
+                    write_ptr.eq(0)
+                ).Else(
+                    write_ptr.eq(write_ptr + 1)
+                )
+            ),
+            If(self.read_inc,
+                If(read_ptr == size - 1,
+                    read_ptr.eq(0)
+                ).Else(
+                    read_ptr.eq(read_ptr + 1)
+                )
+            ),
+            If(write_inc & ~self.release,
+                level.eq(level + 1)
+            ).Elif(self.release & ~write_inc,
+                level.eq(level - 1)
+            )
+        ]
+        self.comb += [
+            writer.address_data.a.eq(base + write_ptr),
+            self.read_address.eq(base + read_ptr)
+        ]
+
+        # pack bytes in memory words
+        word = Signal(lasmim.dw)
+        byte_sel = Signal(max=nbytes)
+        byte_sel_clr = Signal()
+        byte_ce = Signal()
+        self.sync += \
+            If(byte_sel_clr,
+                byte_sel.eq(0)
+            ).Elif(byte_ce,
+                byte_sel.eq(byte_sel + 1),
+                [If(byte_sel == i, word[8*i:8*(i+1)].eq(sink.data)) for i in range(nbytes)]
+            )
+        self.comb += writer.address_data.d.eq(word)
+
+        # frame delimitation
+        last_ff = Signal()
+        eoi = Signal()
+        eoi_pending = Signal()
+        frame_bytes = Signal(32)
+        frame_bytes_clr = Signal()
+        self.comb += eoi.eq(last_ff & (sink.data == 0xd9))
+        self.sync += [
+            If(byte_ce,
+                last_ff.eq(sink.data == 0xff),
+                eoi_pending.eq(eoi)
+            ),
+            If(frame_bytes_clr,
+                frame_bytes.eq(0)
+            ).Elif(byte_ce,
+                frame_bytes.eq(frame_bytes + 1)
+            )
+        ]
+        self.comb += length_fifo.sink.bytes.eq(frame_bytes)
+
+        self.submodules.fsm = fsm = FSM(reset_state="FILL")
+        fsm.act("FILL",
+            sink.ack.eq(1),
+            If(sink.stb,
+                byte_ce.eq(1),
+                If((byte_sel == nbytes - 1) | eoi,
+                    NextState("WRITE")
+                )
+            )
+        )
+        fsm.act("WRITE",
+            If(level != size,
+                writer.address_data.stb.eq(1),
+                If(writer.address_data.ack,
+                    write_inc.eq(1),
+                    byte_sel_clr.eq(1),
+                    If(eoi_pending,
+                        NextState("LENGTH")
+                    ).Else(
+                        NextState("FILL")
+                    )
+                )
+            )
+        )
+        fsm.act("LENGTH",
+            length_fifo.sink.stb.eq(1),
+            If(length_fifo.sink.ack,
+                frame_bytes_clr.eq(1),
+                NextState("FILL")
+            )
+        )
+
+
+class EncoderMerger(Module, AutoCSR):
+    """Merge the outputs of several JPEG cores
+
+    Cores encode alternate frames, each core stores its frames in its own
+    SDRAM ring so that it never waits on the others. Frames are then read
+    back from the rings in the order they have been dispatched to the cores
+    (round robin).
+    """
+    def __init__(self, lasmims_write, lasmim_read, max_frames=8):
+        ncores = len(lasmims_write)
+        self.sinks = [Sink([("data", 8)]) for i in range(ncores)]
+        self.source = source = Source([("data", 8)])
+
+        # # #
+
+        nbytes = lasmim_read.dw//8
+
+        stagers = []
+        for i, lasmim in enumerate(lasmims_write):
+            cdc = RenameClockDomains(AsyncFIFO([("data", 8)], 16),
+                                     {"write": "encoder", "read": "sys"})
+            stager = _FrameStager(lasmim, max_frames)
+            setattr(self.submodules, "cdc" + str(i), cdc)
+            setattr(self.submodules, "stager" + str(i), stager)
+            self.comb += [
+                Record.connect(self.sinks[i], cdc.sink),
+                Record.connect(cdc.source, stager.sink)
+            ]
+            stagers.append(stager)
+
+        self.submodules.reader = reader = dma_lasmi.Reader(lasmim_read)
+        self.submodules.output_cdc = output_cdc = RenameClockDomains(AsyncFIFO([("data", 8)], 16),
+                                          {"write": "sys", "read": "encoder"})
+        self.comb += Record.connect(output_cdc.source, source)
+
+        # current core
+        core = Signal(max=ncores)
+        core_next = Signal()
+        self.sync += \
+            If(core_next,
+                If(core == ncores - 1,
+                    core.eq(0)
+                ).Else(
+                    core.eq(core + 1)
+                )
+            )
+
+        length_stb = Array(stager.length.stb for stager in stagers)[core]
+        length = Array(stager.length.bytes for stager in stagers)[core]
+        length_ack = Signal()
+        read_inc = Signal()
+        release = Signal()
+        for n, stager in enumerate(stagers):
+            self.comb += [
+                stager.length.ack.eq(length_ack & (core == n)),
+                stager.read_inc.eq(read_inc & (core == n)),
+                stager.release.eq(release & (core == n))
+            ]
+
+        # requests
+        words_remaining = Signal(32)
+        bytes_remaining = Signal(32)
+        load = Signal()
+        self.sync += [
+            If(load,
+                words_remaining.eq((length + nbytes - 1)[log2_int(nbytes):])
+            ).Elif(read_inc,
+                words_remaining.eq(words_remaining - 1)
+            )
+        ]
+        self.comb += reader.address.a.eq(Array(stager.read_address for stager in stagers)[core])
+
+        self.submodules.fsm = fsm = FSM(reset_state="IDLE")
+        fsm.act("IDLE",
+            If(length_stb,
+                load.eq(1),
+                NextState("READ")
+            )
+        )
+        fsm.act("READ",
+            reader.address.stb.eq(1),
+            If(reader.address.ack,
+                read_inc.eq(1),
+                If(words_remaining == 1,
+                    NextState("DRAIN")
+                )
+            )
+        )
+        fsm.act("DRAIN",
+            If(bytes_remaining == 0,
+                length_ack.eq(1),
+                core_next.eq(1),
+                NextState("IDLE")
+            )
+        )
+
+        # unpack memory words in bytes, padding of the last word is dropped
+        byte_sel = Signal(max=nbytes)
+        last_byte = Signal()
+        self.comb += [
+            last_byte.eq((byte_sel == nbytes - 1) | (bytes_remaining == 1)),
+            output_cdc.sink.stb.eq(reader.data.stb & (bytes_remaining != 0)),
+            output_cdc.sink.data.eq(Array(reader.data.d[8*i:8*(i+1)] for i in range(nbytes))[byte_sel]),
+            reader.data.ack.eq(output_cdc.sink.ack & output_cdc.sink.stb & last_byte),
+            release.eq(reader.data.stb & reader.data.ack)
+        ]
+        self.sync += [
+            If(load,
+                bytes_remaining.eq(length)
+            ).Elif(output_cdc.sink.stb & output_cdc.sink.ack,
+                bytes_remaining.eq(bytes_remaining - 1)
+            ),
+            If(reader.data.stb & reader.data.ack,
+                byte_sel.eq(0)
+            ).Elif(output_cdc.sink.stb & output_cdc.sink.ack,
+                byte_sel.eq(byte_sel + 1)
+            )
+        ]
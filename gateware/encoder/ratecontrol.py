@@ -0,0 +1,75 @@
+from migen.fhdl.std import *
+from migen.genlib.cdc import PulseSynchronizer
+from migen.bank.description import *
+
+
+class EncoderRateControl(Module, AutoCSR):
+    """Closed loop JPEG bitrate control
+
+    Output bytes fill a bucket that is drained at the target rate (in bytes
+    per second). At the end of each encoded frame (eoi, not pulsed for the
+    REPEAT/UPDATE markers), the quantization table bank to use for the next
+    frame is moved towards coarser tables when the bucket level is above
+    high_level and towards finer tables when it is below low_level. Bank 0
+    holds the finest tables.
+    """
+    def __init__(self, count, eoi, clk_freq, nbanks=4):
+        self.enable = CSRStorage()
+        self.target = CSRStorage(32)
+        self.high_level = CSRStorage(32)
+        self.low_level = CSRStorage(32)
+        self.bank = CSRStatus(bits_for(nbanks-1))
+        self.level = CSRStatus(32)
+
+        # # #
+
+        # output bytes since last cycle (count is a free running byte counter)
+        last_count = Signal(32)
+        delta = Signal(32)
+        self.sync += last_count.eq(count)
+        self.comb += delta.eq(count - last_count)
+
+        # drain target bytes per second (at most one byte per cycle)
+        phase = Signal(32)
+        phase_next = Signal(33)
+        drain = Signal()
+        self.comb += [
+            phase_next.eq(phase + self.target.storage),
+            drain.eq(phase_next >= clk_freq)
+        ]
+        self.sync += \
+            If(drain,
+                phase.eq(phase_next - clk_freq)
+            ).Else(
+                phase.eq(phase_next)
+            )
+
+        # bucket, unused bandwidth is not accumulated
+        level = self.level.status
+        level_next = Signal(33)
+        self.comb += level_next.eq(level + delta)
+        self.sync += \
+            If(~self.enable.storage,
+                level.eq(0)
+            ).Elif(level_next < drain,
+                level.eq(0)
+            ).Else(
+                level.eq(level_next - drain)
+            )
+
+        # bank selection at the end of each frame
+        frame_end = PulseSynchronizer("encoder", "sys")
+        self.submodules += frame_end
+        self.comb += frame_end.i.eq(eoi)
+
+        bank = self.bank.status
+        self.sync += \
+            If(~self.enable.storage,
+                bank.eq(0)
+            ).Elif(frame_end.o,
+                If((level > self.high_level.storage) & (bank != nbanks-1),
+                    bank.eq(bank + 1)
+                ).Elif((level < self.low_level.storage) & (bank != 0),
+                    bank.eq(bank - 1)
+                )
+            )
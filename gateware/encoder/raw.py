@@ -0,0 +1,173 @@
+from migen.fhdl.std import *
+from migen.genlib.record import *
+from migen.genlib.fsm import FSM, NextState
+from migen.genlib.cdc import MultiReg
+from migen.bank.description import *
+from migen.flow.actor import *
+from migen.actorlib.fifo import AsyncFIFO
+from migen.actorlib import structuring
+
+
+# raw frame header (optional): "YUY2", width, height, frame number (big endian)
+raw_magic = [ord(c) for c in "YUY2"]
+raw_header_length = 12
+
+
+class EncoderRaw(Module, AutoCSR):
+    """Uncompressed YCbCr 4:2:2 frames (YUY2)
+
+    When enabled, the frames read by the encoder reader (in raster order, see
+    EncoderDMAReader.raster) bypass the JPEG encoder and are sent to the
+    streamer as YUY2 bytes (Y0 Cb0 Y1 Cr0...) with an explicit end of frame.
+    With with_header, each frame is preceded by a raw frame header so that
+    the host can find the frames in the stream (UDP).
+
+    The mode must only be changed when the reader and the encoder are idle
+    (see encoder_raw_enable in the firmware), idle reports when no raw frame
+    is in progress. The streamer output only switches between frames.
+    """
+    def __init__(self, with_header=False):
+        # from the reader / to the encoder (sys domain)
+        self.sink = sink = Sink([("data", 128)])
+        self.encoder_source = encoder_source = Source([("data", 128)])
+        # from the encoder / to the streamer (encoder domain)
+        self.jpeg_sink = jpeg_sink = Sink([("data", 8)])
+        self.source = source = Source([("data", 8), ("raw", 1), ("eof", 1)])
+
+        # frame size (latched at the start of each frame)
+        self.h_width = Signal(16)
+        self.v_width = Signal(16)
+
+        self.enable = CSRStorage()
+        self.idle = CSRStatus()
+
+        # # #
+
+        enable = self.enable.storage
+
+        # 128-bit words of 8 pixels, first pixel in the msbs. Swap the bytes of
+        # each pixel so that luma comes first.
+        self.submodules.converter = converter = structuring.Converter(EndpointDescription([("data", 128)]),
+                                                                      EndpointDescription([("data", 8)]),
+                                                                      reverse=True)
+        self.comb += [
+            If(enable,
+                converter.sink.stb.eq(sink.stb),
+                sink.ack.eq(converter.sink.ack)
+            ).Else(
+                Record.connect(sink, encoder_source)
+            ),
+            converter.sink.data.eq(Cat(*[Cat(sink.data[16*i+8:16*i+16], sink.data[16*i:16*i+8])
+                for i in range(8)]))
+        ]
+
+        self.submodules.cdc = cdc = RenameClockDomains(AsyncFIFO([("data", 8), ("eof", 1)], 16),
+                                                       {"write": "sys", "read": "encoder"})
+
+        # frame bytes
+        h_width = Signal(16)
+        v_width = Signal(16)
+        frame_bytes = Signal(32)
+        frame_number = Signal(32)
+        frame_start = Signal()
+        self.sync += \
+            If(frame_start,
+                h_width.eq(self.h_width),
+                v_width.eq(self.v_width),
+                frame_bytes.eq(self.h_width*self.v_width*2)
+            )
+
+        count = Signal(32)
+        count_clr = Signal()
+        count_inc = Signal()
+        self.sync += [
+            If(count_clr,
+                count.eq(0)
+            ).Elif(count_inc,
+                count.eq(count + 1)
+            ),
+            If(count_inc & cdc.sink.eof,
+                frame_number.eq(frame_number + 1)
+            )
+        ]
+
+        header = raw_magic + [
+            h_width[8:16], h_width[0:8],
+            v_width[8:16], v_width[0:8],
+            frame_number[24:32], frame_number[16:24], frame_number[8:16], frame_number[0:8]
+        ]
+        header_data = Signal(8)
+        self.comb += Case(count, {i: header_data.eq(v) for i, v in enumerate(header)})
+
+        self.submodules.fsm = fsm = FSM(reset_state="IDLE")
+        fsm.act("IDLE",
+            count_clr.eq(1),
+            If(converter.source.stb,
+                frame_start.eq(1),
+                NextState("HEADER" if with_header else "DATA")
+            )
+        )
+        fsm.act("HEADER",
+            cdc.sink.stb.eq(1),
+            cdc.sink.data.eq(header_data),
+            If(cdc.sink.ack,
+                If(count == raw_header_length - 1,
+                    count_clr.eq(1),
+                    NextState("DATA")
+                ).Else(
+                    count_inc.eq(1)
+                )
+            )
+        )
+        fsm_idle = Signal()
+        fsm.act("IDLE", fsm_idle.eq(1))
+        self.comb += self.idle.status.eq(fsm_idle & ~converter.source.stb & ~(enable & sink.stb))
+        fsm.act("DATA",
+            cdc.sink.stb.eq(converter.source.stb),
+            cdc.sink.data.eq(converter.source.data),
+            cdc.sink.eof.eq(count == frame_bytes - 1),
+            converter.source.ack.eq(cdc.sink.ack),
+            If(cdc.sink.stb & cdc.sink.ack,
+                count_inc.eq(1),
+                If(cdc.sink.eof,
+                    NextState("IDLE")
+                )
+            )
+        )
+
+        # streamer output, only switched between frames once the current
+        # path is drained
+        encoder_enable = Signal()
+        self.specials += MultiReg(enable, encoder_enable, "encoder")
+        output_raw = Signal()
+        raw_in_frame = Signal()
+        jpeg_in_frame = Signal()
+        jpeg_last_ff = Signal()
+        self.sync.encoder += [
+            If(cdc.source.stb & cdc.source.ack,
+                raw_in_frame.eq(~cdc.source.eof)
+            ),
+            If(jpeg_sink.stb & jpeg_sink.ack,
+                jpeg_last_ff.eq(jpeg_sink.data == 0xff),
+                jpeg_in_frame.eq(~(jpeg_last_ff & (jpeg_sink.data == 0xd9)))
+            ),
+            If(output_raw,
+                If(~raw_in_frame & ~cdc.source.stb,
+                    output_raw.eq(encoder_enable)
+                )
+            ).Else(
+                If(~jpeg_in_frame & ~jpeg_sink.stb,
+                    output_raw.eq(encoder_enable)
+                )
+            )
+        ]
+        self.comb += \
+            If(output_raw,
+                source.stb.eq(cdc.source.stb),
+                source.data.eq(cdc.source.data),
+                source.raw.eq(1),
+                source.eof.eq(cdc.source.eof),
+                cdc.source.ack.eq(source.ack)
+            ).Else(
+                Record.connect(jpeg_sink, source)
+            )
@@ -0,0 +1,174 @@
+from migen.fhdl.std import *
+from migen.genlib.cdc import MultiReg, PulseSynchronizer
+from migen.bank.description import *
+
+
+class _StageCounters(Module):
+    def __init__(self, endpoint, nbytes, frame_size=None):
+        self.clear = Signal()
+        self.snapshot = Signal()
+
+        self.cycles = Signal(32)
+        self.valid = Signal(32)
+        self.stall = Signal(32)
+        self.bytes = Signal(32)
+        self.frame_bytes = Signal(32)
+
+        # # #
+
+        cycles = Signal(32)
+        valid = Signal(32)
+        stall = Signal(32)
+        nbytes_total = Signal(32)
+        nbytes_frame = Signal(32)
+        frame_bytes = Signal(32)
+
+        transfer = Signal()
+        self.comb += transfer.eq(endpoint.stb & endpoint.ack)
+
+        # end of frame at this stage
+        frame_end = Signal()
+        if nbytes == 1:
+            # jpeg bytes: end of image marker (FF D9)
+            last_ff = Signal()
+            self.sync += \
+                If(transfer,
+                    last_ff.eq(endpoint.data == 0xff)
+                )
+            self.comb += frame_end.eq(transfer & last_ff & (endpoint.data == 0xd9))
+        elif frame_size is not None:
+            # pixels: frame_size bytes, taken at the first transfer of the frame
+            size = Signal(32)
+            self.sync += \
+                If(transfer & (nbytes_frame == 0),
+                    size.eq(frame_size)
+                )
+            self.comb += frame_end.eq(transfer &
+                (nbytes_frame + nbytes >= Mux(nbytes_frame == 0, frame_size, size)))
+
+        self.sync += [
+            If(self.clear,
+                cycles.eq(0),
+                valid.eq(0),
+                stall.eq(0),
+                nbytes_total.eq(0)
+            ).Else(
+                cycles.eq(cycles + 1),
+                If(endpoint.stb,
+                    valid.eq(valid + 1),
+                    If(~endpoint.ack,
+                        stall.eq(stall + 1)
+                    )
+                ),
+                If(transfer,
+                    nbytes_total.eq(nbytes_total + nbytes)
+                )
+            ),
+            If(frame_end,
+                frame_bytes.eq(nbytes_frame + Mux(transfer, nbytes, 0)),
+                nbytes_frame.eq(0)
+            ).Elif(transfer,
+                nbytes_frame.eq(nbytes_frame + nbytes)
+            ),
+            # all counters are latched on the same cycle
+            If(self.snapshot,
+                self.cycles.eq(cycles),
+                self.valid.eq(valid),
+                self.stall.eq(stall),
+                self.bytes.eq(nbytes_total),
+                self.frame_bytes.eq(frame_bytes)
+            )
+        ]
+
+
+class EncoderStats(Module, AutoCSR):
+    """Encoder pipeline statistics
+
+    For each stage boundary (a (name, endpoint, clock domain) tuple), count
+    the cycles, the cycles with valid data, the cycles stalled waiting for
+    ack and the transferred bytes. The bytes of the last frame are counted
+    with the frame boundaries seen by each stage: end of image marker for
+    the jpeg (8-bit) stages, frame_size bytes (size of the frame being read,
+    sys domain, taken when the stage starts the frame) for the pixel stages.
+    Encode latency (in encoder cycles from core start to end of image of the
+    output) is also reported.
+
+    Writing snapshot latches all the counters at once, values are then stable
+    and can be read by the cpu.
+    """
+    def __init__(self, stages, output, start, frame_size=None):
+        self.snapshot = CSR()
+        self.clear = CSR()
+        self.latency = CSRStatus(32)
+
+        self._stages = []
+        for name, endpoint, cd in stages:
+            csrs = [CSRStatus(32, name=name + "_" + counter)
+                for counter in ["cycles", "valid", "stall", "bytes", "frame_bytes"]]
+            for csr in csrs:
+                setattr(self, csr.name, csr)
+            self._stages.append((endpoint, cd, csrs))
+
+        # # #
+
+        snapshot = self.snapshot.re & self.snapshot.r
+        clear = self.clear.re & self.clear.r
+
+        # end of image marker (FF D9) on the encoder output
+        last_ff = Signal()
+        eoi = Signal()
+        self.sync.encoder += \
+            If(output.stb & output.ack,
+                last_ff.eq(output.data == 0xff)
+            )
+        self.comb += eoi.eq(output.stb & output.ack & last_ff & (output.data == 0xd9))
+
+        for i, (endpoint, cd, csrs) in enumerate(self._stages):
+            nbytes = flen(endpoint.data)//8
+            stage_frame_size = None
+            if frame_size is not None and nbytes != 1:
+                if cd == "sys":
+                    stage_frame_size = frame_size
+                else:
+                    # quasi-static: only changes at the start of a frame
+                    stage_frame_size = Signal(32)
+                    self.specials += MultiReg(frame_size, stage_frame_size, cd)
+            counters = RenameClockDomains(_StageCounters(endpoint, nbytes, stage_frame_size), cd)
+            setattr(self.submodules, "stage" + str(i), counters)
+
+            snapshot_ps = PulseSynchronizer("sys", cd)
+            clear_ps = PulseSynchronizer("sys", cd)
+            self.submodules += snapshot_ps, clear_ps
+            self.comb += [
+                snapshot_ps.i.eq(snapshot),
+                clear_ps.i.eq(clear),
+                counters.snapshot.eq(snapshot_ps.o),
+                counters.clear.eq(clear_ps.o)
+            ]
+            values = [counters.cycles, counters.valid, counters.stall,
+                      counters.bytes, counters.frame_bytes]
+            for value, csr in zip(values, csrs):
+                self.specials += MultiReg(value, csr.status)
+
+        # latency (encoder domain)
+        running = Signal()
+        latency = Signal(32)
+        latency_counter = Signal(32)
+        self.sync.encoder += [
+            If(start & ~running,
+                running.eq(1),
+                latency_counter.eq(0)
+            ).Elif(running,
+                latency_counter.eq(latency_counter + 1),
+                If(eoi,
+                    running.eq(0),
+                    latency.eq(latency_counter + 1)
+                )
+            )
+        ]
+        latency_snapshot = PulseSynchronizer("sys", "encoder")
+        self.submodules += latency_snapshot
+        latency_latched = Signal(32)
+        self.comb += latency_snapshot.i.eq(snapshot)
+        self.sync.encoder += If(latency_snapshot.o, latency_latched.eq(latency))
+        self.specials += MultiReg(latency_latched, self.latency.status)
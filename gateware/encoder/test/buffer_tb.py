@@ -2,23 +2,30 @@ from migen.fhdl.std import *
 from migen.sim.generic import run_simulation
 from migen.flow.actor import EndpointDescription
 
-from gateware.encoder.buffer import EncoderBuffer
+from gateware.encoder.buffer import EncoderBuffer, EncoderBufferStatus
 from gateware.csc.test.common import *
 
 
 class TB(Module):
-    def __init__(self):
+    def __init__(self, nblocks=2):
         stream_description = EndpointDescription([("data", 128)], packetized=True)
 
         self.submodules.streamer = PacketStreamer(stream_description)
         self.submodules.streamer_randomizer = AckRandomizer(stream_description, 50)
-        self.submodules.buffer = EncoderBuffer()
+        self.submodules.buffer = EncoderBuffer(nblocks)
         self.submodules.logger_randomizer = AckRandomizer(stream_description, 50)
         self.submodules.logger = PacketLogger(stream_description)
+        # simulation only supports sys clock domain
+        self.submodules.status = RenameClockDomains(EncoderBufferStatus(self.buffer), {"encoder": "sys"})
+
+        # hold the output to fill the buffer
+        self.hold = Signal()
         self.comb += [
         	Record.connect(self.streamer.source, self.streamer_randomizer.sink),
             Record.connect(self.streamer_randomizer.source, self.buffer.sink),
-            Record.connect(self.buffer.source, self.logger_randomizer.sink),
+            Record.connect(self.buffer.source, self.logger_randomizer.sink, leave_out=set(["stb", "ack"])),
+            self.logger_randomizer.sink.stb.eq(self.buffer.source.stb & ~self.hold),
+            self.buffer.source.ack.eq(self.logger_randomizer.sink.ack & ~self.hold),
             Record.connect(self.logger_randomizer.source, self.logger.sink)
         ]
 
@@ -27,7 +34,24 @@ class TB(Module):
         reference = (line >> 16*(7-index%8)) & 0xffff
         return value == reference
 
+    def check_level(self, selfp):
+        # level read by the cpu: never out of range, only changes by one
+        # block at a time
+        level = selfp.status.level.status
+        errors = (level > self.buffer.nblocks) or (abs(level - self.last_level) > 1)
+        self.last_level = level
+        return errors
+
+    def wait(self, selfp, cycles):
+        for i in range(cycles):
+            self.level_errors += self.check_level(selfp)
+            yield
+
     def gen_simulation(self, selfp):
+        nblocks = self.buffer.nblocks
+        self.last_level = 0
+        self.level_errors = 0
+
         # create 8x8 blocks (one 8 pixels line per stb)
         blocks = []
         for i in range(8):
@@ -47,5 +71,47 @@ class TB(Module):
                 errors += not self.check_pixel(value, index, block)
         print("blocks: {}, errors: {}".format(len(blocks), errors))
 
+        # status: fill the buffer with the output held
+        status_errors = 0
+        selfp.hold = 1
+        blocks = []
+        for i in range(nblocks + 2):
+            block = [randn(2**128) for line in range(8)]
+            blocks.append(block)
+            self.streamer.send(Packet(block))
+        yield from self.wait(selfp, 64*nblocks + 256)
+        status_errors += selfp.status.level.status != nblocks
+        status_errors += selfp.status.max_level.status != nblocks
+        status_errors += selfp.status.almost_full.status != 1
+        selfp.status.almost_full_level.storage = nblocks + 1
+        yield from self.wait(selfp, 8)
+        status_errors += selfp.status.almost_full.status != 0
+        selfp.status.almost_full_level.storage = nblocks
+
+        # drain
+        selfp.hold = 0
+        for block in blocks:
+            yield from self.logger.receive()
+            for index, value in enumerate(self.logger.packet):
+                errors += not self.check_pixel(value, index, block)
+        self.last_level = selfp.status.level.status
+        yield from self.wait(selfp, 8)
+        status_errors += selfp.status.level.status != 0
+        status_errors += selfp.status.max_level.status != nblocks
+        status_errors += selfp.status.almost_full.status != 0
+
+        # max level clear
+        selfp.status.max_level_clear.re = 1
+        selfp.status.max_level_clear.r = 1
+        yield
+        selfp.status.max_level_clear.re = 0
+        yield from self.wait(selfp, 8)
+        status_errors += selfp.status.max_level.status != 0
+
+        print("blocks: {}, errors: {}, status errors: {}, level errors: {}".format(
+            len(blocks), errors, status_errors, self.level_errors))
+        assert errors == 0 and status_errors == 0 and self.level_errors == 0
+
 if __name__ == "__main__":
-    run_simulation(TB(), ncycles=2048, vcd_name="my.vcd", keep_files=True)
+    run_simulation(TB(), ncycles=8192, vcd_name="my.vcd", keep_files=True)
+    run_simulation(TB(nblocks=5), ncycles=8192)
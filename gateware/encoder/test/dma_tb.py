@@ -16,7 +16,7 @@ from misoclib.mem import sdram
 
 
 class TB(Module):
-    def __init__(self):
+    def __init__(self, line_prefetch=False):
         # sdram
         sdram_module = MT48LC4M16(75*1000000)
         sdram_phy_settings = sdram.PhySettings(
@@ -41,7 +41,9 @@ class TB(Module):
         self.submodules.dma_writer = dma_lasmi.Writer(self.sdram_core.crossbar.get_master())
 
         # dma reader
-        self.submodules.dma_reader = EncoderDMAReader(self.sdram_core.crossbar.get_master())
+        self.submodules.dma_reader = EncoderDMAReader(self.sdram_core.crossbar.get_master(),
+                                                      line_prefetch=line_prefetch,
+                                                      max_h_width=16)
         self.comb += self.dma_reader.source.ack.eq(1)
 
     def check_line(self, value, x, y, memory_data):
@@ -72,16 +74,11 @@ class TB(Module):
             selfp.dma_writer.address_data.stb = 0
             yield
 
-        # read
-        selfp.dma_reader.base.storage = 0
+        # read (load frame in slot0)
         selfp.dma_reader.h_width.storage = 16
         selfp.dma_reader.v_width.storage = 16
-        yield
-        selfp.dma_reader.start.r = 1
-        selfp.dma_reader.start.re = 1
-        yield
-        selfp.dma_reader.start.r = 0
-        selfp.dma_reader.start.re = 0
+        selfp.dma_reader._slot_array.slot0._address.storage = 0
+        selfp.dma_reader._slot_array.slot0._status.storage = 1
 
         errors = 0
         x_indexs = [0]*8 + [8]*8 + \
@@ -95,7 +92,16 @@ class TB(Module):
             x = x_indexs[i]
             y = y_indexs[i]
             errors += not self.check_line(selfp.dma_reader.source.data, x, y, memory_data)
+
+        # slot0 must have been released
+        for i in range(16):
+            yield
+        if selfp.dma_reader._slot_array.slot0._status.storage != 2:
+            errors += 1
         print("errors : {}".format(errors))
 
 if __name__ == "__main__":
+    print("block read:")
     run_simulation(TB(), ncycles=2048, vcd_name="my.vcd", keep_files=True)
+    print("line prefetch:")
+    run_simulation(TB(line_prefetch=True), ncycles=2048)
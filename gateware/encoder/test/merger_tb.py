@@ -0,0 +1,85 @@
+from migen.fhdl.std import *
+from migen.sim.generic import run_simulation
+
+from gateware.encoder.merger import EncoderMerger
+from gateware.csc.test.common import *
+
+from misoclib.mem.sdram.module import MT48LC4M16
+from misoclib.mem.sdram.phy.simphy import SDRAMPHYSim
+from misoclib.mem.sdram.core import SDRAMCore
+from misoclib.mem.sdram.core.lasmicon import LASMIconSettings
+
+from misoclib.mem import sdram
+
+
+def jpeg_frame(n):
+    return [0xff, 0xd8] + [randn(2**8) & 0xfe for i in range(n)] + [0xff, 0xd9]
+
+
+class TB(Module):
+    def __init__(self):
+        # sdram
+        sdram_module = MT48LC4M16(75*1000000)
+        sdram_phy_settings = sdram.PhySettings(
+            memtype="SDR",
+            dfi_databits=1*16,
+            nphases=1,
+            rdphase=0,
+            wrphase=0,
+            rdcmdphase=0,
+            wrcmdphase=0,
+            cl=2,
+            read_latency=4,
+            write_latency=0
+        )
+        self.submodules.sdram_phy = SDRAMPHYSim(sdram_module, sdram_phy_settings)
+        self.submodules.sdram_core = SDRAMCore(self.sdram_phy,
+                                               sdram_module.geom_settings,
+                                               sdram_module.timing_settings,
+                                               LASMIconSettings(with_refresh=False))
+
+        # merger (simulation only supports sys clock domain)
+        lasmims = [self.sdram_core.crossbar.get_master() for i in range(3)]
+        self.submodules.merger = RenameClockDomains(EncoderMerger(lasmims[:-1], lasmims[-1]),
+                                                    {"encoder": "sys"})
+        self.comb += self.merger.source.ack.eq(1)
+
+        # core1 frames are produced faster than core0 ones
+        self.frames = [[jpeg_frame(61), jpeg_frame(40)],
+                       [jpeg_frame(13), jpeg_frame(20)]]
+
+    def gen_simulation(self, selfp):
+        selfp.sdram_core.dfii._control.storage = 1
+        for stager, base in [(selfp.merger.stager0, 0), (selfp.merger.stager1, 256)]:
+            stager._base.storage = base
+            stager._size.storage = 256
+        for i in range(16):
+            yield
+
+        sinks = [selfp.merger.sinks[i] for i in range(2)]
+        streams = [sum(frames, []) for frames in self.frames]
+        reference = []
+        for frames in zip(*self.frames):
+            for frame in frames:
+                reference += frame
+
+        received = []
+        while len(received) < len(reference):
+            for sink, stream in zip(sinks, streams):
+                if sink.stb and sink.ack:
+                    stream.pop(0)
+                sink.stb = len(stream) != 0
+                if len(stream):
+                    sink.data = stream[0]
+            if selfp.merger.source.stb:
+                received.append(selfp.merger.source.data)
+            yield
+
+        errors = 0
+        for r, v in zip(reference, received):
+            if r != v:
+                errors += 1
+        print("errors : {}".format(errors))
+
+if __name__ == "__main__":
+    run_simulation(TB(), ncycles=8192, vcd_name="my.vcd", keep_files=True)
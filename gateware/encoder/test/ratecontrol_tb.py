@@ -0,0 +1,53 @@
+from migen.fhdl.std import *
+from migen.sim.generic import run_simulation
+
+from gateware.encoder.ratecontrol import EncoderRateControl
+
+
+class TB(Module):
+    def __init__(self):
+        self.count = Signal(32)
+        self.eoi = Signal()
+
+        # simulation only supports sys clock domain
+        # 1000 cycles per "second", 100 bytes per second target rate
+        self.submodules.rate_control = RenameClockDomains(EncoderRateControl(self.count, self.eoi, 1000),
+                                                          {"encoder": "sys"})
+
+    def send_frames(self, selfp, nframes, nbytes, period):
+        for frame in range(nframes):
+            for i in range(nbytes*period):
+                if i%period == 0:
+                    selfp.count += 1
+                yield
+            selfp.eoi = 1
+            yield
+            selfp.eoi = 0
+            for i in range(8):
+                yield
+
+    def gen_simulation(self, selfp):
+        selfp.rate_control.target.storage = 100
+        selfp.rate_control.high_level.storage = 50
+        selfp.rate_control.low_level.storage = 10
+        selfp.rate_control.enable.storage = 1
+        yield
+
+        errors = 0
+
+        # too many bytes: coarser tables
+        yield from self.send_frames(selfp, 8, 50, 2)
+        print("bank (fast): {}".format(selfp.rate_control.bank.status))
+        if selfp.rate_control.bank.status != 3:
+            errors += 1
+
+        # link not saturated: finer tables
+        yield from self.send_frames(selfp, 40, 10, 20)
+        print("bank (slow): {}".format(selfp.rate_control.bank.status))
+        if selfp.rate_control.bank.status != 0:
+            errors += 1
+
+        print("errors: {}".format(errors))
+
+if __name__ == "__main__":
+    run_simulation(TB(), ncycles=16384, vcd_name="my.vcd", keep_files=True)
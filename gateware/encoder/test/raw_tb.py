@@ -0,0 +1,117 @@
+from migen.fhdl.std import *
+from migen.sim.generic import run_simulation
+
+from gateware.encoder.raw import EncoderRaw, raw_magic
+from gateware.csc.test.common import *
+
+
+h_width = 16
+v_width = 2
+nframes = 2
+
+
+def pixels_word(pixels):
+    # 8 pixels of 16 bits (luma in the lsbs), first pixel in the msbs
+    word = 0
+    for pixel in pixels:
+        word = (word << 16) | pixel
+    return word
+
+
+class TB(Module):
+    def __init__(self):
+        # simulation only supports sys clock domain
+        self.submodules.raw = RenameClockDomains(EncoderRaw(with_header=True), {"encoder": "sys"})
+        self.comb += [
+            self.raw.h_width.eq(h_width),
+            self.raw.v_width.eq(v_width),
+            self.raw.source.ack.eq(1)
+        ]
+
+        self.frames = [[randn(2**16) for i in range(h_width*v_width)] for n in range(nframes)]
+
+    def gen_simulation(self, selfp):
+        selfp.raw.enable.storage = 1
+        for i in range(8):
+            yield
+
+        words = []
+        reference = []
+        for n, frame in enumerate(self.frames):
+            for i in range(0, len(frame), 8):
+                words.append(pixels_word(frame[i:i+8]))
+            header = raw_magic + [h_width >> 8, h_width & 0xff, v_width >> 8, v_width & 0xff,
+                                  0, 0, 0, n]
+            reference += [(b, 0) for b in header]
+            for pixel in frame:
+                reference += [(pixel & 0xff, 0), (pixel >> 8, 0)]
+            reference[-1] = (reference[-1][0], 1)
+
+        received = []
+        sink = selfp.raw.sink
+        while len(received) < len(reference):
+            if sink.stb and sink.ack:
+                words.pop(0)
+            sink.stb = len(words) != 0
+            if len(words):
+                sink.data = words[0]
+            if selfp.raw.source.stb:
+                if not selfp.raw.source.raw:
+                    print("jpeg data in raw mode")
+                received.append((selfp.raw.source.data, selfp.raw.source.eof))
+            yield
+
+        errors = 0
+        for r, v in zip(reference, received):
+            if r != v:
+                errors += 1
+        print("errors: {}".format(errors))
+
+class SwitchTB(Module):
+    """Raw mode enabled in the middle of a jpeg frame: the output only
+    switches to the raw frame once the jpeg frame is complete"""
+    def __init__(self):
+        self.submodules.raw = RenameClockDomains(EncoderRaw(), {"encoder": "sys"})
+        self.comb += [
+            self.raw.h_width.eq(8),
+            self.raw.v_width.eq(1),
+            self.raw.source.ack.eq(1)
+        ]
+
+    def gen_simulation(self, selfp):
+        jpeg = [0xff, 0xd8] + [randn(0xff) for i in range(32)] + [0xff, 0xd9]
+        pixels = [randn(2**16) for i in range(8)]
+        reference = [(b, 0) for b in jpeg]
+        for pixel in pixels:
+            reference += [(pixel & 0xff, 1), (pixel >> 8, 1)]
+
+        received = []
+        jpeg_sink = selfp.raw.jpeg_sink
+        sink = selfp.raw.sink
+        sent = 0
+        raw_sent = False
+        while len(received) < len(reference):
+            if jpeg_sink.stb and jpeg_sink.ack:
+                sent += 1
+            jpeg_sink.stb = sent < len(jpeg)
+            if sent < len(jpeg):
+                jpeg_sink.data = jpeg[sent]
+            if sink.stb and sink.ack:
+                raw_sent = True
+            if sent >= len(jpeg)//2:
+                selfp.raw.enable.storage = 1
+                sink.stb = not raw_sent
+                sink.data = pixels_word(pixels)
+            if selfp.raw.source.stb:
+                received.append((selfp.raw.source.data, selfp.raw.source.raw))
+            yield
+
+        errors = 0
+        for r, v in zip(reference, received):
+            if r != v:
+                errors += 1
+        print("switch errors: {}".format(errors))
+
+if __name__ == "__main__":
+    run_simulation(TB(), ncycles=4096, vcd_name="my.vcd", keep_files=True)
+    run_simulation(SwitchTB(), ncycles=1024)
@@ -0,0 +1,62 @@
+from migen.fhdl.std import *
+from migen.sim.generic import run_simulation
+from migen.flow.actor import EndpointDescription
+
+from gateware.encoder.stats import EncoderStats
+from gateware.csc.test.common import *
+
+
+class TB(Module):
+    def __init__(self):
+        stream_description = EndpointDescription([("data", 8)], packetized=True)
+
+        self.submodules.streamer = PacketStreamer(stream_description)
+        self.submodules.logger_randomizer = AckRandomizer(stream_description, 50)
+        self.submodules.logger = PacketLogger(stream_description)
+        self.comb += [
+            Record.connect(self.streamer.source, self.logger_randomizer.sink),
+            Record.connect(self.logger_randomizer.source, self.logger.sink)
+        ]
+
+        # simulation only supports sys clock domain
+        self.start = Signal()
+        self.submodules.stats = RenameClockDomains(EncoderStats([
+                ("output", self.logger_randomizer.sink, "sys")
+            ], self.logger_randomizer.sink, self.start), {"encoder": "sys"})
+
+    def gen_simulation(self, selfp):
+        frame = [0xff, 0xd8] + [randn(2**8) & 0xfe for i in range(100)] + [0xff, 0xd9]
+
+        selfp.start = 1
+        yield
+        selfp.start = 0
+        self.streamer.send(Packet(frame))
+        latency = 0
+        for _ in self.logger.receive():
+            latency += 1
+            yield
+
+        # snapshot
+        selfp.stats.snapshot.re = 1
+        selfp.stats.snapshot.r = 1
+        yield
+        selfp.stats.snapshot.re = 0
+        for i in range(16):
+            yield
+
+        errors = 0
+        frame_bytes = selfp.stats.output_frame_bytes.status
+        valid = selfp.stats.output_valid.status
+        stall = selfp.stats.output_stall.status
+        if frame_bytes != len(frame):
+            errors += 1
+        if valid - stall != len(frame):
+            errors += 1
+        if abs(selfp.stats.latency.status - latency) > 2:
+            errors += 1
+        print("frame bytes: {}, valid: {}, stall: {}, latency: {}".format(
+            frame_bytes, valid, stall, selfp.stats.latency.status))
+        print("errors: {}".format(errors))
+
+if __name__ == "__main__":
+    run_simulation(TB(), ncycles=1024, vcd_name="my.vcd", keep_files=True)
@@ -0,0 +1,525 @@
+"""End-to-end simulation of the video memory traffic
+
+The capture (FrameExtraction -> hdmi_in DMA), scan-out (HDMIOut reader) and
+encoder (EncoderDMAReader -> EncoderBuffer) masters share the crossbar of
+an SDRAMCore, as in the video mixer targets. The PHY is a half-rate DDR
+PHY with the settings of the Atlys targets (64-bit words at 75MHz) and the
+memory is the P3R1GE4JGF DDR2 of the Atlys (banks, columns and timings),
+so rates, row conflicts and refreshes are those of the hardware. Only the
+number of rows is reduced to keep the simulated memory small.
+
+Only a few lines of each frame are simulated, with the line timings of the
+resolution. For each resolution we report the bandwidth achieved by each
+master and the cycles its requests waited, the row conflicts (single bank
+precharges), the refreshes and the cycles they block the memory, and the
+real-time misses (capture overflows, scan-out underflows). The scan-out
+FIFO is the phy FIFO plus the HDMIOut prefetch buffer (--prefetch_lines).
+A second run
+adds a best-effort reader reading as fast as it can: its bandwidth is the
+headroom left by the video masters.
+
+With --check, the simulation fails on any real-time miss: "make
+system_qos_tb" checks that, with the QoS, the encoder and the best-effort
+reader never make the scan-out underflow or the capture overflow.
+
+Simulation only supports the sys clock domain: when the pixel clock is
+faster than sys_clk (1080p60), FrameExtraction (1 pixel/cycle) is replaced
+by a source of packed words with the same FIFO depth.
+"""
+import argparse
+
+from migen.fhdl.std import *
+from migen.sim.generic import run_simulation
+from migen.flow.actor import *
+
+from misoclib.mem.sdram.frontend import dma_lasmi
+from misoclib.mem.sdram.module import P3R1GE4JGF
+from misoclib.mem.sdram.phy.simphy import SDRAMPHYSim
+from misoclib.mem.sdram.core import SDRAMCore
+from misoclib.mem.sdram.core.lasmicon import LASMIconSettings
+from misoclib.mem import sdram
+
+from gateware.hdmi_in.analysis import FrameExtraction
+from gateware.hdmi_in.dma import DMA
+from gateware.encoder.dma import EncoderDMAReader
+from gateware.encoder.buffer import EncoderBuffer
+from gateware.csc.test.common import randn
+from gateware.qos import LASMIQoS
+
+sys_clk_freq = 75*1000000
+
+# name: hres, htotal, vres, vtotal, pixel clock
+resolutions = {
+    "720p60":  (1280, 1650, 720, 750, 74.25*1000000),
+    "1080p30": (1920, 2200, 1080, 1125, 74.25*1000000),
+    "1080p60": (1920, 2200, 1080, 1125, 148.5*1000000)
+}
+
+capture_base = [0x00000, 0x10000]
+scanout_base = 0x20000
+probe_base = 0x40000
+probe_words = 0x10000
+
+# simulated rows of each bank (8192 on the P3R1GE4JGF)
+sim_rowbits = 9
+
+
+class _Raster:
+    """Position in a raster of hres active slots out of htotal per line, lines
+    active lines and blank_lines blank lines, advancing rate slots per cycle"""
+    def __init__(self, hres, htotal, lines, blank_lines, rate):
+        self.hres = hres
+        self.htotal = htotal
+        self.lines = lines
+        self.vtotal = lines + blank_lines
+        self.rate = rate
+        self.phase = 0.
+        self.h = 0
+        self.v = 0
+
+    def active(self):
+        return self.h < self.hres and self.v < self.lines
+
+    def advance(self):
+        self.h += 1
+        if self.h == self.htotal:
+            self.h = 0
+            self.v += 1
+            if self.v == self.vtotal:
+                self.v = 0
+
+    def slots(self):
+        """Number of slots of the current cycle"""
+        self.phase += self.rate
+        n = int(self.phase)
+        self.phase -= n
+        return n
+
+
+class _Handshake(Module):
+    """Transfers and wait cycles of an endpoint (after warmup)"""
+    def __init__(self, warmup):
+        self.stb = Signal()
+        self.ack = Signal()
+        self.warmup = warmup
+
+        # # #
+
+        self.cycle = 0
+        self.transfers = 0
+        self.waits = 0
+
+    def do_simulation(self, selfp):
+        if self.cycle >= self.warmup:
+            if selfp.stb and selfp.ack:
+                self.transfers += 1
+            elif selfp.stb:
+                self.waits += 1
+        self.cycle += 1
+
+
+class _CommandMonitor(Module):
+    """Commands issued on the DFI interface (after warmup)"""
+    def __init__(self, dfi, warmup):
+        self.warmup = warmup
+        commands = {
+            # ras_n, cas_n, we_n
+            "activate":  (0, 1, 1),
+            "read":      (1, 0, 1),
+            "write":     (1, 0, 0),
+            "precharge": (0, 1, 0),
+            "refresh":   (0, 0, 1)
+        }
+        self.names = list(commands.keys()) + ["precharge_all"]
+        nphases = len(dfi.phases)
+        for name, (ras_n, cas_n, we_n) in commands.items():
+            issued = [~p.cs_n & (p.ras_n == ras_n) & (p.cas_n == cas_n) & (p.we_n == we_n)
+                for p in dfi.phases]
+            if name == "precharge":
+                precharge_all = Signal(max=nphases+1)
+                self.comb += precharge_all.eq(optree("+", [i & p.address[10] for i, p in zip(issued, dfi.phases)]))
+                setattr(self, "precharge_all", precharge_all)
+                issued = [i & ~p.address[10] for i, p in zip(issued, dfi.phases)]
+            count = Signal(max=nphases+1)
+            self.comb += count.eq(optree("+", issued))
+            setattr(self, name, count)
+
+        # # #
+
+        self.cycle = 0
+        self.counts = {name: 0 for name in self.names}
+
+    def do_simulation(self, selfp):
+        if self.cycle >= self.warmup:
+            for name in self.names:
+                self.counts[name] += getattr(selfp, name)
+        self.cycle += 1
+
+
+class _VideoSource(Module):
+    """Pixel domain of the capture: drives FrameExtraction"""
+    def __init__(self, raster):
+        self.valid_i = Signal()
+        self.vsync = Signal()
+        self.de = Signal()
+        self.r = Signal(8)
+        self.g = Signal(8)
+        self.b = Signal(8)
+        self.raster = raster
+
+    def do_simulation(self, selfp):
+        raster = self.raster
+        if raster.slots():
+            selfp.valid_i = 1
+            selfp.de = raster.active()
+            # vsync on the first blank line
+            selfp.vsync = raster.v == raster.lines
+            selfp.r, selfp.g, selfp.b = randn(256), randn(256), randn(256)
+            raster.advance()
+        else:
+            selfp.valid_i = 0
+
+
+class _WordSource(Module):
+    """Pixel domain of the capture and FrameExtraction FIFO (packed words)"""
+    def __init__(self, raster, dw, fifo_depth):
+        self.source = Source([("sof", 1), ("pixels", dw)])
+        self.raster = raster
+        self.pack_factor = dw//16
+        self.fifo_depth = fifo_depth
+
+        # # #
+
+        self.level = 0
+        self.sofs = []
+        self.pixels = 0
+        self.sof = False
+        self.overflows = 0
+
+    def do_simulation(self, selfp):
+        if selfp.source.stb and selfp.source.ack:
+            self.level -= 1
+            self.sofs.pop(0)
+        raster = self.raster
+        for i in range(raster.slots()):
+            if raster.v == raster.lines and raster.h == 0:
+                self.sof = True
+            if raster.active():
+                self.pixels += 1
+                if self.pixels == self.pack_factor:
+                    self.pixels = 0
+                    if self.level < self.fifo_depth:
+                        self.level += 1
+                        self.sofs.append(self.sof)
+                        self.sof = False
+                    else:
+                        self.overflows += 1
+            raster.advance()
+        selfp.source.stb = self.level > 0
+        if self.level:
+            selfp.source.sof = self.sofs[0]
+            selfp.source.pixels = randn(2**(16*self.pack_factor))
+
+
+class _Scanout(Module):
+    """HDMIOut reader: sequential reads of the framebuffer, VTG and phy FIFO
+
+    The VTG moves one phy word (pack_factor pixels) per cycle into the FIFO
+    when it is not full, taking a memory word for active words. The pixel
+    domain drains the FIFO, an empty FIFO is an underflow.
+    """
+    def __init__(self, lasmim, raster, frame_words, base, fifo_depth=512, warmup=0):
+        self.submodules.reader = reader = dma_lasmi.Reader(lasmim)
+        self.raster = raster
+        self.frame_words = frame_words
+        self.base = base
+        self.fifo_depth = fifo_depth
+        self.warmup = warmup
+
+        # # #
+
+        self.cycle = 0
+        self.transfers = 0
+        self.word = 0
+        self.level = 0
+        self.started = False
+        self.underflows = 0
+        self.min_level = fifo_depth
+
+    def do_simulation(self, selfp):
+        reader = selfp.reader
+        # address generator (continuous frames)
+        if reader.address.stb and reader.address.ack:
+            self.word = (self.word + 1) % self.frame_words
+        reader.address.stb = 1
+        reader.address.a = self.base + self.word
+
+        # vtg (raster of phy words)
+        raster = self.raster
+        if reader.data.stb and reader.data.ack:
+            self.level += 1
+            raster.advance()
+            if self.cycle >= self.warmup:
+                self.transfers += 1
+        elif not raster.active() and self.level < self.fifo_depth:
+            self.level += 1
+            raster.advance()
+        reader.data.ack = raster.active() and self.level < self.fifo_depth
+
+        # pixel domain
+        if self.level == self.fifo_depth:
+            self.started = True
+        if self.started:
+            for i in range(raster.slots()):
+                if self.level:
+                    self.level -= 1
+                elif self.cycle >= self.warmup:
+                    self.underflows += 1
+            if self.cycle >= self.warmup:
+                self.min_level = min(self.min_level, self.level)
+        self.cycle += 1
+
+
+class _EncoderSink(Module):
+    """Encoder: drains the EncoderBuffer at rate pixels/cycle"""
+    def __init__(self, rate):
+        self.sink = Sink(EndpointDescription([("data", 16)], packetized=True))
+        self.rate = rate
+        self.phase = 0.
+
+    def do_simulation(self, selfp):
+        self.phase += self.rate
+        if self.phase >= 1:
+            self.phase -= 1
+            selfp.sink.ack = 1
+        else:
+            selfp.sink.ack = 0
+
+
+class TB(Module):
+    def __init__(self, resolution, lines=16, encoder_rate=1., probe=False, with_refresh=True, qos=False, prefetch_lines=0, warmup=None):
+        hres, htotal, vres, vtotal, pix_freq = resolutions[resolution]
+        blank_lines = max(1, round(lines*(vtotal - vres)/vres))
+        rate = pix_freq/sys_clk_freq
+        self.frame_cycles = int((lines + blank_lines)*htotal/rate)
+        self.warmup = warmup = self.frame_cycles if warmup is None else warmup
+
+        # sdram (Atlys: P3R1GE4JGF, half-rate DDR PHY, 2 phases of 2x16 bits)
+        sdram_module = P3R1GE4JGF(sys_clk_freq)
+        geom = sdram_module.geom_settings
+        sdram_module.geom_settings = sdram.GeomSettings(geom.bankbits, sim_rowbits, geom.colbits)
+        sdram_phy_settings = sdram.PhySettings(
+            memtype=sdram_module.memtype,
+            dfi_databits=2*16,
+            nphases=2,
+            rdphase=0,
+            wrphase=1,
+            rdcmdphase=1,
+            wrcmdphase=0,
+            cl=3,
+            read_latency=5,
+            write_latency=0
+        )
+        self.sdram_module = sdram_module
+        self.submodules.sdram_phy = SDRAMPHYSim(sdram_module, sdram_phy_settings)
+        self.submodules.sdram_core = SDRAMCore(self.sdram_phy,
+                                               sdram_module.geom_settings,
+                                               sdram_module.timing_settings,
+                                               LASMIconSettings(with_refresh=with_refresh))
+        crossbar = self.sdram_core.crossbar
+        if qos:
+            self.submodules.qos = LASMIQoS(crossbar)
+            get_master = self.qos.get_master
+        else:
+            get_master = lambda realtime=False, weight=0: crossbar.get_master()
+        self.submodules.commands = _CommandMonitor(self.sdram_phy.dfi, warmup)
+
+        # capture
+        lasmim = get_master(realtime=True)
+        self.dw = dw = lasmim.dw
+        assert probe_base + probe_words <= 2**lasmim.aw, "increase sim_rowbits"
+        pack_factor = dw//16
+        self.frame_words = hres*lines//pack_factor
+        self.submodules.dma = DMA(lasmim, 2)
+        capture_raster = _Raster(hres, htotal, lines, blank_lines, rate)
+        if rate <= 1:
+            self.submodules.frame_extraction = RenameClockDomains(FrameExtraction(dw, 512), {"pix": "sys"})
+            self.submodules.video_source = _VideoSource(capture_raster)
+            for name in ["valid_i", "vsync", "de", "r", "g", "b"]:
+                self.comb += getattr(self.frame_extraction, name).eq(getattr(self.video_source, name))
+            self.comb += Record.connect(self.frame_extraction.frame, self.dma.frame)
+        else:
+            self.submodules.word_source = _WordSource(capture_raster, dw, 512)
+            self.comb += Record.connect(self.word_source.source, self.dma.frame)
+        self.submodules.capture = _Handshake(warmup)
+        self.comb += [
+            self.capture.stb.eq(self.dma._bus_accessor.address_data.stb),
+            self.capture.ack.eq(self.dma._bus_accessor.address_data.ack)
+        ]
+
+        # scan-out (phy FIFO and prefetch buffer)
+        scanout_fifo_depth = 512 + prefetch_lines*hres//pack_factor
+        scanout_raster = _Raster(hres//pack_factor, htotal//pack_factor, lines, blank_lines, rate/pack_factor)
+        self.submodules.scanout = _Scanout(get_master(realtime=True), scanout_raster,
+                                           self.frame_words, scanout_base, scanout_fifo_depth, warmup)
+        self.submodules.scanout_requests = _Handshake(warmup)
+        self.comb += [
+            self.scanout_requests.stb.eq(self.scanout.reader.address.stb),
+            self.scanout_requests.ack.eq(self.scanout.reader.address.ack)
+        ]
+
+        # encoder
+        self.submodules.encoder_reader = EncoderDMAReader(get_master(weight=32))
+        self.submodules.encoder_buffer = EncoderBuffer(nblocks=64)
+        self.submodules.encoder_sink = _EncoderSink(encoder_rate)
+        self.comb += [
+            self.encoder_buffer.sink.stb.eq(self.encoder_reader.source.stb),
+            self.encoder_buffer.sink.data.eq(self.encoder_reader.source.data),
+            self.encoder_reader.source.ack.eq(self.encoder_buffer.sink.ack),
+            Record.connect(self.encoder_buffer.source, self.encoder_sink.sink)
+        ]
+        self.submodules.encoder = _Handshake(warmup)
+        self.submodules.encoder_requests = _Handshake(warmup)
+        self.comb += [
+            self.encoder.stb.eq(self.encoder_reader.reader.data.stb),
+            self.encoder.ack.eq(self.encoder_reader.reader.data.ack),
+            self.encoder_requests.stb.eq(self.encoder_reader.reader.address.stb),
+            self.encoder_requests.ack.eq(self.encoder_reader.reader.address.ack)
+        ]
+        self.hres = hres
+        self.lines = lines
+
+        # best-effort reader (headroom)
+        self.probe = probe
+        if probe:
+            self.submodules.probe_reader = dma_lasmi.Reader(get_master())
+            self.submodules.probe_words = _Handshake(warmup)
+            self.comb += [
+                self.probe_words.stb.eq(self.probe_reader.data.stb),
+                self.probe_words.ack.eq(self.probe_reader.data.ack)
+            ]
+            self.probe_word = 0
+
+        # # #
+
+        self.capture_frame = 0
+        self.capture_frames = 0
+        self.encoder_frames = 0
+        self.capture_overflow = False
+
+    def do_simulation(self, selfp):
+        # firmware: reload the released slots
+        for n in range(2):
+            slot = getattr(selfp.dma._slot_array, "slot"+str(n))
+            if slot._status.storage != 1:
+                if slot._status.storage == 2:
+                    self.capture_frames += 1
+                slot._address.storage = capture_base[self.capture_frame]
+                slot._status.storage = 1
+                self.capture_frame ^= 1
+        selfp.dma._frame_size.storage = self.frame_words
+        slot = selfp.encoder_reader._slot_array.slot0
+        if slot._status.storage != 1:
+            if slot._status.storage == 2:
+                self.encoder_frames += 1
+            slot._address.storage = capture_base[0]
+            slot._status.storage = 1
+        selfp.encoder_reader.h_width.storage = self.hres
+        selfp.encoder_reader.v_width.storage = self.lines
+        if hasattr(self, "frame_extraction") and selfp.frame_extraction._overflow.w:
+            self.capture_overflow = True
+
+        # best-effort reader
+        if self.probe:
+            probe = selfp.probe_reader
+            if probe.address.stb and probe.address.ack:
+                self.probe_word = (self.probe_word + 1) % probe_words
+            probe.address.stb = 1
+            probe.address.a = probe_base + self.probe_word
+            probe.data.ack = 1
+
+    def gen_simulation(self, selfp):
+        selfp.sdram_core.dfii._control.storage = 1
+        yield
+
+    def report(self, cycles):
+        cycles -= self.warmup
+        word_bytes = self.dw//8
+
+        def bandwidth(words):
+            return words*word_bytes*sys_clk_freq/cycles/1e6
+
+        r = {
+            "cycles": cycles,
+            "capture_MBps": bandwidth(self.capture.transfers),
+            "capture_wait": self.capture.waits/cycles,
+            "scanout_MBps": bandwidth(self.scanout.transfers),
+            "scanout_wait": self.scanout_requests.waits/cycles,
+            "encoder_MBps": bandwidth(self.encoder.transfers),
+            "encoder_wait": self.encoder_requests.waits/cycles,
+            "commands": dict(self.commands.counts),
+            "capture_overflows": self.word_source.overflows if hasattr(self, "word_source") else int(self.capture_overflow),
+            "scanout_underflows": self.scanout.underflows,
+            "scanout_min_level": self.scanout.min_level
+        }
+        if self.probe:
+            r["headroom_MBps"] = bandwidth(self.probe_words.transfers)
+        timing = self.sdram_module.timing_settings
+        r["refresh_blocked"] = self.commands.counts["refresh"]*(timing.tRP + timing.tRFC)/cycles
+        # one memory word per read/write command
+        r["utilization"] = (self.commands.counts["read"] + self.commands.counts["write"])/cycles
+        return r
+
+
+def simulate(resolution, lines=16, frames=2, encoder_rate=1., probe=False, with_refresh=True, qos=False,
+             prefetch_lines=0):
+    tb = TB(resolution, lines, encoder_rate, probe, with_refresh, qos, prefetch_lines)
+    ncycles = tb.warmup + frames*tb.frame_cycles
+    run_simulation(tb, ncycles=ncycles)
+    return tb.report(ncycles)
+
+
+def _get_args():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("resolutions", nargs="*", help="resolutions ({})".format(", ".join(sorted(resolutions))))
+    parser.add_argument("--lines", default=16, type=int, help="simulated lines per frame (multiple of 8)")
+    parser.add_argument("--frames", default=2, type=int, help="simulated frames (after one frame of warmup)")
+    parser.add_argument("--encoder_rate", default=1., type=float, help="encoder pixels per sys_clk cycle")
+    parser.add_argument("--no_refresh", action="store_true", help="disable the refresh")
+    parser.add_argument("--qos", action="store_true", help="arbitrate with the QoS (gateware/qos.py)")
+    parser.add_argument("--prefetch_lines", default=0, type=int, help="lines of the HDMIOut prefetch buffer")
+    parser.add_argument("--check", action="store_true", help="fail on capture overflows or scan-out underflows")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = _get_args()
+    for resolution in args.resolutions if args.resolutions else sorted(resolutions):
+        hres, htotal, vres, vtotal, pix_freq = resolutions[resolution]
+        fps = pix_freq/(htotal*vtotal)
+        frame_bytes = hres*vres*2
+        required = frame_bytes*fps/1e6
+        peak = 2*2*16//8*sys_clk_freq/1e6
+
+        r = simulate(resolution, args.lines, args.frames, args.encoder_rate, False, not args.no_refresh, args.qos,
+                     args.prefetch_lines)
+        p = simulate(resolution, args.lines, args.frames, args.encoder_rate, True, not args.no_refresh, args.qos,
+                     args.prefetch_lines)
+
+        print("{} ({:.0f}fps, {:.0f}MB/s per video stream, {:.0f}MB/s peak):".format(
+            resolution, fps, required, peak))
+        print("  capture:  {:7.1f}MB/s  wait {:5.1%}  overflows {}".format(
+            r["capture_MBps"], r["capture_wait"], r["capture_overflows"]))
+        print("  scan-out: {:7.1f}MB/s  wait {:5.1%}  underflows {}  min fifo level {}".format(
+            r["scanout_MBps"], r["scanout_wait"], r["scanout_underflows"], r["scanout_min_level"]))
+        print("  encoder:  {:7.1f}MB/s  wait {:5.1%}  ({:.1f}fps)".format(
+            r["encoder_MBps"], r["encoder_wait"], r["encoder_MBps"]*1e6/frame_bytes))
+        c = r["commands"]
+        print("  sdram: utilization {:.1%}  activates {}  row conflicts {}  refreshes {} ({:.1%} blocked)".format(
+            r["utilization"], c["activate"], c["precharge"], c["refresh"], r["refresh_blocked"]))
+        print("  headroom: {:7.1f}MB/s  (with the best-effort reader: capture overflows {}, scan-out underflows {})".format(
+            p["headroom_MBps"], p["capture_overflows"], p["scanout_underflows"]))
+        if args.check:
+            for result in [r, p]:
+                assert result["capture_overflows"] == 0 and result["scanout_underflows"] == 0, \
+                    "{}: real-time miss".format(resolution)
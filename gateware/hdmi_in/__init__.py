@@ -10,6 +10,7 @@ from gateware.hdmi_in.decoding import Decoding
 from gateware.hdmi_in.chansync import ChanSync
 from gateware.hdmi_in.analysis import SyncPolarity, ResolutionDetection, FrameExtraction
 from gateware.hdmi_in.dma import DMA
+from gateware.hdmi_in.tiles import DirtyTiles
 
 
 class HDMIIn(Module, AutoCSR):
@@ -74,7 +75,17 @@ class HDMIIn(Module, AutoCSR):
         ]
 
         self.submodules.dma = DMA(lasmim, n_dma_slots)
-        self.comb += self.frame.frame.connect(self.dma.frame)
+        self.comb += [
+            self.frame.frame.connect(self.dma.frame),
+            self.dma.crc.eq(self.frame.crc)
+        ]
+
+        self.submodules.tiles = DirtyTiles(lasmim.dw)
+        self.comb += [
+            self.tiles.sof.eq(self.frame.frame.sof),
+            self.tiles.pixels.eq(self.frame.frame.pixels),
+            self.tiles.transfer.eq(self.frame.frame.stb & self.frame.frame.ack)
+        ]
         self.ev = self.dma.ev
 
     autocsr_exclude = {"ev"}
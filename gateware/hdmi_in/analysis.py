@@ -110,6 +110,37 @@ class ResolutionDetection(Module, AutoCSR):
         self.specials += MultiReg(vcounter_st, self._vres.status)
 
 
+class CRCEngine(Module):
+    """Parallel CRC, one data word per cycle
+
+    XOR taps are computed at elaboration by running the (Galois) LFSR
+    symbolically on the data word, bit 0 first.
+    """
+    def __init__(self, data_width, width=32, polynom=0x04c11db7):
+        self.data = Signal(data_width)
+        self.last = Signal(width)
+        self.next = Signal(width)
+
+        ###
+
+        # each bit of the state is a (last bits, data bits) set of xored inputs
+        state = [(frozenset([i]), frozenset()) for i in range(width)]
+        for n in range(data_width):
+            feedback = (state[width-1][0], state[width-1][1] ^ frozenset([n]))
+            new_state = [feedback]
+            for i in range(1, width):
+                if (polynom >> i) & 1:
+                    new_state.append((state[i-1][0] ^ feedback[0], state[i-1][1] ^ feedback[1]))
+                else:
+                    new_state.append(state[i-1])
+            state = new_state
+
+        for i, (last_bits, data_bits) in enumerate(state):
+            xors = [self.last[j] for j in sorted(last_bits)] + [self.data[j] for j in sorted(data_bits)]
+            if xors:
+                self.comb += self.next[i].eq(optree("^", xors))
+
+
 class FrameExtraction(Module, AutoCSR):
     def __init__(self, word_width, fifo_depth):
         # in pix clock domain
@@ -124,6 +155,8 @@ class FrameExtraction(Module, AutoCSR):
         word_layout = [("sof", 1), ("pixels", word_width)]
         self.frame = Source(word_layout)
         self.busy = Signal()
+        # signature of the words of the current frame
+        self.crc = Signal(32)
 
         self._overflow = CSR()
 
@@ -210,6 +243,17 @@ class FrameExtraction(Module, AutoCSR):
             self.busy.eq(0)
         ]
 
+        # frame signature (crc of the packed pixels)
+        self.submodules.crc_engine = CRCEngine(word_width)
+        self.comb += [
+            self.crc_engine.data.eq(self.frame.pixels),
+            self.crc_engine.last.eq(Mux(self.frame.sof, 2**32-1, self.crc))
+        ]
+        self.sync += \
+            If(self.frame.stb & self.frame.ack,
+                self.crc.eq(self.crc_engine.next)
+            )
+
         # overflow detection
         pix_overflow = Signal()
         pix_overflow_reset = Signal()
@@ -6,6 +6,8 @@ from migen.flow.actor import *
 
 from misoclib.mem.sdram.frontend import dma_lasmi
 
+from gateware.hdmi_in.analysis import CRCEngine
+
 
 # Slot status: EMPTY=0 LOADED=1 PENDING=2
 class _Slot(Module, AutoCSR):
@@ -62,14 +64,31 @@ class _SlotArray(Module, AutoCSR):
 
 
 class DMA(Module):
-    def __init__(self, lasmim, nslots):
+    """Write the frames to the memory slots
+
+    When _line_size is set, the crc of each line of the frame is computed on
+    the memory words and the table of the line crcs (32-bit, first line in
+    the msbs of the memory words) is written just after the frame, in the
+    same slot.
+
+    _frame_count counts the frames written to memory: the host can compare it
+    before and after reading a framebuffer to know whether the framebuffer
+    may have been reused in the meantime.
+    """
+    def __init__(self, lasmim, nslots, max_lines=2048):
         bus_aw = lasmim.aw
         bus_dw = lasmim.dw
         alignment_bits = bits_for(bus_dw//8) - 1
+        assert(bus_dw >= 32)
+        crcs_per_word = bus_dw//32
 
         fifo_word_width = bus_dw
         self.frame = Sink([("sof", 1), ("pixels", fifo_word_width)])
+        self.crc = Signal(32)
         self._frame_size = CSRStorage(bus_aw + alignment_bits, alignment_bits=alignment_bits)
+        self._frame_crc = CSRStatus(32)
+        self._frame_count = CSRStatus(32)
+        self._line_size = CSRStorage(bus_aw + alignment_bits, alignment_bits=alignment_bits)
         self.submodules._slot_array = _SlotArray(nslots, bus_aw, alignment_bits)
         self.ev = self._slot_array.ev
 
@@ -101,11 +120,98 @@ class DMA(Module):
             pixbits.append(self.frame.pixels)
         self.comb += memory_word.eq(Cat(*pixbits))
 
+        # line crcs
+        table_write = Signal()
+        count_pixel_word = Signal()
+        self.comb += count_pixel_word.eq(count_word & ~table_write)
+
+        self.submodules.line_crc_engine = CRCEngine(bus_dw)
+
+        line_crcs_enable = Signal()
+        lwords_remaining = Signal(bus_aw)
+        last_line_word = Signal()
+        line = Signal(max=max_lines+1)
+        line_crc = Signal(32)
+        self.comb += [
+            line_crcs_enable.eq(self._line_size.storage != 0),
+            last_line_word.eq(lwords_remaining == 1)
+        ]
+        self.sync += [
+            If(reset_words,
+                lwords_remaining.eq(self._line_size.storage),
+                line.eq(0),
+                line_crc.eq(2**32-1)
+            ).Elif(count_pixel_word,
+                If(last_line_word,
+                    lwords_remaining.eq(self._line_size.storage),
+                    If(line != max_lines, line.eq(line + 1)),
+                    line_crc.eq(2**32-1)
+                ).Else(
+                    lwords_remaining.eq(lwords_remaining - 1),
+                    line_crc.eq(self.line_crc_engine.next)
+                )
+            )
+        ]
+
+        self.comb += [
+            self.line_crc_engine.data.eq(memory_word),
+            self.line_crc_engine.last.eq(line_crc)
+        ]
+
+        line_crcs = Memory(32, max_lines)
+        line_crcs_wr = line_crcs.get_port(write_capable=True)
+        line_crcs_rd = line_crcs.get_port()
+        self.specials += line_crcs, line_crcs_wr, line_crcs_rd
+        self.comb += [
+            line_crcs_wr.adr.eq(line),
+            line_crcs_wr.dat_w.eq(self.line_crc_engine.next),
+            line_crcs_wr.we.eq(count_pixel_word & last_line_word & (line != max_lines))
+        ]
+
+        # table of the line crcs, written after the frame
+        table_index = Signal(max=max_lines+1)
+        table_index_reset = Signal()
+        table_index_inc = Signal()
+        table_word = Signal(bus_dw)
+        table_shift = Signal()
+        table_count = Signal(max=max(crcs_per_word, 2))
+        table_word_ready = Signal()
+        self.comb += [
+            line_crcs_rd.adr.eq(table_index),
+            table_word_ready.eq(table_count == crcs_per_word - 1)
+        ]
+        self.sync += [
+            If(table_index_reset,
+                table_index.eq(0)
+            ).Elif(table_index_inc,
+                table_index.eq(table_index + 1)
+            ),
+            If(table_index_reset,
+                table_count.eq(0)
+            ).Elif(table_shift,
+                If(table_word_ready,
+                    table_count.eq(0)
+                ).Else(
+                    table_count.eq(table_count + 1)
+                ),
+                # first crc in the msbs, zeros after the last line
+                If(table_index < line,
+                    table_word.eq(Cat(line_crcs_rd.dat_r, table_word[:-32]))
+                ).Else(
+                    table_word.eq(Cat(Replicate(0, 32), table_word[:-32]))
+                )
+            )
+        ]
+
         # bus accessor
         self.submodules._bus_accessor = dma_lasmi.Writer(lasmim)
         self.comb += [
             self._bus_accessor.address_data.a.eq(current_address),
-            self._bus_accessor.address_data.d.eq(memory_word)
+            If(table_write,
+                self._bus_accessor.address_data.d.eq(table_word)
+            ).Else(
+                self._bus_accessor.address_data.d.eq(memory_word)
+            )
         ]
 
         # control FSM
@@ -114,6 +220,7 @@ class DMA(Module):
 
         fsm.act("WAIT_SOF",
             reset_words.eq(1),
+            table_index_reset.eq(1),
             self.frame.ack.eq(~self._slot_array.address_valid | ~self.frame.sof),
             If(self._slot_array.address_valid & self.frame.sof & self.frame.stb, NextState("TRANSFER_PIXELS"))
         )
@@ -123,7 +230,39 @@ class DMA(Module):
                 self._bus_accessor.address_data.stb.eq(1),
                 If(self._bus_accessor.address_data.ack,
                     count_word.eq(1),
-                    If(last_word, NextState("EOF"))
+                    If(last_word,
+                        If(line_crcs_enable,
+                            NextState("TABLE_READ")
+                        ).Else(
+                            NextState("EOF")
+                        )
+                    )
+                )
+            )
+        )
+        # line crcs memory is read synchronously: one cycle to present the
+        # address, one to shift the crc in the table word
+        fsm.act("TABLE_READ",
+            NextState("TABLE_SHIFT")
+        )
+        fsm.act("TABLE_SHIFT",
+            table_shift.eq(1),
+            table_index_inc.eq(1),
+            If(table_word_ready,
+                NextState("TABLE_WRITE")
+            ).Else(
+                NextState("TABLE_READ")
+            )
+        )
+        fsm.act("TABLE_WRITE",
+            table_write.eq(1),
+            self._bus_accessor.address_data.stb.eq(1),
+            If(self._bus_accessor.address_data.ack,
+                count_word.eq(1),
+                If(table_index >= line,
+                    NextState("EOF")
+                ).Else(
+                    NextState("TABLE_READ")
                 )
             )
         )
@@ -134,5 +273,12 @@ class DMA(Module):
             )
         )
 
+        # signature and number of the last frame written to memory
+        self.sync += \
+            If(self._slot_array.address_done,
+                self._frame_crc.status.eq(self.crc),
+                self._frame_count.status.eq(self._frame_count.status + 1)
+            )
+
     def get_csrs(self):
-        return [self._frame_size] + self._slot_array.get_csrs()
+        return [self._frame_size, self._frame_crc, self._frame_count, self._line_size] + self._slot_array.get_csrs()
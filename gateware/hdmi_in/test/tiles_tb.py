@@ -0,0 +1,84 @@
+from migen.fhdl.std import *
+from migen.sim.generic import run_simulation
+
+from gateware.hdmi_in.tiles import DirtyTiles
+from gateware.csc.test.common import *
+
+
+word_width = 64
+h_width = 64
+v_width = 40
+tile_size = 16
+pack_factor = word_width//16
+h_tiles = h_width//tile_size
+v_tiles = (v_width + tile_size - 1)//tile_size
+
+
+def tile_of(n):
+    # tile (row, column) of the n-th word of a frame
+    y = n//(h_width//pack_factor)
+    x = (n % (h_width//pack_factor))*pack_factor
+    return y//tile_size, x//tile_size
+
+
+class TB(Module):
+    def __init__(self):
+        self.submodules.tiles = DirtyTiles(word_width, max_h_tiles=64, max_v_tiles=4)
+        self.comb += [
+            self.tiles._h_width.storage.eq(h_width),
+            self.tiles._v_width.storage.eq(v_width)
+        ]
+
+        # frame 1: tiles (0, 1) and (2, 3) changed, frame 2: unchanged
+        nwords = h_width*v_width//pack_factor
+        frame = [randn(2**word_width) for i in range(nwords)]
+        self.frames = [frame]
+        frame = list(frame)
+        for n in range(nwords):
+            if tile_of(n) in [(0, 1), (2, 3)] and n % 5 == 0:
+                frame[n] ^= 1
+        self.frames.append(frame)
+        self.frames.append(list(frame))
+        self.dirty = [
+            [(r, c) for r in range(v_tiles) for c in range(h_tiles)],
+            [(0, 1), (2, 3)],
+            []
+        ]
+
+    def read_map(self, selfp):
+        dirty = []
+        for r in range(v_tiles):
+            selfp.tiles._adr.storage = r*self.tiles.words_per_row
+            for i in range(4):
+                yield
+            word = selfp.tiles._dat.status
+            dirty += [(r, c) for c in range(h_tiles) if word & (1 << c)]
+        self.map = dirty
+
+    def gen_simulation(self, selfp):
+        errors = 0
+        for n, frame in enumerate(self.frames):
+            bank = selfp.tiles._bank.status
+            for i, word in enumerate(frame):
+                selfp.tiles.sof = i == 0
+                selfp.tiles.pixels = word
+                selfp.tiles.transfer = 1
+                yield
+            selfp.tiles.sof = 0
+            selfp.tiles.transfer = 0
+            yield
+
+            # the map of the frame is readable as soon as its last word is
+            # transferred (dma end of frame), not at the next start of frame
+            if selfp.tiles._bank.status == bank:
+                print("frame {}: bank not switched".format(n))
+                errors += 1
+            yield from self.read_map(selfp)
+            if self.map != self.dirty[n]:
+                print("frame {}: dirty tiles {} (expected {})".format(n, self.map, self.dirty[n]))
+                errors += 1
+        print("errors: {}".format(errors))
+
+
+if __name__ == "__main__":
+    run_simulation(TB(), ncycles=4096, vcd_name="my.vcd", keep_files=True)
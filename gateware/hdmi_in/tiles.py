@@ -0,0 +1,184 @@
+from migen.fhdl.std import *
+from migen.bank.description import *
+
+from gateware.hdmi_in.analysis import CRCEngine
+
+
+class DirtyTiles(Module, AutoCSR):
+    """Map of the 16x16 tiles that changed since the previous frame
+
+    A 16-bit signature (crc) of each tile is computed on the packed pixels
+    and compared with the signature of the same tile in the previous frame.
+    Dirty bits are stored in two banks (one per frame) of 32-bit words, each
+    tile row uses words_per_row words (bit n of word w is tile 32*w + n). The
+    bank of the last completed frame can be read by the cpu through adr/dat:
+    banks are switched when the last tile of the frame is done, before the
+    dma end of frame event.
+    """
+    def __init__(self, word_width, max_h_tiles=120, max_v_tiles=68):
+        self.sof = Signal()
+        self.pixels = Signal(word_width)
+        self.transfer = Signal()
+
+        self._h_width = CSRStorage(16)
+        self._v_width = CSRStorage(16)
+        self._bank = CSRStatus()
+        self._adr = CSRStorage(16)
+        self._dat = CSRStatus(32)
+
+        ###
+
+        tile_size = 16
+        pack_factor = word_width//16
+        assert(pack_factor <= tile_size)
+        tile_words = tile_size//pack_factor
+        words_per_row = (max_h_tiles + 31)//32
+        assert(words_per_row > 1 and words_per_row & (words_per_row - 1) == 0)  # only support powers of 2
+        self.words_per_row = words_per_row
+
+        h_tiles = Signal(16)
+        self.comb += h_tiles.eq(self._h_width.storage[log2_int(tile_size):])
+
+        # position of the current word (the start of frame word is always
+        # the first word of the first tile)
+        word = Signal(max=max(tile_words, 2))
+        column = Signal(max=max_h_tiles)
+        line = Signal(max=tile_size)
+        tile_row = Signal(max=max_v_tiles)
+        y = Signal(16)
+        tile_base = Signal(max=max_h_tiles*max_v_tiles)
+
+        cur_word = Signal(max=max(tile_words, 2))
+        cur_column = Signal(max=max_h_tiles)
+        cur_line = Signal(max=tile_size)
+        cur_tile_row = Signal(max=max_v_tiles)
+        cur_y = Signal(16)
+        cur_tile_base = Signal(max=max_h_tiles*max_v_tiles)
+        self.comb += [
+            cur_word.eq(Mux(self.sof, 0, word)),
+            cur_column.eq(Mux(self.sof, 0, column)),
+            cur_line.eq(Mux(self.sof, 0, line)),
+            cur_tile_row.eq(Mux(self.sof, 0, tile_row)),
+            cur_y.eq(Mux(self.sof, 0, y)),
+            cur_tile_base.eq(Mux(self.sof, 0, tile_base))
+        ]
+
+        last_word = Signal()
+        last_column = Signal()
+        last_line = Signal()
+        self.comb += [
+            last_word.eq(cur_word == tile_words - 1),
+            last_column.eq(cur_column == h_tiles - 1),
+            last_line.eq((cur_line == tile_size - 1) | (cur_y == self._v_width.storage - 1))
+        ]
+
+        next_column = Signal(max=max_h_tiles)
+        self.comb += \
+            If(self.transfer & last_word,
+                If(last_column,
+                    next_column.eq(0)
+                ).Else(
+                    next_column.eq(cur_column + 1)
+                )
+            ).Else(
+                next_column.eq(cur_column)
+            )
+
+        self.sync += \
+            If(self.transfer,
+                If(last_word,
+                    word.eq(0),
+                    column.eq(next_column),
+                    If(last_column,
+                        y.eq(cur_y + 1),
+                        If(last_line,
+                            line.eq(0),
+                            tile_row.eq(cur_tile_row + 1),
+                            tile_base.eq(cur_tile_base + h_tiles)
+                        ).Else(
+                            line.eq(cur_line + 1)
+                        )
+                    )
+                ).Else(
+                    word.eq(cur_word + 1)
+                )
+            )
+
+        # signatures: columns of the current tile row and tiles of the
+        # previous frame. Memories are read synchronously: present the address
+        # of the next word.
+        columns = Memory(16, max_h_tiles)
+        columns_wr = columns.get_port(write_capable=True)
+        columns_rd = columns.get_port()
+        previous = Memory(16, max_h_tiles*max_v_tiles)
+        previous_wr = previous.get_port(write_capable=True)
+        previous_rd = previous.get_port()
+        self.specials += columns, columns_wr, columns_rd, previous, previous_wr, previous_rd
+
+        self.submodules.crc_engine = CRCEngine(word_width, 16, 0x1021)
+        chain = Signal(16)
+        self.comb += [
+            columns_rd.adr.eq(next_column),
+            previous_rd.adr.eq(cur_tile_base + next_column),
+            self.crc_engine.data.eq(self.pixels),
+            If(cur_word != 0,
+                self.crc_engine.last.eq(chain)
+            ).Elif(cur_line == 0,
+                self.crc_engine.last.eq(2**16-1)
+            ).Else(
+                self.crc_engine.last.eq(columns_rd.dat_r)
+            )
+        ]
+        self.sync += If(self.transfer, chain.eq(self.crc_engine.next))
+
+        tile_done = Signal()
+        frame_done = Signal()
+        self.comb += [
+            columns_wr.adr.eq(cur_column),
+            columns_wr.dat_w.eq(self.crc_engine.next),
+            columns_wr.we.eq(self.transfer & last_word),
+
+            tile_done.eq(self.transfer & last_word & last_line),
+            previous_wr.adr.eq(cur_tile_base + cur_column),
+            previous_wr.dat_w.eq(self.crc_engine.next),
+            previous_wr.we.eq(tile_done),
+
+            frame_done.eq(tile_done & last_column & (cur_y == self._v_width.storage - 1))
+        ]
+
+        # frame banks, the map of the frame is written to bank
+        bank = Signal()
+        self.sync += If(frame_done, bank.eq(~bank))
+        self.comb += self._bank.status.eq(~bank)
+
+        # dirty map
+        dirty = Memory(32, 2*words_per_row*2**bits_for(max_v_tiles-1))
+        dirty_wr = dirty.get_port(write_capable=True)
+        dirty_rd = dirty.get_port()
+        self.specials += dirty, dirty_wr, dirty_rd
+
+        dirty_word = Signal(32)
+        dirty_word_next = Signal(32)
+        self.comb += [
+            dirty_word_next.eq(dirty_word),
+            Case(cur_column[:5], {
+                i: dirty_word_next[i].eq(self.crc_engine.next != previous_rd.dat_r) for i in range(32)
+            })
+        ]
+        self.sync += \
+            If(tile_done,
+                If((cur_column[:5] == 31) | last_column,
+                    dirty_word.eq(0)
+                ).Else(
+                    dirty_word.eq(dirty_word_next)
+                )
+            )
+
+        self.comb += [
+            dirty_wr.adr.eq(Cat(cur_column[5:5+log2_int(words_per_row)], cur_tile_row, bank)),
+            dirty_wr.dat_w.eq(dirty_word_next),
+            dirty_wr.we.eq(tile_done & ((cur_column[:5] == 31) | last_column)),
+
+            dirty_rd.adr.eq(Cat(self._adr.storage[:flen(dirty_rd.adr)-1], ~bank)),
+            self._dat.status.eq(dirty_rd.dat_r)
+        ]
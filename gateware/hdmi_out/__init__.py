@@ -1,8 +1,10 @@
 from migen.fhdl.std import *
 from migen.flow.network import *
 from migen.flow import plumbing
-from migen.bank.description import AutoCSR
+from migen.bank.description import *
+from migen.bank.eventmanager import *
 from migen.actorlib import structuring, misc
+from migen.actorlib.fifo import SyncFIFO
 
 from misoclib.mem.sdram.frontend import dma_lasmi
 from gateware.hdmi_out.format import bpp, pixel_layout, FrameInitiator, VTG
@@ -11,12 +13,28 @@ from gateware.i2c import I2C
 
 
 class HDMIOut(Module, AutoCSR):
-    def __init__(self, pads, lasmim, external_clocking=None):
+    """HDMI scan-out of a framebuffer
+
+    prefetch_lines lines (of up to max_hres pixels) are buffered between
+    the DMA and the VTG, on top of the phy FIFO, to ride through the
+    latency of the other SDRAM masters. The fill level of this buffer and
+    its minimum since the last prefetch_min_level_clear are reported.
+
+    Underflows of the pixel domain (phy FIFO empty, the last pixels are
+    repeated) are counted (one per burst) in underflows and raise the
+    underflow event.
+    """
+    def __init__(self, pads, lasmim, external_clocking=None, prefetch_lines=0, max_hres=1920):
         pack_factor = lasmim.dw//bpp
 
         if hasattr(pads, "scl"):
             self.submodules.i2c = I2C(pads)
 
+        self._underflows = CSRStatus(32)
+        self.submodules.ev = EventManager()
+        self.ev.underflow = EventSourcePulse()
+        self.ev.finalize()
+
         g = DataFlowGraph()
 
         self.fi = FrameInitiator(lasmim.aw, pack_factor)
@@ -32,6 +50,44 @@ class HDMIOut(Module, AutoCSR):
 
         g.add_connection(self.fi, vtg, source_subr=self.fi.timing_subr, sink_ep="timing")
         g.add_connection(dma_out, cast)
-        g.add_connection(cast, vtg, sink_ep="pixels")
+        if prefetch_lines:
+            prefetch_depth = prefetch_lines*max_hres//pack_factor
+            prefetch = SyncFIFO(pixel_layout(pack_factor), prefetch_depth)
+            g.add_connection(cast, prefetch)
+            g.add_connection(prefetch, vtg, sink_ep="pixels")
+        else:
+            g.add_connection(cast, vtg, sink_ep="pixels")
         g.add_connection(vtg, self.driver)
         self.submodules += CompositeActor(g)
+
+        underflows_d = Signal(32)
+        self.sync += underflows_d.eq(self.driver.underflows)
+        self.comb += [
+            self._underflows.status.eq(self.driver.underflows),
+            self.ev.underflow.trigger.eq(self.driver.underflows != underflows_d)
+        ]
+
+        if prefetch_lines:
+            self._prefetch_depth = CSRStatus(bits_for(prefetch_depth), reset=prefetch_depth)
+            self._prefetch_level = CSRStatus(bits_for(prefetch_depth))
+            self._prefetch_min_level = CSRStatus(bits_for(prefetch_depth), reset=prefetch_depth)
+            self._prefetch_min_level_clear = CSR()
+
+            # level in phy words, minimum taken when the VTG reads
+            level = self._prefetch_level.status
+            written = prefetch.sink.stb & prefetch.sink.ack
+            read = prefetch.source.stb & prefetch.source.ack
+            self.sync += [
+                If(written & ~read,
+                    level.eq(level + 1)
+                ).Elif(read & ~written,
+                    level.eq(level - 1)
+                )
+            ]
+            min_level_clear = self._prefetch_min_level_clear.re & self._prefetch_min_level_clear.r
+            self.sync += \
+                If(min_level_clear,
+                    self._prefetch_min_level.status.eq(prefetch_depth)
+                ).Elif(read & (level < self._prefetch_min_level.status),
+                    self._prefetch_min_level.status.eq(level)
+                )
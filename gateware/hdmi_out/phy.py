@@ -6,6 +6,7 @@ from migen.flow.actor import *
 
 from gateware.hdmi_out.format import bpc_phy, phy_layout
 from gateware.hdmi_out import hdmi
+from gateware.encoder.buffer import _gray_encode, _gray_decode
 
 from gateware.csc.ycbcr2rgb import YCbCr2RGB
 from gateware.csc.ycbcr422to444 import YCbCr422to444
@@ -21,6 +22,7 @@ class _FIFO(Module):
         self.pix_de = Signal()
         self.pix_y = Signal(bpc_phy)
         self.pix_cb_cr = Signal(bpc_phy)
+        self.underflows = Signal(32)
 
         ###
 
@@ -56,6 +58,27 @@ class _FIFO(Module):
             )
         self.comb += fifo.re.eq(unpack_counter == (pack_factor - 1))
 
+        # underflows (pix domain): the fifo is read while empty and the last
+        # word is repeated. Count them once per burst and gray code the count
+        # to cross clock domains
+        underflow = Signal()
+        underflow_d = Signal()
+        underflows = Signal(32)
+        underflows_gray = Signal(32)
+        self.comb += underflow.eq(fifo.re & ~fifo.readable)
+        self.sync.pix += [
+            If(fifo.re,
+                underflow_d.eq(underflow)
+            ),
+            If(underflow & ~underflow_d,
+                underflows.eq(underflows + 1)
+            ),
+            underflows_gray.eq(_gray_encode(underflows))
+        ]
+        sys_underflows_gray = Signal(32)
+        self.specials += MultiReg(underflows_gray, sys_underflows_gray)
+        self.comb += _gray_decode(sys_underflows_gray, self.underflows)
+
 
 # This assumes a 50MHz base clock
 class _Clocking(Module, AutoCSR):
@@ -209,6 +232,7 @@ class Driver(Module, AutoCSR):
         self.submodules += fifo
         self.phy = fifo.phy
         self.busy = fifo.busy
+        self.underflows = fifo.underflows
 
         self.submodules.clocking = _Clocking(pads, external_clocking)
 
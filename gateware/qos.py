@@ -0,0 +1,140 @@
+from migen.fhdl.std import *
+from migen.bank.description import *
+from migen.genlib.misc import optree
+
+from misoclib.mem.sdram.core import lasmibus
+
+
+class _QoSPort(Module, AutoCSR):
+    """Gate the requests of a crossbar master
+
+    Each cycle the port earns weight/256 requests of credit (up to
+    max_credit requests), a request granted while in credit spends one
+    request of credit. Weights below min_weight earn min_weight/256, so
+    that no best-effort port is starved by the other best-effort ports.
+    The priority level of the port is, from the highest: real-time and in
+    credit, real-time, best-effort and in credit, then best-effort: the
+    class comes first so that best-effort credit never delays the real-time
+    ports, whose bandwidth is bounded by the video rates. Requests are only
+    presented to the crossbar when no other port requests with a higher
+    level, the round-robin of the crossbar arbitrates between the ports of
+    the same level.
+    """
+    def __init__(self, master, realtime, weight, min_weight=1, max_credit=16):
+        self.master = master
+        self.client = client = lasmibus.Interface(master.aw, master.dw, 1,
+            master.req_queue_size, master.read_latency, master.write_latency)
+        self.level = Signal(2)
+        self.allowed = Signal()
+        self.update = Signal()
+
+        self._realtime = CSRStorage(reset=realtime)
+        self._weight = CSRStorage(8, reset=weight)
+        self._requests = CSRStatus(32)
+        self._denied = CSRStatus(32)
+
+        ###
+
+        granted = Signal()
+        denied = Signal()
+        self.comb += [
+            master.adr.eq(client.adr),
+            master.we.eq(client.we),
+            master.stb.eq(client.stb & self.allowed),
+            client.req_ack.eq(master.req_ack & self.allowed),
+            client.dat_w_ack.eq(master.dat_w_ack),
+            client.dat_r_ack.eq(master.dat_r_ack),
+            client.lock.eq(master.lock),
+            master.dat_w.eq(client.dat_w),
+            master.dat_we.eq(client.dat_we),
+            client.dat_r.eq(master.dat_r),
+
+            granted.eq(client.stb & client.req_ack),
+            denied.eq(client.stb & ~client.req_ack)
+        ]
+
+        # credit (in 1/256 of request)
+        credit = Signal(max=256*max_credit+1)
+        credit_inc = Signal(max=256*max_credit+256+1)
+        credit_sat = Signal(max=256*max_credit+1)
+        in_credit = Signal()
+        weight = Signal(8)
+        self.comb += [
+            If(self._weight.storage < min_weight,
+                weight.eq(min_weight)
+            ).Else(
+                weight.eq(self._weight.storage)
+            ),
+            credit_inc.eq(credit + weight),
+            If(credit_inc > 256*max_credit,
+                credit_sat.eq(256*max_credit)
+            ).Else(
+                credit_sat.eq(credit_inc)
+            ),
+            in_credit.eq(credit >= 256),
+            self.level.eq(Cat(in_credit, self._realtime.storage))
+        ]
+        self.sync += \
+            If(granted & in_credit,
+                credit.eq(credit_sat - 256)
+            ).Else(
+                credit.eq(credit_sat)
+            )
+
+        # counters, latched (and cleared) on update
+        requests = Signal(32)
+        denied_cycles = Signal(32)
+        self.sync += [
+            If(self.update,
+                self._requests.status.eq(requests),
+                self._denied.status.eq(denied_cycles),
+                requests.eq(granted),
+                denied_cycles.eq(denied)
+            ).Else(
+                requests.eq(requests + granted),
+                denied_cycles.eq(denied_cycles + denied)
+            )
+        ]
+
+
+class LASMIQoS(Module, AutoCSR):
+    """Priority and bandwidth reservation for the masters of a LASMI crossbar
+
+    Masters are requested with get_master instead of crossbar.get_master,
+    with their deadline class (real-time masters such as the scan-out must
+    not be starved, best-effort masters such as the encoder reader can wait)
+    and their share of the bandwidth left by the real-time masters
+    (weight/256 of the memory words, at least min_weight/256 so that no
+    best-effort master can be starved). Classes and weights can be changed
+    at runtime (masterN_realtime, masterN_weight).
+
+    The number of requests and of cycles each master has been denied (by
+    the QoS or by the crossbar) are latched in masterN_requests and
+    masterN_denied on update and counted again from zero.
+
+    The gate does not look at banks: a master may wait for a higher level
+    master using another bank.
+    """
+    def __init__(self, crossbar, min_weight=1):
+        self.crossbar = crossbar
+        self.min_weight = min_weight
+        self.ports = []
+
+        self._enable = CSRStorage(reset=1)
+        self._update = CSR()
+
+    def get_master(self, realtime=False, weight=0):
+        port = _QoSPort(self.crossbar.get_master(), realtime, weight, self.min_weight)
+        setattr(self.submodules, "master"+str(len(self.ports)), port)
+        self.ports.append(port)
+        return port.client
+
+    def do_finalize(self):
+        for port in self.ports:
+            higher = [other.client.stb & (other.level > port.level)
+                for other in self.ports if other is not port]
+            if higher:
+                self.comb += port.allowed.eq(~self._enable.storage | ~optree("|", higher))
+            else:
+                self.comb += port.allowed.eq(1)
+            self.comb += port.update.eq(self._update.re)
@@ -5,29 +5,143 @@ from migen.genlib.record import *
 from migen.flow.actor import *
 from migen.actorlib.fifo import SyncFIFO, AsyncFIFO
 from migen.genlib.misc import WaitTimer
+from migen.genlib.cdc import MultiReg
+from migen.bank.description import *
 
 from liteeth.common import *
 
-class UDPStreamer(Module):
-    def __init__(self, ip_address, udp_port, fifo_depth=1024):
-        self.sink = sink = Sink([("data", 8)])
+from gateware.encoder.buffer import _gray_encode, _gray_decode
+
+class FrameSources(Module, AutoCSR):
+    """Source (input) of the streamed frames
+
+    The cpu pushes the source of each frame before starting it, the source
+    of the frame being streamed is popped at the end of the frame.
+    """
+    def __init__(self, nsources, depth=8):
+        self.current = Signal(max=nsources)
+        self.frame_done = Signal()
+
+        self._push = CSR(bits_for(nsources-1))
+
+        # # #
+
+        self.submodules.fifo = fifo = SyncFIFO([("n", bits_for(nsources-1))], depth)
+        self.comb += [
+            fifo.sink.stb.eq(self._push.re),
+            fifo.sink.n.eq(self._push.r),
+            If(fifo.source.stb,
+                self.current.eq(fifo.source.n)
+            ),
+            fifo.source.ack.eq(self.frame_done)
+        ]
+
+
+class UDPStreamer(Module, AutoCSR):
+    """Stream the encoder output in UDP datagrams
+
+    Datagrams carry up to payload_size bytes (1472 bytes fills an Ethernet
+    MTU of 1500 bytes, at least 1 byte) and are always closed on the end of
+    image markers so that a datagram never contains the end of a frame and
+    the start of the next one. Incomplete datagrams are flushed after a
+    timeout.
+
+    Raw (uncompressed) data gives the end of its frames on the eof sideband.
+
+    With nsources > 1, the frames of source n are sent to udp_port + n.
+    """
+    def __init__(self, ip_address, udp_port, fifo_depth=2048, max_payload_size=1472, nsources=1):
+        self.sink = sink = Sink([("data", 8), ("raw", 1), ("eof", 1)])
         self.source = source = Source(eth_udp_user_description(8))
 
+        self._payload_size = CSRStorage(16, reset=max_payload_size)
+
         # # #
 
-        self.submodules.async_fifo = async_fifo = RenameClockDomains(AsyncFIFO([("data", 8)], 4),
+        self.submodules.async_fifo = async_fifo = RenameClockDomains(AsyncFIFO([("data", 8), ("eof", 1)], 4),
                                           {"write": "encoder", "read": "sys"})
         self.submodules.fifo = fifo = SyncFIFO([("data", 8)], fifo_depth)
+        self.submodules.eoi_fifo = eoi_fifo = SyncFIFO([("bytes", 32)], 8)
+
+        # end of frame: end of image marker (FF D9) for jpeg data
+        last_ff = Signal()
+        self.sync.encoder += \
+            If(sink.stb & sink.ack,
+                last_ff.eq(sink.data == 0xff)
+            )
+        self.comb += [
+            async_fifo.sink.stb.eq(sink.stb),
+            async_fifo.sink.data.eq(sink.data),
+            async_fifo.sink.eof.eq(Mux(sink.raw, sink.eof, last_ff & (sink.data == 0xd9))),
+            sink.ack.eq(async_fifo.sink.ack),
+            # input stalls when no more frame ends can be queued
+            fifo.sink.stb.eq(async_fifo.source.stb & eoi_fifo.sink.ack),
+            fifo.sink.data.eq(async_fifo.source.data),
+            async_fifo.source.ack.eq(fifo.sink.ack & eoi_fifo.sink.ack)
+        ]
+
+        payload_size = Signal(16)
+        self.comb += \
+            If(self._payload_size.storage > max_payload_size,
+                payload_size.eq(max_payload_size)
+            ).Elif(self._payload_size.storage == 0,
+                payload_size.eq(1)
+            ).Else(
+                payload_size.eq(self._payload_size.storage)
+            )
+
+        # the number of bytes of each frame (up to its end) present in the
+        # fifo is queued
+        eoi = Signal()
+        frame_bytes = Signal(32)
         self.comb += [
-            Record.connect(sink, async_fifo.sink),
-            Record.connect(async_fifo.source, fifo.sink)
+            eoi.eq(fifo.sink.stb & fifo.sink.ack & async_fifo.source.eof),
+            eoi_fifo.sink.stb.eq(eoi),
+            eoi_fifo.sink.bytes.eq(frame_bytes + 1)
         ]
+        self.sync += [
+            If(fifo.sink.stb & fifo.sink.ack,
+                If(eoi,
+                    frame_bytes.eq(0)
+                ).Else(
+                    frame_bytes.eq(frame_bytes + 1)
+                )
+            )
+        ]
+
+        # bytes of the current frame already sent
+        sent = Signal(32)
+        sent_inc = Signal()
+        sent_clr = Signal()
+
+        bytes_to_eoi = Signal(32)
+        self.comb += bytes_to_eoi.eq(eoi_fifo.source.bytes - sent)
 
-        level = Signal(max=fifo_depth + 1)
-        level_update = Signal()
-        self.sync += If(level_update, level.eq(fifo.fifo.level))
+        length = Signal(16)
+        length_update = Signal()
+        length_next = Signal(16)
+        last = Signal()
+        self.comb += \
+            If(eoi_fifo.source.stb & (bytes_to_eoi <= payload_size),
+                length_next.eq(bytes_to_eoi)
+            ).Elif(fifo.fifo.level >= payload_size,
+                length_next.eq(payload_size)
+            ).Else(
+                length_next.eq(fifo.fifo.level)
+            )
+        self.sync += [
+            If(length_update,
+                length.eq(length_next),
+                last.eq(eoi_fifo.source.stb & (bytes_to_eoi <= payload_size))
+            ),
+            If(sent_clr,
+                sent.eq(0)
+            ).Elif(sent_inc,
+                sent.eq(sent + length)
+            )
+        ]
 
-        counter = Signal(max=fifo_depth)
+        counter = Signal(16)
         counter_reset = Signal()
         counter_ce = Signal()
         self.sync += \
@@ -37,6 +151,16 @@ class UDPStreamer(Module):
                 counter.eq(counter + 1)
             )
 
+        port = Signal(16)
+        if nsources > 1:
+            self.submodules.frame_sources = FrameSources(nsources)
+            self.comb += [
+                port.eq(udp_port + self.frame_sources.current),
+                self.frame_sources.frame_done.eq(eoi_fifo.source.stb & eoi_fifo.source.ack)
+            ]
+        else:
+            self.comb += port.eq(udp_port)
+
         self.submodules.flush_timer = WaitTimer(10000)
         flush = Signal()
         self.comb += [
@@ -45,9 +169,9 @@ class UDPStreamer(Module):
 
         self.submodules.fsm = fsm = FSM(reset_state="IDLE")
         fsm.act("IDLE",
-          self.flush_timer.wait.eq(1),
-            If((fifo.fifo.level >= 256) | flush,
-                level_update.eq(1),
+            self.flush_timer.wait.eq(1),
+            If(eoi_fifo.source.stb | (fifo.fifo.level >= payload_size) | flush,
+                length_update.eq(1),
                 counter_reset.eq(1),
                 NextState("SEND")
             )
@@ -55,33 +179,44 @@ class UDPStreamer(Module):
         fsm.act("SEND",
             source.stb.eq(fifo.source.stb),
             source.sop.eq(counter == 0),
-            If(level == 0,
-                source.eop.eq(1),
-            ).Else(
-                source.eop.eq(counter == (level - 1)),
-            ),
-            source.src_port.eq(udp_port),
-            source.dst_port.eq(udp_port),
+            source.eop.eq(counter == (length - 1)),
+            source.src_port.eq(port),
+            source.dst_port.eq(port),
             source.ip_address.eq(ip_address),
-            If(level == 0,
-                source.length.eq(1),
-            ).Else(
-                source.length.eq(level),
-            ),
+            source.length.eq(length),
             source.data.eq(fifo.source.data),
             fifo.source.ack.eq(source.ack),
             If(source.stb & source.ack,
                 counter_ce.eq(1),
                 If(source.eop,
+                    If(last,
+                        eoi_fifo.source.ack.eq(1),
+                        sent_clr.eq(1)
+                    ).Else(
+                        sent_inc.eq(1)
+                    ),
                     NextState("IDLE")
                 )
             )
         )
 
 
-class USBStreamer(Module):
-    def __init__(self, platform, pads):
-        self.sink = sink = Sink([("data", 8)])
+class USBStreamer(Module, AutoCSR):
+    """Stream the encoder output to the FX2
+
+    A deep (block ram) fifo crosses from the encoder to the FX2 clock
+    domain. The end of image markers are flagged on an eof sideband so that
+    the FX2 packet is committed (pktend) right after the end of each frame.
+    The fifo level (in bytes) and the number of underruns (fifo empty in the
+    middle of a frame) can be read by the cpu.
+
+    Raw (uncompressed) data gives the end of its frames on the eof sideband.
+    """
+    def __init__(self, platform, pads, fifo_depth=4096):
+        self.sink = sink = Sink([("data", 8), ("raw", 1), ("eof", 1)])
+
+        self._level = CSRStatus(bits_for(fifo_depth))
+        self._underruns = CSRStatus(32)
 
         # # #
 
@@ -91,10 +226,75 @@ class USBStreamer(Module):
           self.cd_usb.rst.eq(ResetSignal()) # XXX FIXME
         ]
 
-        self.submodules.fifo = fifo = RenameClockDomains(AsyncFIFO([("data", 8)], 4),
+        self.submodules.fifo = fifo = RenameClockDomains(AsyncFIFO([("data", 8), ("eof", 1)], fifo_depth),
                                           {"write": "encoder", "read": "usb"})
-        self.comb += Record.connect(sink, fifo.sink)
 
+        # end of image detection (encoder domain)
+        last_ff = Signal()
+        self.sync.encoder += \
+            If(sink.stb & sink.ack,
+                last_ff.eq(sink.data == 0xff)
+            )
+        self.comb += [
+            fifo.sink.stb.eq(sink.stb),
+            fifo.sink.data.eq(sink.data),
+            fifo.sink.eof.eq(Mux(sink.raw, sink.eof, last_ff & (sink.data == 0xd9))),
+            sink.ack.eq(fifo.sink.ack)
+        ]
+
+        # written and read bytes only increment by one at a time: gray code
+        # them to cross clock domains
+        written = Signal(32)
+        written_gray = Signal(32)
+        self.sync.encoder += [
+            If(fifo.sink.stb & fifo.sink.ack,
+                written.eq(written + 1)
+            ),
+            written_gray.eq(_gray_encode(written))
+        ]
+        read = Signal(32)
+        read_gray = Signal(32)
+        self.sync.usb += [
+            If(fifo.source.stb & fifo.source.ack,
+                read.eq(read + 1)
+            ),
+            read_gray.eq(_gray_encode(read))
+        ]
+        sys_written_gray = Signal(32)
+        sys_written = Signal(32)
+        sys_read_gray = Signal(32)
+        sys_read = Signal(32)
+        self.specials += [
+            MultiReg(written_gray, sys_written_gray),
+            MultiReg(read_gray, sys_read_gray)
+        ]
+        self.comb += [
+            _gray_decode(sys_written_gray, sys_written),
+            _gray_decode(sys_read_gray, sys_read),
+            self._level.status.eq(sys_written - sys_read)
+        ]
+
+        # underruns (usb domain): the streamer waits for data in the middle
+        # of a frame
+        in_frame = Signal()
+        underrun = Signal()
+        underrun_d = Signal()
+        underruns = Signal(32)
+        underruns_gray = Signal(32)
+        self.comb += underrun.eq(in_frame & ~fifo.source.stb & pads.flagb)
+        self.sync.usb += [
+            If(fifo.source.stb & fifo.source.ack,
+                in_frame.eq(~fifo.source.eof)
+            ),
+            underrun_d.eq(underrun),
+            If(underrun & ~underrun_d,
+                underruns.eq(underruns + 1)
+            ),
+            underruns_gray.eq(_gray_encode(underruns))
+        ]
+        sys_underruns_gray = Signal(32)
+        self.specials += MultiReg(underruns_gray, sys_underruns_gray)
+        self.comb += _gray_decode(sys_underruns_gray, self._underruns.status)
 
         self.specials += Instance("fx2_jpeg_streamer",
                                   # clk, rst
@@ -104,6 +304,7 @@ class USBStreamer(Module):
                                   # jpeg encoder interface
                                   i_sink_stb=fifo.source.stb,
                                   i_sink_data=fifo.source.data,
+                                  i_sink_eof=fifo.source.eof,
                                   o_sink_ack=fifo.source.ack,
 
                                   # cypress fx2 slave fifo interface
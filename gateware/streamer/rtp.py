@@ -1,158 +1,513 @@
-# RTP Proof of concept, metadata informations are missing (Sync, ...)
-# but this can be used as a basis to implement real RTP
+from migen.fhdl.std import *
+from migen.genlib.record import *
+from migen.genlib.fsm import FSM, NextState
+from migen.flow.actor import *
+from migen.actorlib.fifo import SyncFIFO, AsyncFIFO
+from migen.bank.description import *
+
+from liteeth.common import *
+
+from gateware.streamer import FrameSources
+
+# RTP/JPEG (RFC 2435)
+#
+# JFIF headers are stripped from the encoder output, only the entropy coded
+# scan data is sent. Receivers rebuild the headers from the 8-byte JPEG
+# header (type, width, height) and from the quantization tables sent in the
+# first packet of each frame (Q=255: tables may change on each frame, which
+# is the case with the encoder rate control). JpegEnc uses the standard
+# Huffman tables and no restart interval, as expected by RFC 2435.
 
 rtp_header_length = 12
-rtp_header_fields = {
-    "ver":              HeaderField(0,  6,  2),
-    "p":                HeaderField(0,  5,  1),
-    "x":                HeaderField(0,  4,  1),
-    "cc":               HeaderField(0,  0,  4),
-    "m":                HeaderField(1,  7,  1),
-    "pt":               HeaderField(1,  0,  7),
-    "sequence_number":  HeaderField(2,  0,  16),
-    "timestamp":        HeaderField(4,  0,  32),
-    "ssrc":             HeaderField(8,  0,  32)
-}
-rtp_header = Header(rtp_header_fields,
-                    rtp_header_length,
-                    swap_field_bytes=True)
-
-
-def eth_rtp_description(dw):
-    param_layout = rtp_header.get_layout()
-    payload_layout = [
-        ("data", dw),
-        ("error", dw//8)
-    ]
-    return EndpointDescription(payload_layout, param_layout, packetized=True)
-
-
-def eth_rtp_user_description(dw):
-    param_layout = [
-        ("src_port", 16),
-        ("dst_port", 16),
-        ("ip_address", 32),
-        ("length", 16)
-    ]
-    payload_layout = [
-        ("data", dw),
-        ("error", dw//8)
-    ]
-    return EndpointDescription(payload_layout, param_layout, packetized=True)
-
-
-class EncoderRTPGenerator(Module):
-    def __init__(self, ip_address, udp_port, fifo_depth=1024):
+rtp_version = 2
+rtp_payload_type_jpeg = 26
+rtp_clock_freq = 90000
+
+jpeg_header_length = 8
+jpeg_q_dynamic = 255
+jpeg_qtable_header_length = 4
+jpeg_qtable_length = 64
+jpeg_nqtables = 2
+
+# headers of the first packet of each frame and one scan byte
+rtp_jpeg_min_payload_size = (rtp_header_length + jpeg_header_length + jpeg_qtable_header_length +
+                             jpeg_nqtables*jpeg_qtable_length + 1)
+
+
+class JPEGParser(Module):
+    """Extract the scan data from a JFIF stream
+
+    Headers are parsed to get the image size, the subsampling and the
+    quantization tables, which are stored in the memory bank of the frame
+    (self.qtables, two banks of two 64-byte tables in zigzag order). Frame
+    informations are queued on self.info at the start of the scan, the scan
+    data (without EOI) is sent on self.source and the number of scan bytes is
+    queued on self.end at the end of the frame.
+
+    Frames without scan (encoder markers) are dropped.
+    """
+    def __init__(self):
         self.sink = sink = Sink([("data", 8)])
-        self.source = source = Source(eth_rtp_user_description(8))
+        self.source = source = Source([("data", 8)])
+        self.info = Source([("width", 8), ("height", 8), ("type", 8), ("bank", 1)])
+        self.end = Source([("bytes", 32)])
+
+        self.qtables = Memory(8, 2*jpeg_nqtables*jpeg_qtable_length)
 
         # # #
 
-        self.submodules.fifo = fifo = SyncFIFO([("data", 8)], fifo_depth)
-        self.comb += Record.connect(sink, fifo.sink)
+        qtables_wr = self.qtables.get_port(write_capable=True)
+        self.specials += self.qtables, qtables_wr
+
+        marker = Signal(8)
+        marker_load = Signal()
+        length = Signal(16)
+        length_msb_load = Signal()
+        length_lsb_load = Signal()
+        self.sync += [
+            If(marker_load, marker.eq(sink.data)),
+            If(length_msb_load, length[8:16].eq(sink.data)),
+            If(length_lsb_load, length[0:8].eq(sink.data))
+        ]
+        offset = Signal(16)
+        offset_clr = Signal()
+        offset_inc = Signal()
+        self.sync += \
+            If(offset_clr,
+                offset.eq(0)
+            ).Elif(offset_inc,
+                offset.eq(offset + 1)
+            )
 
-        self.submodules.level = level = FlipFlop(max=fifo_depth+1)
-        self.comb += level.d.eq(fifo.fifo.level)
+        # frame informations (SOF0/SOF1 segments)
+        width = Signal(16)
+        height = Signal(16)
+        sampling = Signal(8)
+        self.sync += \
+            If(offset_inc & ((marker == 0xc0) | (marker == 0xc1)),
+                Case(offset, {
+                    1: height[8:16].eq(sink.data),
+                    2: height[0:8].eq(sink.data),
+                    3: width[8:16].eq(sink.data),
+                    4: width[0:8].eq(sink.data),
+                    7: sampling.eq(sink.data)
+                })
+            )
 
-        self.submodules.counter = counter = Counter(max=fifo_depth)
+        # quantization tables (DQT segments, 8-bit precision)
+        bank = Signal()
+        bank_toggle = Signal()
+        qtable = Signal()
+        qtable_index = Signal(max=jpeg_qtable_length+1)
+        dqt = Signal()
+        self.comb += dqt.eq(offset_inc & (marker == 0xdb))
+        self.sync += [
+            If(bank_toggle, bank.eq(~bank)),
+            If(offset_clr,
+                qtable_index.eq(0)
+            ).Elif(dqt,
+                If(qtable_index == 0,
+                    qtable.eq(sink.data[0])
+                ),
+                If(qtable_index == jpeg_qtable_length,
+                    qtable_index.eq(0)
+                ).Else(
+                    qtable_index.eq(qtable_index + 1)
+                )
+            )
+        ]
+        self.comb += [
+            qtables_wr.adr.eq(Cat((qtable_index - 1)[:log2_int(jpeg_qtable_length)], qtable, bank)),
+            qtables_wr.dat_w.eq(sink.data),
+            qtables_wr.we.eq(dqt & (qtable_index != 0))
+        ]
 
-        self.submodules.flush_timer = WaitTimer(10000)
-        flush = Signal()
         self.comb += [
-            flush.eq((fifo.fifo.level > 0) & self.flush_timer.done)
+            self.info.width.eq(width[3:]),
+            self.info.height.eq(height[3:]),
+            # 4:2:2 (type 0) or 4:2:0 (type 1), from the luma sampling factors
+            self.info.type.eq(sampling == 0x22),
+            self.info.bank.eq(bank)
         ]
 
+        # scan bytes
+        scan_bytes = Signal(32)
+        scan_bytes_clr = Signal()
+        self.sync += \
+            If(scan_bytes_clr,
+                scan_bytes.eq(0)
+            ).Elif(source.stb & source.ack,
+                scan_bytes.eq(scan_bytes + 1)
+            )
+        self.comb += self.end.bytes.eq(scan_bytes)
+
         self.submodules.fsm = fsm = FSM(reset_state="IDLE")
+        # a new frame can only be parsed when the bank it will use is no
+        # longer used by a pending frame
         fsm.act("IDLE",
-          self.flush_timer.wait.eq(fifo.fifo.level > 0),
-            If((fifo.fifo.level >= 256) | flush,
-                level.ce.eq(1),
-                counter.reset.eq(1),
-                NextState("SEND")
+            sink.ack.eq(self.info.ack),
+            If(sink.stb & self.info.ack & (sink.data == 0xff),
+                NextState("MARKER")
             )
         )
-        fsm.act("SEND",
-            source.stb.eq(fifo.source.stb),
-            source.sop.eq(counter.value == 0),
-            If(level.q == 0,
-                source.eop.eq(1),
+        fsm.act("HEADER",
+            sink.ack.eq(1),
+            If(sink.stb & (sink.data == 0xff),
+                NextState("MARKER")
+            )
+        )
+        fsm.act("MARKER",
+            sink.ack.eq(1),
+            offset_clr.eq(1),
+            If(sink.stb,
+                marker_load.eq(1),
+                If(sink.data == 0xff,
+                    NextState("MARKER")
+                ).Elif(sink.data == 0xd9,
+                    NextState("IDLE")
+                ).Elif((sink.data == 0xd8) | (sink.data == 0x01) | (sink.data[3:] == (0xd0 >> 3)),
+                    NextState("HEADER")
+                ).Else(
+                    NextState("LENGTH_MSB")
+                )
+            )
+        )
+        fsm.act("LENGTH_MSB",
+            sink.ack.eq(1),
+            If(sink.stb,
+                length_msb_load.eq(1),
+                NextState("LENGTH_LSB")
+            )
+        )
+        fsm.act("LENGTH_LSB",
+            sink.ack.eq(1),
+            If(sink.stb,
+                length_lsb_load.eq(1),
+                NextState("SEGMENT")
+            )
+        )
+        fsm.act("SEGMENT",
+            If(offset == length - 2,
+                If(marker == 0xda,
+                    self.info.stb.eq(1),
+                    bank_toggle.eq(1),
+                    scan_bytes_clr.eq(1),
+                    NextState("SCAN")
+                ).Else(
+                    NextState("HEADER")
+                )
             ).Else(
-                source.eop.eq(counter.value == (level.q-1)),
-            ),
-            source.src_port.eq(udp_port),
-            source.dst_port.eq(udp_port),
-            source.ip_address.eq(ip_address),
-            If(level.q == 0,
-                source.length.eq(1),
+                sink.ack.eq(1),
+                offset_inc.eq(sink.stb)
+            )
+        )
+        fsm.act("SCAN",
+            source.data.eq(sink.data),
+            If(sink.data == 0xff,
+                sink.ack.eq(1),
+                If(sink.stb,
+                    NextState("SCAN_FF")
+                )
             ).Else(
-                source.length.eq(level.q),
-            ),
-            source.data.eq(fifo.source.data),
-            fifo.source.ack.eq(source.ack),
-            If(source.stb & source.ack,
-                counter.ce.eq(1),
-                If(source.eop,
+                source.stb.eq(sink.stb),
+                sink.ack.eq(source.ack)
+            )
+        )
+        fsm.act("SCAN_FF",
+            If(sink.data == 0xd9,
+                self.end.stb.eq(sink.stb),
+                sink.ack.eq(self.end.ack),
+                If(sink.stb & self.end.ack,
                     NextState("IDLE")
                 )
+            ).Else(
+                # the held FF is part of the scan data (stuffing, RSTn)
+                source.stb.eq(sink.stb),
+                source.data.eq(0xff),
+                If(sink.stb & source.ack,
+                    NextState("SCAN")
+                )
             )
         )
 
 
-class EncoderRTPPacketizer(Packetizer):
-    def __init__(self):
-        Packetizer.__init__(self,
-            eth_rtp_description(8),
-            eth_udp_user_description(8),
-            rtp_header)
+class RTPJPEGSender(Module, AutoCSR):
+    """Stream the encoder output in RTP/JPEG packets (RFC 2435)
 
+    Packets carry up to payload_size bytes (RTP and JPEG headers included,
+    1472 bytes fills an Ethernet MTU of 1500 bytes, at least
+    rtp_jpeg_min_payload_size), the last packet of each frame is closed on
+    the end of the frame and has the RTP marker bit set. A packet is only
+    sent full before the end of the frame is known if more scan bytes follow,
+    so that the last packet is never empty.
+    The RTP timestamp is a 90kHz clock sampled at the start of the scan of
+    each frame.
 
-class EncoderRTPSender(Module):
-    def __init__(self):
-        self.sink = sink = Sink(eth_rtp_user_description(8))
+    With nsources > 1, the frames of source n are sent with ssrc + n, each
+    source having its own sequence numbers.
+    """
+    def __init__(self, ip_address, udp_port, clk_freq, fifo_depth=2048, max_payload_size=1472, nsources=1):
+        assert max_payload_size >= rtp_jpeg_min_payload_size
+        assert fifo_depth > max_payload_size
+        self.sink = sink = Sink([("data", 8)])
         self.source = source = Source(eth_udp_user_description(8))
 
+        self._payload_size = CSRStorage(16, reset=max_payload_size)
+        self._ssrc = CSRStorage(32, reset=1)
+
         # # #
 
+        self.submodules.async_fifo = async_fifo = RenameClockDomains(AsyncFIFO([("data", 8)], 4),
+                                          {"write": "encoder", "read": "sys"})
+        self.submodules.parser = parser = JPEGParser()
+        self.submodules.fifo = fifo = SyncFIFO([("data", 8)], fifo_depth)
+        self.submodules.info_fifo = info_fifo = SyncFIFO([("width", 8), ("height", 8), ("type", 8),
+                                                          ("bank", 1), ("timestamp", 32)], 2)
+        self.submodules.end_fifo = end_fifo = SyncFIFO([("bytes", 32)], 2)
+        self.comb += [
+            Record.connect(sink, async_fifo.sink),
+            Record.connect(async_fifo.source, parser.sink),
+            Record.connect(parser.source, fifo.sink),
+            Record.connect(parser.end, end_fifo.sink)
+        ]
+
+        payload_size = Signal(16)
+        self.comb += \
+            If(self._payload_size.storage > max_payload_size,
+                payload_size.eq(max_payload_size)
+            ).Elif(self._payload_size.storage < rtp_jpeg_min_payload_size,
+                payload_size.eq(rtp_jpeg_min_payload_size)
+            ).Else(
+                payload_size.eq(self._payload_size.storage)
+            )
+
+        # 90kHz media clock
         timestamp = Signal(32)
-        self.sync += timestamp.eq(timestamp+1)
+        phase = Signal(32)
+        phase_next = Signal(33)
+        self.comb += phase_next.eq(phase + rtp_clock_freq)
+        self.sync += \
+            If(phase_next >= clk_freq,
+                phase.eq(phase_next - clk_freq),
+                timestamp.eq(timestamp + 1)
+            ).Else(
+                phase.eq(phase_next)
+            )
+
+        self.comb += [
+            info_fifo.sink.stb.eq(parser.info.stb),
+            info_fifo.sink.width.eq(parser.info.width),
+            info_fifo.sink.height.eq(parser.info.height),
+            info_fifo.sink.type.eq(parser.info.type),
+            info_fifo.sink.bank.eq(parser.info.bank),
+            info_fifo.sink.timestamp.eq(timestamp),
+            parser.info.ack.eq(info_fifo.sink.ack)
+        ]
+        info = info_fifo.source
+
+        # scan bytes of the current frame already sent (fragment offset)
+        sent = Signal(32)
+        sent_inc = Signal()
+        sent_clr = Signal()
+
+        first = Signal()
+        header_length = Signal(8)
+        max_chunk = Signal(16)
+        self.comb += [
+            first.eq(sent == 0),
+            If(first,
+                header_length.eq(rtp_header_length + jpeg_header_length + jpeg_qtable_header_length),
+                max_chunk.eq(payload_size - (rtp_header_length + jpeg_header_length +
+                             jpeg_qtable_header_length + jpeg_nqtables*jpeg_qtable_length))
+            ).Else(
+                header_length.eq(rtp_header_length + jpeg_header_length),
+                max_chunk.eq(payload_size - (rtp_header_length + jpeg_header_length))
+            )
+        ]
+
+        bytes_to_end = Signal(32)
+        self.comb += bytes_to_end.eq(end_fifo.source.bytes - sent)
+
+        chunk = Signal(16)
+        chunk_update = Signal()
+        chunk_next = Signal(16)
+        last = Signal()
+        with_qtables = Signal()
+        self.comb += \
+            If(end_fifo.source.stb & (bytes_to_end <= max_chunk),
+                chunk_next.eq(bytes_to_end)
+            ).Else(
+                chunk_next.eq(max_chunk)
+            )
+        self.sync += [
+            If(chunk_update,
+                chunk.eq(chunk_next),
+                last.eq(end_fifo.source.stb & (bytes_to_end <= max_chunk)),
+                with_qtables.eq(first)
+            ),
+            If(sent_clr,
+                sent.eq(0)
+            ).Elif(sent_inc,
+                sent.eq(sent + chunk)
+            )
+        ]
+
+        # frame sources
+        frame_source = Signal(max=max(nsources, 2))
+        frame_done = Signal()
+        if nsources > 1:
+            self.submodules.frame_sources = FrameSources(nsources)
+            self.comb += [
+                frame_source.eq(self.frame_sources.current),
+                self.frame_sources.frame_done.eq(frame_done)
+            ]
+        ssrc = Signal(32)
+        self.comb += ssrc.eq(self._ssrc.storage + frame_source)
+
+        sequence_numbers = Array(Signal(16) for i in range(nsources))
+        sequence_number = Signal(16)
+        sequence_number_inc = Signal()
+        self.comb += sequence_number.eq(sequence_numbers[frame_source])
+        self.sync += \
+            If(sequence_number_inc,
+                sequence_numbers[frame_source].eq(sequence_number + 1)
+            )
+
+        # bytes of the packet
+        index = Signal(16)
+        index_clr = Signal()
+        index_inc = Signal()
+        self.sync += \
+            If(index_clr,
+                index.eq(0)
+            ).Elif(index_inc,
+                index.eq(index + 1)
+            )
 
-        sequence_number = Counter(16)
-        self.submodules += sequence_number
+        remaining = Signal(16)
+        remaining_load = Signal()
+        self.sync += \
+            If(remaining_load,
+                remaining.eq(header_length + Mux(first, jpeg_nqtables*jpeg_qtable_length, 0) +
+                             chunk_next)
+            ).Elif(source.stb & source.ack,
+                remaining.eq(remaining - 1)
+            )
+
+        length = Signal(16)
+        self.sync += \
+            If(remaining_load,
+                length.eq(header_length + Mux(first, jpeg_nqtables*jpeg_qtable_length, 0) +
+                          chunk_next)
+            )
+
+        header = [
+            # RTP header
+            (rtp_version << 6),
+            Cat(Replicate(0, 7), last) | rtp_payload_type_jpeg,
+            sequence_number[8:16], sequence_number[0:8],
+            info.timestamp[24:32], info.timestamp[16:24], info.timestamp[8:16], info.timestamp[0:8],
+            ssrc[24:32], ssrc[16:24], ssrc[8:16], ssrc[0:8],
+            # JPEG header
+            0,
+            sent[16:24], sent[8:16], sent[0:8],
+            info.type,
+            jpeg_q_dynamic,
+            info.width,
+            info.height,
+            # quantization table header (first packet of each frame)
+            0,
+            0,
+            (jpeg_nqtables*jpeg_qtable_length) >> 8, (jpeg_nqtables*jpeg_qtable_length) & 0xff
+        ]
+        header_data = Signal(8)
+        self.comb += Case(index, {i: header_data.eq(v) for i, v in enumerate(header)})
+
+        qtables_rd = parser.qtables.get_port(async_read=True)
+        self.specials += qtables_rd
+        self.comb += qtables_rd.adr.eq(Cat(index[:log2_int(jpeg_nqtables*jpeg_qtable_length)], info.bank))
 
-        self.submodules.packetizer = packetizer = EncoderRTPPacketizer()
         self.comb += [
-            packetizer.sink.stb.eq(sink.stb),
-            packetizer.sink.sop.eq(sink.sop),
-            packetizer.sink.eop.eq(sink.eop),
-            sink.ack.eq(packetizer.sink.ack),
-            packetizer.sink.ver.eq(0x2),
-            packetizer.sink.p.eq(0),
-            packetizer.sink.x.eq(0),
-            packetizer.sink.cc.eq(0),
-            packetizer.sink.m.eq(0),
-            packetizer.sink.pt.eq(26), #JPEG
-            packetizer.sink.sequence_number.eq(sequence_number.value),
-            packetizer.sink.timestamp.eq(timestamp),
-            packetizer.sink.ssrc.eq(1),
-            packetizer.sink.data.eq(sink.data)
+            source.eop.eq(remaining == 1),
+            source.src_port.eq(udp_port),
+            source.dst_port.eq(udp_port),
+            source.ip_address.eq(ip_address),
+            source.length.eq(length)
         ]
 
         self.submodules.fsm = fsm = FSM(reset_state="IDLE")
         fsm.act("IDLE",
-            packetizer.source.ack.eq(1),
-            If(packetizer.source.stb & packetizer.source.sop,
-                packetizer.source.ack.eq(0),
-                NextState("SEND")
+            index_clr.eq(1),
+            # without the end of the frame, a full chunk is only sent if
+            # more bytes follow: the frame could end with this chunk
+            If(info.stb & ((end_fifo.source.stb & ((bytes_to_end <= max_chunk) |
+                                                   (fifo.fifo.level >= max_chunk))) |
+                           (fifo.fifo.level > max_chunk)),
+                chunk_update.eq(1),
+                remaining_load.eq(1),
+                NextState("HEADER")
+            )
+        )
+        fsm.act("HEADER",
+            source.stb.eq(1),
+            source.sop.eq(index == 0),
+            source.data.eq(header_data),
+            If(source.ack,
+                index_inc.eq(1),
+                If(source.eop,
+                    NextState("END")
+                ).Elif(index == rtp_header_length + jpeg_header_length - 1,
+                    If(with_qtables,
+                        NextState("QTABLE_HEADER")
+                    ).Else(
+                        index_clr.eq(1),
+                        NextState("DATA")
+                    )
+                )
+            )
+        )
+        fsm.act("QTABLE_HEADER",
+            source.stb.eq(1),
+            source.data.eq(header_data),
+            If(source.ack,
+                If(index == rtp_header_length + jpeg_header_length + jpeg_qtable_header_length - 1,
+                    index_clr.eq(1),
+                    NextState("QTABLES")
+                ).Else(
+                    index_inc.eq(1)
+                )
+            )
+        )
+        fsm.act("QTABLES",
+            source.stb.eq(1),
+            source.data.eq(qtables_rd.dat_r),
+            If(source.ack,
+                index_inc.eq(1),
+                If(source.eop,
+                    NextState("END")
+                ).Elif(index == jpeg_nqtables*jpeg_qtable_length - 1,
+                    index_clr.eq(1),
+                    NextState("DATA")
+                )
+            )
+        )
+        fsm.act("DATA",
+            source.stb.eq(fifo.source.stb),
+            source.data.eq(fifo.source.data),
+            fifo.source.ack.eq(source.ack),
+            If(source.stb & source.ack & source.eop,
+                NextState("END")
             )
         )
-        fsm.act("SEND",
-            Record.connect(packetizer.source, source),
-            source.src_port.eq(sink.src_port),
-            source.dst_port.eq(sink.dst_port),
-            source.ip_address.eq(sink.ip_address),
-            source.length.eq(sink.length + rtp_header.length),
-            If(source.stb & source.eop & source.ack,
-                sequence_number.ce.eq(1),
-                NextState("IDLE"),
-            )
-        )
\ No newline at end of file
+        fsm.act("END",
+            sequence_number_inc.eq(1),
+            If(last,
+                info.ack.eq(1),
+                end_fifo.source.ack.eq(1),
+                frame_done.eq(1),
+                sent_clr.eq(1)
+            ).Else(
+                sent_inc.eq(1)
+            ),
+            NextState("IDLE")
+        )
@@ -0,0 +1,100 @@
+from migen.fhdl.std import *
+from migen.sim.generic import run_simulation
+
+from gateware.streamer.rtp import *
+from gateware.csc.test.common import *
+
+
+payload_size = 200
+width = 64
+height = 32
+
+
+def jfif(scan, qtables):
+    # minimal JFIF frame (4:2:2), scan without FF bytes
+    data = [0xff, 0xd8]
+    data += [0xff, 0xdb, 0x00, 2 + 2*65]
+    for i, qtable in enumerate(qtables):
+        data += [i] + qtable
+    data += [0xff, 0xc0, 0x00, 17, 8, height >> 8, height & 0xff, width >> 8, width & 0xff,
+             3, 1, 0x21, 0, 2, 0x11, 1, 3, 0x11, 1]
+    data += [0xff, 0xda, 0x00, 12, 3, 1, 0x00, 2, 0x11, 3, 0x11, 0, 63, 0]
+    data += scan
+    data += [0xff, 0xd9]
+    return data
+
+
+def packetize(scan, qtables, sequence_number):
+    # RTP/JPEG packets of a frame, timestamp bytes set to None
+    packets = []
+    offset = 0
+    while True:
+        header = [0, offset >> 16, (offset >> 8) & 0xff, offset & 0xff, 0, jpeg_q_dynamic,
+                  width//8, height//8]
+        if offset == 0:
+            header += [0, 0, (2*jpeg_qtable_length) >> 8, (2*jpeg_qtable_length) & 0xff]
+            header += qtables[0] + qtables[1]
+        chunk = payload_size - rtp_header_length - len(header)
+        last = offset + chunk >= len(scan)
+        packets.append([rtp_version << 6, (last << 7) | rtp_payload_type_jpeg,
+                        sequence_number >> 8, sequence_number & 0xff] + [None]*4 + [0, 0, 0, 1] +
+                       header + scan[offset:offset + chunk])
+        sequence_number += 1
+        offset += chunk
+        if last:
+            return packets
+
+
+class TB(Module):
+    def __init__(self):
+        # simulation only supports sys clock domain
+        self.submodules.rtp = RenameClockDomains(RTPJPEGSender(convert_ip("192.168.1.15"), 8000, 100000000,
+                                                               fifo_depth=256, max_payload_size=payload_size),
+                                                 {"encoder": "sys"})
+        self.comb += self.rtp.source.ack.eq(1)
+
+        # scan lengths: exact multiples of the chunks (no empty last packet),
+        # one packet, exactly the first chunk
+        first_chunk = payload_size - (rtp_header_length + jpeg_header_length +
+                                      jpeg_qtable_header_length + 2*jpeg_qtable_length)
+        chunk = payload_size - (rtp_header_length + jpeg_header_length)
+        lengths = [first_chunk + 2*chunk, 100, first_chunk, first_chunk + chunk + 1]
+        self.data = []
+        self.reference = []
+        for length in lengths:
+            scan = [randn(0xff) for i in range(length)]
+            qtables = [[randn(0x100) for i in range(jpeg_qtable_length)] for j in range(2)]
+            self.data += jfif(scan, qtables)
+            self.reference += packetize(scan, qtables, len(self.reference))
+
+    def gen_simulation(self, selfp):
+        data = list(self.data)
+        packets = []
+        packet = []
+        sink = selfp.rtp.sink
+        source = selfp.rtp.source
+        errors = 0
+        while len(packets) < len(self.reference):
+            if sink.stb and sink.ack:
+                data.pop(0)
+            sink.stb = len(data) != 0
+            if len(data):
+                sink.data = data[0]
+            if source.stb:
+                packet.append(source.data)
+                if source.eop:
+                    if source.length != len(packet):
+                        errors += 1
+                    packets.append(packet)
+                    packet = []
+            yield
+
+        for n, (p, r) in enumerate(zip(packets, self.reference)):
+            if len(p) != len(r) or any(b is not None and a != b for a, b in zip(p, r)):
+                print("packet {}: {} bytes (expected {})".format(n, len(p), len(r)))
+                errors += 1
+        print("packets: {}, errors: {}".format(len(packets), errors))
+
+
+if __name__ == "__main__":
+    run_simulation(TB(), ncycles=16384, vcd_name="my.vcd", keep_files=True)
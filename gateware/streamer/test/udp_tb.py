@@ -0,0 +1,70 @@
+from migen.fhdl.std import *
+from migen.sim.generic import run_simulation
+
+from gateware.streamer import UDPStreamer
+from gateware.csc.test.common import *
+
+
+def jpeg_frame(length):
+    return [0xff, 0xd8] + [randn(0xff) for i in range(length - 4)] + [0xff, 0xd9]
+
+
+def datagrams(frame, payload_size):
+    return [frame[i:i + payload_size] for i in range(0, len(frame), payload_size)]
+
+
+class TB(Module):
+    def __init__(self):
+        # simulation only supports sys clock domain
+        self.submodules.udp = RenameClockDomains(UDPStreamer(convert_ip("192.168.1.15"), 8000,
+                                                             fifo_depth=64, max_payload_size=16),
+                                                 {"encoder": "sys"})
+        self.comb += self.udp.source.ack.eq(1)
+
+        # frames (data, raw) streamed with payload_size: jpeg frames closed on
+        # the end of image, raw frames on eof. payload_size 0 is clamped to 1.
+        self.tests = []
+        for payload_size in [16, 40, 0]:
+            frames = [(jpeg_frame(40), 0), (jpeg_frame(7), 0), ([randn(0x100) for i in range(20)], 1)]
+            self.tests.append((payload_size, frames))
+
+    def gen_simulation(self, selfp):
+        sink = selfp.udp.sink
+        source = selfp.udp.source
+        errors = 0
+        for payload_size, frames in self.tests:
+            selfp.udp._payload_size.storage = payload_size
+            data = []
+            reference = []
+            for frame, raw in frames:
+                data += [(b, raw, raw and i == len(frame) - 1) for i, b in enumerate(frame)]
+                reference += datagrams(frame, min(max(payload_size, 1), 16))
+
+            received = []
+            datagram = []
+            cycles = 0
+            while len(received) < len(reference) and cycles < 8192:
+                if sink.stb and sink.ack:
+                    data.pop(0)
+                sink.stb = len(data) != 0
+                if len(data):
+                    sink.data, sink.raw, sink.eof = data[0]
+                if source.stb:
+                    datagram.append(source.data)
+                    if source.eop:
+                        if source.length != len(datagram):
+                            errors += 1
+                        received.append(datagram)
+                        datagram = []
+                cycles += 1
+                yield
+
+            if received != reference:
+                print("payload_size {}: {} datagrams (expected {})".format(payload_size,
+                      len(received), len(reference)))
+                errors += 1
+        print("errors: {}".format(errors))
+
+
+if __name__ == "__main__":
+    run_simulation(TB(), ncycles=32768, vcd_name="my.vcd", keep_files=True)
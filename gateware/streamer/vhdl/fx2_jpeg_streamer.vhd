@@ -30,6 +30,7 @@ entity fx2_jpeg_streamer is
       sink_stb  : in  std_logic;
       sink_ack  : out std_logic;
       sink_data : in  std_logic_vector(7 downto 0);
+      sink_eof  : in  std_logic;             -- last byte of the frame (EOI)
 
       -- FX2 slave fifo interface
       ---------------------------------------------------------------------------
@@ -57,8 +58,6 @@ architecture rtl of fx2_jpeg_streamer is
   signal packet_fid     : std_logic;
   signal packet_counter : unsigned(11 downto 0);
 
-  signal sink_data_d : std_logic_vector(7 downto 0);
-
   type fsm_states is (S_RESET,
   	                  S_WAIT,
                       S_PACKET_END,
@@ -89,7 +88,6 @@ begin
       packet_fid     <= '0';
       packet_sent    <= '0';
       packet_counter <= (others => '0');
-      sink_data_d    <= (others => '0');
       fsm_state      <= S_RESET;
     elsif falling_edge(clk) then
 
@@ -103,7 +101,6 @@ begin
           packet_sent    <= '0';
           fsm_state      <= S_WAIT;
           fx2_data       <= (others => '0');
-          sink_data_d    <= (others => '0');
           packet_counter <= (others => '0');
 
         when S_WAIT =>
@@ -136,9 +133,9 @@ begin
 
             else
               fx2_wr_n    <= '0';
-              sink_data_d <= sink_data;
               fx2_data    <= sink_data;
-              if sink_data_d = X"FF" and sink_data = X"D9" then
+              -- commit a short packet at the end of each frame
+              if sink_eof = '1' then
                 packet_fid     <= not packet_fid;
                 fsm_state      <= S_PACKET_END;
                 packet_sent    <= '1';
@@ -14,8 +14,12 @@ from gateware.hdmi_in import HDMIIn
 from gateware.hdmi_out import HDMIOut
 from gateware.encoder import Encoder
 from gateware.encoder.dma import EncoderDMAReader
-from gateware.encoder.buffer import EncoderBuffer
+from gateware.encoder.buffer import EncoderBuffer, EncoderBufferStatus
+from gateware.encoder.stats import EncoderStats
+from gateware.encoder.ratecontrol import EncoderRateControl
+from gateware.encoder.raw import EncoderRaw
 from gateware.streamer import UDPStreamer
+from gateware.streamer.rtp import RTPJPEGSender
 
 from targets.common import *
 from targets.atlys_base import BaseSoC
@@ -71,37 +75,74 @@ EtherVideoMixerSoC = CreateVideoMixerSoC(EtherboneSoC)
 class HDMI2EthSoC(EtherVideoMixerSoC):
     csr_peripherals = (
         "encoder_reader",
+        "encoder_buffer_status",
         "encoder",
+        "encoder_stats",
+        "encoder_rate_control",
+        "encoder_raw",
+        "encoder_streamer",
     )
     csr_map_update(EtherVideoMixerSoC.csr_map, csr_peripherals)
+    interrupt_map = {
+        "encoder_reader": 5,
+    }
+    interrupt_map.update(EtherVideoMixerSoC.interrupt_map)
     mem_map = {
         "encoder": 0x50000000,  # (shadow @0xd0000000)
     }
     mem_map.update(EtherVideoMixerSoC.mem_map)
 
-    def __init__(self, platform, **kwargs):
+    def __init__(self, platform, streamer="udp", **kwargs):
         EtherVideoMixerSoC.__init__(self, platform, **kwargs)
 
-        lasmim = self.sdram.crossbar.get_master()
+        lasmim = self.sdram.qos.get_master(weight=32)
         self.submodules.encoder_reader = EncoderDMAReader(lasmim)
         self.submodules.encoder_cdc = RenameClockDomains(AsyncFIFO([("data", 128)], 4),
                                           {"write": "sys", "read": "encoder"})
-        self.submodules.encoder_buffer = RenameClockDomains(EncoderBuffer(), "encoder")
+        self.submodules.encoder_buffer = RenameClockDomains(EncoderBuffer(nblocks=64), "encoder")
+        self.submodules.encoder_buffer_status = EncoderBufferStatus(self.encoder_buffer)
         self.submodules.encoder_fifo = RenameClockDomains(SyncFIFO(EndpointDescription([("data", 16)], packetized=True), 16), "encoder")
         self.submodules.encoder = Encoder(platform)
         encoder_port = self.ethcore.udp.crossbar.get_port(8000, 8)
-        self.submodules.encoder_streamer = UDPStreamer(convert_ip("192.168.1.15"), 8000)
-
         self.comb += [
             platform.request("user_led", 0).eq(self.encoder_reader.source.stb),
             platform.request("user_led", 1).eq(self.encoder_reader.source.ack),
-            Record.connect(self.encoder_reader.source, self.encoder_cdc.sink),
             Record.connect(self.encoder_cdc.source, self.encoder_buffer.sink),
             Record.connect(self.encoder_buffer.source, self.encoder_fifo.sink),
-            Record.connect(self.encoder_fifo.source, self.encoder.sink),
-            Record.connect(self.encoder.source, self.encoder_streamer.sink),
-            Record.connect(self.encoder_streamer.source, encoder_port.sink)
+            Record.connect(self.encoder_fifo.source, self.encoder.sink)
         ]
+        if streamer == "rtp":
+            self.submodules.encoder_streamer = RTPJPEGSender(convert_ip("192.168.1.15"), 8000, self.clk_freq,
+                                                         nsources=2)
+            self.comb += [
+                Record.connect(self.encoder_reader.source, self.encoder_cdc.sink),
+                Record.connect(self.encoder.source, self.encoder_streamer.sink)
+            ]
+        else:
+            # uncompressed frames are only supported by the raw udp streamer
+            # hdmi_in0 frames are sent to port 8000, hdmi_in1 frames to port 8001
+            self.submodules.encoder_streamer = UDPStreamer(convert_ip("192.168.1.15"), 8000, nsources=2)
+            self.submodules.encoder_raw = EncoderRaw(with_header=True)
+            self.comb += [
+                self.encoder_reader.raster.eq(self.encoder_raw.enable.storage),
+                self.encoder_raw.h_width.eq(self.encoder_reader.h_width.storage),
+                self.encoder_raw.v_width.eq(self.encoder_reader.v_width.storage),
+                Record.connect(self.encoder_reader.source, self.encoder_raw.sink),
+                Record.connect(self.encoder_raw.encoder_source, self.encoder_cdc.sink),
+                Record.connect(self.encoder.source, self.encoder_raw.jpeg_sink),
+                Record.connect(self.encoder_raw.source, self.encoder_streamer.sink)
+            ]
+        self.comb += Record.connect(self.encoder_streamer.source, encoder_port.sink)
+        self.submodules.encoder_stats = EncoderStats([
+                ("reader", self.encoder_reader.source, "sys"),
+                ("cdc", self.encoder_cdc.source, "encoder"),
+                ("buffer", self.encoder_buffer.source, "encoder"),
+                ("fifo", self.encoder_fifo.source, "encoder"),
+                ("output", self.encoder.source, "encoder")
+            ], self.encoder.source, self.encoder.start, self.encoder_reader.frame_size)
+        self.submodules.encoder_rate_control = EncoderRateControl(self.encoder.bandwidth.count,
+                                                                  self.encoder.eoi,
+                                                                  self.clk_freq)
         self.add_wb_slave(mem_decoder(self.mem_map["encoder"]), self.encoder.bus)
         self.add_memory_region("encoder", self.mem_map["encoder"]+self.shadow_base, 0x2000)
 
@@ -5,7 +5,10 @@ from misoclib.soc import mem_decoder
 
 from gateware.encoder import Encoder
 from gateware.encoder.dma import EncoderDMAReader
-from gateware.encoder.buffer import EncoderBuffer
+from gateware.encoder.buffer import EncoderBuffer, EncoderBufferStatus
+from gateware.encoder.stats import EncoderStats
+from gateware.encoder.ratecontrol import EncoderRateControl
+from gateware.encoder.raw import EncoderRaw
 from gateware.streamer import USBStreamer
 
 from targets.common import *
@@ -15,9 +18,18 @@ from targets.atlys_video import VideoMixerSoC
 class HDMI2USBSoC(VideoMixerSoC):
     csr_peripherals = (
         "encoder_reader",
+        "encoder_buffer_status",
         "encoder",
+        "encoder_stats",
+        "encoder_rate_control",
+        "encoder_raw",
+        "usb_streamer",
     )
     csr_map_update(VideoMixerSoC.csr_map, csr_peripherals)
+    interrupt_map = {
+        "encoder_reader": 5,
+    }
+    interrupt_map.update(VideoMixerSoC.interrupt_map)
     mem_map = {
         "encoder": 0x70000000,  # (shadow @0xf0000000)
     }
@@ -26,24 +38,43 @@ class HDMI2USBSoC(VideoMixerSoC):
     def __init__(self, platform, **kwargs):
         VideoMixerSoC.__init__(self, platform, **kwargs)
 
-        lasmim = self.sdram.crossbar.get_master()
+        lasmim = self.sdram.qos.get_master(weight=32)
         self.submodules.encoder_reader = EncoderDMAReader(lasmim)
         self.submodules.encoder_cdc = RenameClockDomains(AsyncFIFO([("data", 128)], 4),
                                           {"write": "sys", "read": "encoder"})
-        self.submodules.encoder_buffer = RenameClockDomains(EncoderBuffer(), "encoder")
+        self.submodules.encoder_buffer = RenameClockDomains(EncoderBuffer(nblocks=64), "encoder")
+        self.submodules.encoder_buffer_status = EncoderBufferStatus(self.encoder_buffer)
         self.submodules.encoder_fifo = RenameClockDomains(SyncFIFO(EndpointDescription([("data", 16)], packetized=True), 16), "encoder")
         self.submodules.encoder = Encoder(platform)
         self.submodules.usb_streamer = USBStreamer(platform, platform.request("fx2"))
+        self.submodules.encoder_raw = EncoderRaw()
+        self.comb += [
+            self.encoder_reader.raster.eq(self.encoder_raw.enable.storage),
+            self.encoder_raw.h_width.eq(self.encoder_reader.h_width.storage),
+            self.encoder_raw.v_width.eq(self.encoder_reader.v_width.storage)
+        ]
 
         self.comb += [
             platform.request("user_led", 0).eq(self.encoder_reader.source.stb),
             platform.request("user_led", 1).eq(self.encoder_reader.source.ack),
-            Record.connect(self.encoder_reader.source, self.encoder_cdc.sink),
+            Record.connect(self.encoder_reader.source, self.encoder_raw.sink),
+            Record.connect(self.encoder_raw.encoder_source, self.encoder_cdc.sink),
             Record.connect(self.encoder_cdc.source, self.encoder_buffer.sink),
             Record.connect(self.encoder_buffer.source, self.encoder_fifo.sink),
             Record.connect(self.encoder_fifo.source, self.encoder.sink),
-            Record.connect(self.encoder.source, self.usb_streamer.sink)
+            Record.connect(self.encoder.source, self.encoder_raw.jpeg_sink),
+            Record.connect(self.encoder_raw.source, self.usb_streamer.sink)
         ]
+        self.submodules.encoder_stats = EncoderStats([
+                ("reader", self.encoder_reader.source, "sys"),
+                ("cdc", self.encoder_cdc.source, "encoder"),
+                ("buffer", self.encoder_buffer.source, "encoder"),
+                ("fifo", self.encoder_fifo.source, "encoder"),
+                ("output", self.encoder.source, "encoder")
+            ], self.encoder.source, self.encoder.start, self.encoder_reader.frame_size)
+        self.submodules.encoder_rate_control = EncoderRateControl(self.encoder.bandwidth.count,
+                                                                  self.encoder.eoi,
+                                                                  self.clk_freq)
         self.add_wb_slave(mem_decoder(self.mem_map["encoder"]), self.encoder.bus)
         self.add_memory_region("encoder", self.mem_map["encoder"]+self.shadow_base, 0x2000)
 
@@ -1,6 +1,11 @@
 import os
 import struct
 
+# misoc csr_address_width=14: 32 banks of 512 registers
+csr_banks = 32
+
 def csr_map_update(csr_map, csr_peripherals):
   csr_map.update(dict((n, v) for v, n in enumerate(csr_peripherals, start=max(csr_map.values()) + 1)))
-
+  assert max(csr_map.values()) < csr_banks, \
+    "CSR banks exhausted: {} (max {})".format(
+      ", ".join(n for n, v in sorted(csr_map.items(), key=lambda x: x[1]) if v >= csr_banks), csr_banks)
@@ -1,5 +1,6 @@
 from gateware.hdmi_in import HDMIIn
 from gateware.hdmi_out import HDMIOut
+from gateware.qos import LASMIQoS
 
 from targets.common import *
 from targets.opsis_base import default_subtarget as BaseSoC
@@ -21,27 +22,35 @@ def CreateVideoMixerSoC(base):
         interrupt_map = {
             "hdmi_in0": 3,
             "hdmi_in1": 4,
+            "hdmi_out0": 7,
+            "hdmi_out1": 8,
         }
         interrupt_map.update(base.interrupt_map)
     
         def __init__(self, platform, **kwargs):
             base.__init__(self, platform, **kwargs)
+            # scan-out and capture are real-time, other masters best-effort
+            # QoS registers in the sdram bank (sdram_qos_*): the CSR banks
+            # are all used on the encoder targets
+            self.sdram.submodules.qos = LASMIQoS(self.sdram.crossbar)
             self.submodules.hdmi_in0 = HDMIIn(
                 platform.request("hdmi_in", 0),
-                self.sdram.crossbar.get_master(),
+                self.sdram.qos.get_master(realtime=True),
                 fifo_depth=512)
             self.submodules.hdmi_in1 = HDMIIn(
                 platform.request("hdmi_in", 1),
-                self.sdram.crossbar.get_master(),
+                self.sdram.qos.get_master(realtime=True),
                 fifo_depth=512)
             self.submodules.hdmi_out0 = HDMIOut(
                 platform.request("hdmi_out", 0),
-                self.sdram.crossbar.get_master())
+                self.sdram.qos.get_master(realtime=True),
+                prefetch_lines=2)
             # Share clocking with hdmi_out0 since no PLL_ADV left.
             self.submodules.hdmi_out1 = HDMIOut(
                 platform.request("hdmi_out", 1),
-                self.sdram.crossbar.get_master(),
-                self.hdmi_out0.driver.clocking)
+                self.sdram.qos.get_master(realtime=True),
+                self.hdmi_out0.driver.clocking,
+                prefetch_lines=2)
     
             # all PLL_ADV are used: router needs help...
             platform.add_platform_command("""INST PLL_ADV LOC=PLL_ADV_X0Y0;""")
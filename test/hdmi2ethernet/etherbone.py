@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""Pipelined Etherbone client for bulk memory transfers
+
+Each Etherbone packet carries a single record (as handled by the LiteEth
+Etherbone slave) of up to words_per_record words. Up to window records are
+in flight, responses are matched to their requests with the base return
+address of the record (used as a tag) and records are retransmitted when
+their response does not come back in time. Writes are acknowledged by
+reading back the first written word in the same record.
+
+The Etherbone slave sends its responses to its own UDP port (not to the
+source port of the requests): the client receives on that port, with its
+own socket or with the socket of a LiteEthWishboneBridgeDriver.
+
+Run this file to benchmark the client against the local slave stand-in.
+"""
+import argparse
+import random
+import select
+import socket
+import struct
+import sys
+import threading
+import time
+from array import array
+from collections import deque
+
+etherbone_magic = 0x4e6f
+etherbone_version = 1
+etherbone_packet_header = struct.Struct(">HBB4x")
+etherbone_record_header = struct.Struct(">BBBB")
+etherbone_pf = 0x01
+etherbone_pr = 0x02
+etherbone_32bit = 0x44
+
+
+def _words_to_bytes(words):
+    a = array("I", words)
+    if sys.byteorder == "little":
+        a.byteswap()
+    return a.tobytes()
+
+
+def _bytes_to_words(data):
+    a = array("I")
+    a.frombytes(data)
+    if sys.byteorder == "little":
+        a.byteswap()
+    return a
+
+
+def _packet(record):
+    return etherbone_packet_header.pack(etherbone_magic, etherbone_version << 4,
+                                        etherbone_32bit) + record
+
+
+def read_record(tag, addresses):
+    return (etherbone_record_header.pack(0, 0x0f, 0, len(addresses)) +
+            struct.pack(">I", tag) + _words_to_bytes(addresses))
+
+
+def write_record(address, data, tag=None):
+    """Write record, acknowledged (read back of the first word) if tag is set"""
+    record = (etherbone_record_header.pack(0, 0x0f, len(data), 0 if tag is None else 1) +
+              struct.pack(">I", address) + _words_to_bytes(data))
+    if tag is not None:
+        record += struct.pack(">II", tag, address)
+    return record
+
+
+def parse_records(packet):
+    """(base address, write data) of the records of a packet"""
+    records = []
+    if len(packet) < etherbone_packet_header.size:
+        return records
+    magic, version, sizes = etherbone_packet_header.unpack_from(packet, 0)
+    if magic != etherbone_magic:
+        return records
+    offset = etherbone_packet_header.size
+    while offset + etherbone_record_header.size <= len(packet):
+        flags, byte_enable, wcount, rcount = etherbone_record_header.unpack_from(packet, offset)
+        offset += etherbone_record_header.size
+        if wcount:
+            base, = struct.unpack_from(">I", packet, offset)
+            data = _bytes_to_words(packet[offset + 4:offset + 4 + 4*wcount])
+            offset += 4 + 4*wcount
+            records.append((base, data, None, None))
+        if rcount:
+            base_ret, = struct.unpack_from(">I", packet, offset)
+            addresses = _bytes_to_words(packet[offset + 4:offset + 4 + 4*rcount])
+            offset += 4 + 4*rcount
+            if wcount:
+                records[-1] = records[-1][:2] + (base_ret, addresses)
+            else:
+                records.append((None, None, base_ret, addresses))
+    return records
+
+
+class EtherboneClient:
+    """Bulk transfers to the Etherbone slave at ip_address:udp_port
+
+    Responses are received on local_port (udp_port by default, where the
+    slave sends them). When a driver (LiteEthWishboneBridgeDriver, bound to
+    the same port) is given, its socket (created by driver.open()) is used
+    and no other socket is opened.
+    """
+    def __init__(self, ip_address, udp_port=20000, window=32, words_per_record=128,
+                 timeout=0.05, retries=20, driver=None, local_port=None):
+        assert words_per_record <= 255
+        self.destination = (ip_address, udp_port)
+        self.window = window
+        self.words_per_record = words_per_record
+        self.timeout = timeout
+        self.retries = retries
+        self.tag = 0
+
+        self.driver = driver
+        if driver is None:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4*1024*1024)
+            self._sock.bind(("", udp_port if local_port is None else local_port))
+
+        self.retransmits = 0
+
+    @property
+    def sock(self):
+        return self._sock if self.driver is None else self.driver.socket
+
+    def close(self):
+        if self.driver is None:
+            self._sock.close()
+
+    def _recv_into(self, buf):
+        # non blocking without changing the mode of a shared socket
+        return self.sock.recv_into(buf, 0, socket.MSG_DONTWAIT)
+
+    def _new_tag(self):
+        self.tag = (self.tag + 1) & 0xffffffff
+        return self.tag
+
+    def _drain(self):
+        # discard late responses of a previous transfer
+        buf = bytearray(2048)
+        while True:
+            try:
+                self._recv_into(buf)
+            except BlockingIOError:
+                return
+
+    def _transfer(self, requests):
+        """Send (tag, packet, on_response) requests with up to window in flight"""
+        self._drain()
+        queue = deque(requests)
+        pending = {}
+        buf = bytearray(2048)
+        while queue or pending:
+            now = time.time()
+            while queue and len(pending) < self.window:
+                tag, packet, on_response = queue.popleft()
+                self.sock.sendto(packet, self.destination)
+                pending[tag] = [packet, on_response, now + self.timeout, 0]
+
+            deadline = min(p[2] for p in pending.values())
+            select.select([self.sock], [], [], max(deadline - time.time(), 0))
+            while True:
+                try:
+                    n = self._recv_into(buf)
+                except BlockingIOError:
+                    break
+                for base, data, base_ret, addresses in parse_records(memoryview(buf)[:n]):
+                    p = pending.pop(base, None)
+                    if p is not None and data is not None:
+                        p[1](data)
+
+            now = time.time()
+            for tag, p in pending.items():
+                if p[2] <= now:
+                    if p[3] >= self.retries:
+                        raise IOError("No response from {}:{}".format(*self.destination))
+                    self.sock.sendto(p[0], self.destination)
+                    p[2] = now + self.timeout
+                    p[3] += 1
+                    self.retransmits += 1
+
+    def read_blocks(self, blocks):
+        """Read (address, length) blocks in a single pipelined transfer"""
+        results = []
+        requests = []
+        for address, length in blocks:
+            result = array("I", bytes(4*length))
+            results.append(result)
+            for offset in range(0, length, self.words_per_record):
+                n = min(self.words_per_record, length - offset)
+                tag = self._new_tag()
+                def on_response(data, result=result, offset=offset, n=n):
+                    result[offset:offset + n] = data[:n]
+                addresses = range(address + 4*offset, address + 4*(offset + n), 4)
+                requests.append((tag, _packet(read_record(tag, addresses)), on_response))
+        self._transfer(requests)
+        return results
+
+    def read_block(self, address, length):
+        """Read length words from address, returns an array of 32-bit words"""
+        return self.read_blocks([(address, length)])[0]
+
+    def write_block(self, address, data):
+        """Write the words of data from address"""
+        requests = []
+        for offset in range(0, len(data), self.words_per_record):
+            chunk = data[offset:offset + self.words_per_record]
+            tag = self._new_tag()
+            requests.append((tag, _packet(write_record(address + 4*offset, chunk, tag)),
+                             lambda data: None))
+        self._transfer(requests)
+
+    def read(self, address, length=None):
+        data = self.read_block(address, 1 if length is None else length)
+        return data[0] if length is None else list(data)
+
+    def write(self, address, data):
+        self.write_block(address, [data] if isinstance(data, int) else data)
+
+
+class BridgeBulk:
+    """read_block/write_block over a sequential wishbone bridge driver (UART)"""
+    def __init__(self, wb, words_per_transfer=128):
+        self.wb = wb
+        self.words_per_transfer = words_per_transfer
+
+    def read_blocks(self, blocks):
+        return [self.read_block(address, length) for address, length in blocks]
+
+    def read_block(self, address, length):
+        result = array("I")
+        for offset in range(0, length, self.words_per_transfer):
+            n = min(self.words_per_transfer, length - offset)
+            data = self.wb.read(address + 4*offset, n)
+            result.extend([data] if n == 1 else data)
+        return result
+
+    def write_block(self, address, data):
+        for offset in range(0, len(data), self.words_per_transfer):
+            self.wb.write(address + 4*offset, list(data[offset:offset + self.words_per_transfer]))
+
+
+class EtherboneSlaveStandIn(threading.Thread):
+    """Local Etherbone slave emulating a memory, with optional packet loss
+
+    As the LiteEth slave, responses are sent to a fixed port (reply_port,
+    udp_port by default) of the requester, not to the source port.
+    """
+    def __init__(self, base, size, ip_address="127.0.0.1", udp_port=20000, loss=0., reply_port=None):
+        threading.Thread.__init__(self, daemon=True)
+        self.base = base
+        self.memory = array("I", bytes(size))
+        self.loss = loss
+        self.reply_port = udp_port if reply_port is None else reply_port
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4*1024*1024)
+        self.sock.bind((ip_address, udp_port))
+        self.sock.settimeout(0.1)
+        self.running = True
+
+    def stop(self):
+        self.running = False
+        self.join()
+        self.sock.close()
+
+    def _index(self, address):
+        return (address - self.base)//4
+
+    def run(self):
+        while self.running:
+            try:
+                packet, (source_address, source_port) = self.sock.recvfrom(2048)
+            except socket.timeout:
+                continue
+            destination = (source_address, self.reply_port)
+            if random.random() < self.loss:
+                continue
+            magic, version, sizes = etherbone_packet_header.unpack_from(packet, 0)
+            if version & etherbone_pf:
+                self.sock.sendto(etherbone_packet_header.pack(etherbone_magic,
+                                                              (etherbone_version << 4) | etherbone_pr,
+                                                              etherbone_32bit), destination)
+                continue
+            reply = b""
+            for base, data, base_ret, addresses in parse_records(packet):
+                if data is not None:
+                    i = self._index(base)
+                    self.memory[i:i + len(data)] = data
+                if addresses is not None:
+                    values = [self.memory[self._index(a)] for a in addresses]
+                    reply += write_record(base_ret, values)
+            if reply and random.random() >= self.loss:
+                self.sock.sendto(_packet(reply), destination)
+
+
+def _get_args():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ip_address", default="127.0.0.1", help="Etherbone IP address")
+    parser.add_argument("--udp_port", default=20000, type=int, help="Etherbone UDP port")
+    parser.add_argument("--window", default=32, type=int, help="records in flight")
+    parser.add_argument("--words_per_record", default=128, type=int, help="words per record")
+    parser.add_argument("--size", default=1280*720*2, type=int, help="transfer size (bytes)")
+    parser.add_argument("--base", default=0x40000000, type=lambda x: int(x, 0), help="base address")
+    parser.add_argument("--loopback", action="store_true", help="run against the local stand-in")
+    parser.add_argument("--loss", default=0., type=float, help="stand-in packet loss probability")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = _get_args()
+    if args.loopback:
+        # the stand-in and the client share the host: responses go to
+        # another port
+        local_port = args.udp_port + 1
+        slave = EtherboneSlaveStandIn(args.base, args.size, args.ip_address, args.udp_port, args.loss,
+                                      reply_port=local_port)
+        slave.start()
+    else:
+        local_port = None
+    client = EtherboneClient(args.ip_address, args.udp_port, args.window, args.words_per_record,
+                             local_port=local_port)
+    length = args.size//4
+    data = [(i*0x31415979 + 1) & 0xffffffff for i in range(length)]
+
+    start = time.time()
+    client.write_block(args.base, data)
+    elapsed = time.time() - start
+    print("write: {:.3f}s ({:.2f} Mbit/s)".format(elapsed, args.size*8/elapsed/1e6))
+
+    start = time.time()
+    result = client.read_block(args.base, length)
+    elapsed = time.time() - start
+    print("read:  {:.3f}s ({:.2f} Mbit/s)".format(elapsed, args.size*8/elapsed/1e6))
+
+    errors = sum(a != b for a, b in zip(data, result))
+    print("errors: {}, retransmits: {}".format(errors, client.retransmits))
+    client.close()
+    if args.loopback:
+        slave.stop()
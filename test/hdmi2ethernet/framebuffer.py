@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""Decode the YCbCr 4:2:2 framebuffers written by gateware/hdmi_in/dma.py
+
+FrameExtraction packs 16-bit pixels (Y in bits 0-7, Cb/Cr in bits 8-15,
+Cb on even pixels and Cr on odd pixels of each line) in memory words of
+16*pack_factor bits, first pixel in the msbs. The CPU/Etherbone view of the
+memory is big endian (the lowest address holds the msbs of a memory word),
+so whatever the pack_factor, the 32-bit words read from a framebuffer are
+the pixels in raster order, two per word, first pixel in the msbs.
+
+Run this file to convert a raw dump (big endian 32-bit words) to png/raw.
+"""
+import argparse
+import struct
+import zlib
+
+import numpy as np
+
+
+# same as gateware/csc/rgb2ycbcr.py (floating point coefficients)
+def rgb2ycbcr_coefs(dw):
+    return {
+        "ca" : 0.1819,
+        "cb" : 0.0618,
+        "cc" : 0.6495,
+        "cd" : 0.5512,
+        "yoffset" : 2**(dw-4),
+        "coffset" : 2**(dw-1),
+        "ymax" : 2**dw-1,
+        "cmax" : 2**dw-1,
+        "ymin" : 0,
+        "cmin" : 0
+    }
+
+
+def unpack_ycbcr422(words, width, height, pack_factor=4):
+    """(y, cb_cr) planes (uint8, height x width) of a framebuffer
+
+    words are the 32-bit words of the framebuffer (as returned by
+    read_block) or a buffer of their big endian bytes.
+    """
+    assert (width*height) % pack_factor == 0, "frame must end on a memory word"
+    if isinstance(words, (bytes, bytearray, memoryview)):
+        data = np.frombuffer(words, dtype=">u2", count=width*height)
+    else:
+        data = np.frombuffer(words, dtype=np.uint32, count=width*height//2)
+        data = data.astype(">u4").view(">u2")
+    pixels = data.reshape(height, width)
+    return (pixels & 0xff).astype(np.uint8), (pixels >> 8).astype(np.uint8)
+
+
+def ycbcr422_to_444(y, cb_cr):
+    """Chroma upsampling (each chroma sample is shared by two pixels)"""
+    cb = np.repeat(cb_cr[:, 0::2], 2, axis=1)
+    cr = np.repeat(cb_cr[:, 1::2], 2, axis=1)
+    return y, cb, cr
+
+
+def ycbcr2rgb(y, cb, cr):
+    """RGB (uint8, height x width x 3) of YCbCr planes, inverse of RGB2YCbCr"""
+    coefs = rgb2ycbcr_coefs(8)
+    yraw = y.astype(np.float32) - coefs["yoffset"]
+    b = yraw + (cb.astype(np.float32) - coefs["coffset"])/coefs["cc"]
+    r = yraw + (cr.astype(np.float32) - coefs["coffset"])/coefs["cd"]
+    g = (yraw - coefs["ca"]*r - coefs["cb"]*b)/(1 - coefs["ca"] - coefs["cb"])
+    rgb = np.stack([r, g, b], axis=-1)
+    return np.clip(np.rint(rgb), 0, 255).astype(np.uint8)
+
+
+def decode(words, width, height, pack_factor=4):
+    """RGB image of a framebuffer"""
+    return ycbcr2rgb(*ycbcr422_to_444(*unpack_ycbcr422(words, width, height, pack_factor)))
+
+
+def yuy2(y, cb_cr):
+    """YUY2 bytes (Y0 Cb0 Y1 Cr0...) of a framebuffer, as sent by EncoderRaw"""
+    return np.stack([y, cb_cr], axis=-1).tobytes()
+
+
+def _png_chunk(f, kind, data):
+    f.write(struct.pack(">I", len(data)) + kind + data)
+    f.write(struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff))
+
+
+def write_png(filename, rgb, rows_per_chunk=64):
+    """Write a RGB image, compressed and written by blocks of rows"""
+    height, width, _ = rgb.shape
+    with open(filename, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        _png_chunk(f, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        compressor = zlib.compressobj(1)
+        for row in range(0, height, rows_per_chunk):
+            block = rgb[row:row + rows_per_chunk]
+            # filter type 0 (none) on each row
+            lines = np.zeros((block.shape[0], 1 + 3*width), dtype=np.uint8)
+            lines[:, 1:] = block.reshape(block.shape[0], -1)
+            data = compressor.compress(lines.tobytes())
+            if data:
+                _png_chunk(f, b"IDAT", data)
+        _png_chunk(f, b"IDAT", compressor.flush())
+        _png_chunk(f, b"IEND", b"")
+
+
+def write(filename, words, width, height, pack_factor=4, format="png"):
+    if format == "png":
+        write_png(filename, decode(words, width, height, pack_factor))
+    elif format == "rgb":
+        with open(filename, "wb") as f:
+            f.write(decode(words, width, height, pack_factor).tobytes())
+    elif format == "yuy2":
+        with open(filename, "wb") as f:
+            f.write(yuy2(*unpack_ycbcr422(words, width, height, pack_factor)))
+    else:
+        raise ValueError("Invalid format {}".format(format))
+
+
+def _get_args():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--width", default=1280, type=int, help="frame width")
+    parser.add_argument("--height", default=720, type=int, help="frame height")
+    parser.add_argument("--pack_factor", default=4, type=int, help="pixels per memory word")
+    parser.add_argument("--format", default="png", help="output format (png, rgb or yuy2)")
+    parser.add_argument("dump", help="raw framebuffer dump")
+    parser.add_argument("output", help="output file")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = _get_args()
+    with open(args.dump, "rb") as f:
+        data = f.read()
+    write(args.output, data, args.width, args.height, args.pack_factor, args.format)
@@ -2,6 +2,8 @@
 import argparse
 import importlib
 
+from etherbone import EtherboneClient, BridgeBulk
+
 
 def _get_args():
     parser = argparse.ArgumentParser()
@@ -22,9 +24,12 @@ if __name__ == "__main__":
         from misoclib.com.uart.software.wishbone import UARTWishboneBridgeDriver
         port = args.port if not args.port.isdigit() else int(args.port)
         wb = UARTWishboneBridgeDriver(port, args.baudrate, "../csr.csv", int(args.busword), debug=False)
+        wb.bulk = BridgeBulk(wb)
     elif args.bridge == "etherbone":
         from misoclib.com.liteeth.software.wishbone import LiteEthWishboneBridgeDriver
         wb = LiteEthWishboneBridgeDriver(args.ip_address, int(args.udp_port), "../csr.csv", int(args.busword), debug=False)
+        # shares the socket of the driver (bound to udp_port)
+        wb.bulk = EtherboneClient(args.ip_address, int(args.udp_port), driver=wb)
     else:
         ValueError("Invalid bridge {}".format(args.bridge))
 
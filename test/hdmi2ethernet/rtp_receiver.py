@@ -0,0 +1,585 @@
+#!/usr/bin/env python3
+"""Receive the RTP/JPEG (RFC 2435) stream of gateware/streamer/rtp.py
+
+receive:  depacketize the stream, reorder the packets in a bounded jitter
+          buffer, rebuild the JFIF frames and write them to per-frame files
+          or to a container (see test_capture.py). Loss, reorder, latency
+          and frame size statistics are reported every second.
+generate: packetize jpg files like the RTPJPEGSender does and send them over
+          UDP (with optional loss and reordering) to test the receiver.
+"""
+import argparse
+import random
+import select
+import socket
+import struct
+import time
+from collections import namedtuple
+
+from test_capture import FilesWriter, ContainerWriter, replay_frames
+
+rtp_header = struct.Struct(">BBHII")
+rtp_header_length = 12
+rtp_version = 2
+rtp_payload_type_jpeg = 26
+rtp_clock_freq = 90000
+
+jpeg_header = struct.Struct(">I BBBB")
+jpeg_header_length = 8
+jpeg_qtable_header = struct.Struct(">BBH")
+jpeg_qtable_header_length = 4
+jpeg_q_dynamic = 255
+
+RTPJPEGPacket = namedtuple("RTPJPEGPacket", "sequence_number timestamp ssrc marker "
+                                            "offset type q width height qtables payload "
+                                            "arrival")
+
+
+def parse_packet(data, arrival=0.):
+    """Parse a RTP/JPEG packet, returns None if the packet is invalid"""
+    if len(data) < rtp_header_length + jpeg_header_length:
+        return None
+    vpxcc, mpt, sequence_number, timestamp, ssrc = rtp_header.unpack_from(data, 0)
+    if vpxcc >> 6 != rtp_version or mpt & 0x7f != rtp_payload_type_jpeg:
+        return None
+    offset = rtp_header_length + 4*(vpxcc & 0x0f)
+    tspec_offset, _type, q, width, height = jpeg_header.unpack_from(data, offset)
+    fragment_offset = tspec_offset & 0xffffff
+    offset += jpeg_header_length
+    if _type >= 64:
+        # restart markers are not used by the encoder
+        return None
+    qtables = None
+    if q >= 128 and fragment_offset == 0:
+        mbz, precision, length = jpeg_qtable_header.unpack_from(data, offset)
+        offset += jpeg_qtable_header_length
+        if precision != 0 or length > len(data) - offset:
+            return None
+        qtables = bytes(data[offset:offset + length])
+        offset += length
+    return RTPJPEGPacket(sequence_number, timestamp, ssrc, mpt >> 7,
+                         fragment_offset, _type, q, width, height, qtables,
+                         bytes(data[offset:]), arrival)
+
+
+def seq_diff(a, b):
+    """Signed difference of two 16-bit sequence numbers"""
+    d = (a - b) & 0xffff
+    return d - 0x10000 if d >= 0x8000 else d
+
+
+class JitterBuffer:
+    """Reorder the packets of one SSRC by sequence number
+
+    Packets are released in order. When more than depth packets are waiting
+    for a missing one, the missing packets are declared lost. Release only
+    starts once startup packets are buffered so that packets reordered
+    before the first one received are not late.
+
+    The buffer resyncs on the sequence number of the stream (pending packets
+    are flushed) when a packet is more than depth packets away from the
+    expected one or after max_late consecutive late packets: a restarted
+    sender does not stall the receiver.
+
+    The interarrival jitter (RFC 3550) is estimated in timestamp units.
+    """
+    def __init__(self, depth=64, startup=8, max_late=16):
+        self.depth = depth
+        self.startup = min(startup, depth)
+        self.max_late = max_late
+        self.packets = {}
+        self.expected = None
+        self.highest = None
+        self.synced = False
+        self.consecutive_late = 0
+        self.flushed = []
+
+        self.transit = None
+        self.jitter = 0.
+
+        self.received = 0
+        self.lost = 0
+        self.reordered = 0
+        self.late = 0
+        self.duplicates = 0
+        self.resyncs = 0
+
+    def _update_jitter(self, packet):
+        transit = packet.arrival*rtp_clock_freq - packet.timestamp
+        if self.transit is not None:
+            d = abs(transit - self.transit)
+            if d < 2**31:
+                self.jitter += (d - self.jitter)/16
+        self.transit = transit
+
+    def _resync(self):
+        # pending packets are released before the new sequence, a None
+        # closes the frame in progress
+        self.flushed = self.flush() + [None]
+        self.expected = self.highest = None
+        self.synced = False
+        self.consecutive_late = 0
+        self.resyncs += 1
+
+    def push(self, packet):
+        self.received += 1
+        self._update_jitter(packet)
+        seq = packet.sequence_number
+        if self.expected is not None:
+            diff = seq_diff(seq, self.expected)
+            if diff < -self.depth or seq_diff(seq, self.highest) > self.depth:
+                self._resync()
+            elif diff < 0 and not self.synced:
+                # reordered before the first packets received
+                self.expected = seq
+            elif diff < 0:
+                self.late += 1
+                self.consecutive_late += 1
+                if self.consecutive_late >= self.max_late:
+                    self._resync()
+                return
+        if self.expected is None:
+            self.expected = self.highest = seq
+        self.consecutive_late = 0
+        if seq in self.packets:
+            self.duplicates += 1
+            return
+        if seq_diff(seq, self.highest) < 0:
+            self.reordered += 1
+        else:
+            self.highest = seq
+        self.packets[seq] = packet
+
+    def pop(self):
+        """Packets that can be released, None marks lost packets"""
+        released, self.flushed = self.flushed, []
+        if not self.synced:
+            if len(self.packets) < self.startup:
+                return released
+            self.synced = True
+        while self.packets:
+            if self.expected in self.packets:
+                released.append(self.packets.pop(self.expected))
+            elif len(self.packets) > self.depth:
+                self.lost += 1
+                released.append(None)
+            else:
+                break
+            self.expected = (self.expected + 1) & 0xffff
+        return released
+
+    def flush(self):
+        released, self.flushed = self.flushed, []
+        self.synced = True
+        while self.packets:
+            released += self.pop()
+            if self.packets:
+                self.lost += 1
+                released.append(None)
+                self.expected = (self.expected + 1) & 0xffff
+        return released
+
+
+# JFIF headers (RFC 2435 appendix A)
+
+zigzag = [
+     0,  1,  8, 16,  9,  2,  3, 10, 17, 24, 32, 25, 18, 11,  4,  5,
+    12, 19, 26, 33, 40, 48, 41, 34, 27, 20, 13,  6,  7, 14, 21, 28,
+    35, 42, 49, 56, 57, 50, 43, 36, 29, 22, 15, 23, 30, 37, 44, 51,
+    58, 59, 52, 45, 38, 31, 39, 46, 53, 60, 61, 54, 47, 55, 62, 63
+]
+
+jpeg_luma_quantizer = [
+    16, 11, 10, 16, 24, 40, 51, 61,
+    12, 12, 14, 19, 26, 58, 60, 55,
+    14, 13, 16, 24, 40, 57, 69, 56,
+    14, 17, 22, 29, 51, 87, 80, 62,
+    18, 22, 37, 56, 68, 109, 103, 77,
+    24, 35, 55, 64, 81, 104, 113, 92,
+    49, 64, 78, 87, 103, 121, 120, 101,
+    72, 92, 95, 98, 112, 100, 103, 99
+]
+
+jpeg_chroma_quantizer = [
+    17, 18, 24, 47, 99, 99, 99, 99,
+    18, 21, 26, 66, 99, 99, 99, 99,
+    24, 26, 56, 99, 99, 99, 99, 99,
+    47, 66, 99, 99, 99, 99, 99, 99,
+    99, 99, 99, 99, 99, 99, 99, 99,
+    99, 99, 99, 99, 99, 99, 99, 99,
+    99, 99, 99, 99, 99, 99, 99, 99,
+    99, 99, 99, 99, 99, 99, 99, 99
+]
+
+lum_dc_codelens = [0, 1, 5, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0, 0, 0]
+lum_dc_symbols = list(range(12))
+lum_ac_codelens = [0, 2, 1, 3, 3, 2, 4, 3, 5, 5, 4, 4, 0, 0, 1, 0x7d]
+lum_ac_symbols = [
+    0x01, 0x02, 0x03, 0x00, 0x04, 0x11, 0x05, 0x12, 0x21, 0x31, 0x41, 0x06, 0x13, 0x51, 0x61, 0x07,
+    0x22, 0x71, 0x14, 0x32, 0x81, 0x91, 0xa1, 0x08, 0x23, 0x42, 0xb1, 0xc1, 0x15, 0x52, 0xd1, 0xf0,
+    0x24, 0x33, 0x62, 0x72, 0x82, 0x09, 0x0a, 0x16, 0x17, 0x18, 0x19, 0x1a, 0x25, 0x26, 0x27, 0x28,
+    0x29, 0x2a, 0x34, 0x35, 0x36, 0x37, 0x38, 0x39, 0x3a, 0x43, 0x44, 0x45, 0x46, 0x47, 0x48, 0x49,
+    0x4a, 0x53, 0x54, 0x55, 0x56, 0x57, 0x58, 0x59, 0x5a, 0x63, 0x64, 0x65, 0x66, 0x67, 0x68, 0x69,
+    0x6a, 0x73, 0x74, 0x75, 0x76, 0x77, 0x78, 0x79, 0x7a, 0x83, 0x84, 0x85, 0x86, 0x87, 0x88, 0x89,
+    0x8a, 0x92, 0x93, 0x94, 0x95, 0x96, 0x97, 0x98, 0x99, 0x9a, 0xa2, 0xa3, 0xa4, 0xa5, 0xa6, 0xa7,
+    0xa8, 0xa9, 0xaa, 0xb2, 0xb3, 0xb4, 0xb5, 0xb6, 0xb7, 0xb8, 0xb9, 0xba, 0xc2, 0xc3, 0xc4, 0xc5,
+    0xc6, 0xc7, 0xc8, 0xc9, 0xca, 0xd2, 0xd3, 0xd4, 0xd5, 0xd6, 0xd7, 0xd8, 0xd9, 0xda, 0xe1, 0xe2,
+    0xe3, 0xe4, 0xe5, 0xe6, 0xe7, 0xe8, 0xe9, 0xea, 0xf1, 0xf2, 0xf3, 0xf4, 0xf5, 0xf6, 0xf7, 0xf8,
+    0xf9, 0xfa
+]
+chm_dc_codelens = [0, 3, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0]
+chm_dc_symbols = list(range(12))
+chm_ac_codelens = [0, 2, 1, 2, 4, 4, 3, 4, 7, 5, 4, 4, 0, 1, 2, 0x77]
+chm_ac_symbols = [
+    0x00, 0x01, 0x02, 0x03, 0x11, 0x04, 0x05, 0x21, 0x31, 0x06, 0x12, 0x41, 0x51, 0x07, 0x61, 0x71,
+    0x13, 0x22, 0x32, 0x81, 0x08, 0x14, 0x42, 0x91, 0xa1, 0xb1, 0xc1, 0x09, 0x23, 0x33, 0x52, 0xf0,
+    0x15, 0x62, 0x72, 0xd1, 0x0a, 0x16, 0x24, 0x34, 0xe1, 0x25, 0xf1, 0x17, 0x18, 0x19, 0x1a, 0x26,
+    0x27, 0x28, 0x29, 0x2a, 0x35, 0x36, 0x37, 0x38, 0x39, 0x3a, 0x43, 0x44, 0x45, 0x46, 0x47, 0x48,
+    0x49, 0x4a, 0x53, 0x54, 0x55, 0x56, 0x57, 0x58, 0x59, 0x5a, 0x63, 0x64, 0x65, 0x66, 0x67, 0x68,
+    0x69, 0x6a, 0x73, 0x74, 0x75, 0x76, 0x77, 0x78, 0x79, 0x7a, 0x82, 0x83, 0x84, 0x85, 0x86, 0x87,
+    0x88, 0x89, 0x8a, 0x92, 0x93, 0x94, 0x95, 0x96, 0x97, 0x98, 0x99, 0x9a, 0xa2, 0xa3, 0xa4, 0xa5,
+    0xa6, 0xa7, 0xa8, 0xa9, 0xaa, 0xb2, 0xb3, 0xb4, 0xb5, 0xb6, 0xb7, 0xb8, 0xb9, 0xba, 0xc2, 0xc3,
+    0xc4, 0xc5, 0xc6, 0xc7, 0xc8, 0xc9, 0xca, 0xd2, 0xd3, 0xd4, 0xd5, 0xd6, 0xd7, 0xd8, 0xd9, 0xda,
+    0xe2, 0xe3, 0xe4, 0xe5, 0xe6, 0xe7, 0xe8, 0xe9, 0xea, 0xf2, 0xf3, 0xf4, 0xf5, 0xf6, 0xf7, 0xf8,
+    0xf9, 0xfa
+]
+
+
+def make_qtables(q):
+    """Quantization tables (zigzag order) of a Q factor in [1, 99]"""
+    factor = min(max(q, 1), 99)
+    scale = 5000//factor if q < 50 else 200 - factor*2
+    tables = bytearray()
+    for table in jpeg_luma_quantizer, jpeg_chroma_quantizer:
+        for i in range(64):
+            tables.append(min(max((table[zigzag[i]]*scale + 50)//100, 1), 255))
+    return bytes(tables)
+
+
+def _segment(marker, data):
+    return bytes([0xff, marker]) + struct.pack(">H", len(data) + 2) + data
+
+
+def make_headers(_type, width, height, qtables):
+    """JFIF headers of a RTP/JPEG frame (width/height in 8-pixel units)"""
+    headers = b"\xff\xd8"
+    # luma and chroma tables (one table for both if only 64 bytes are sent)
+    chroma_table = 1 if len(qtables) >= 128 else 0
+    for i in range(chroma_table + 1):
+        headers += _segment(0xdb, bytes([i]) + qtables[64*i:64*(i+1)])
+    # 4:2:2 (type 0) or 4:2:0 (type 1)
+    sampling = 0x21 if _type & 0x3f == 0 else 0x22
+    headers += _segment(0xc0, struct.pack(">BHHB", 8, 8*height, 8*width, 3) +
+                              bytes([0, sampling, 0,
+                                     1, 0x11, chroma_table,
+                                     2, 0x11, chroma_table]))
+    for tc_th, codelens, symbols in [(0x00, lum_dc_codelens, lum_dc_symbols),
+                                     (0x10, lum_ac_codelens, lum_ac_symbols),
+                                     (0x01, chm_dc_codelens, chm_dc_symbols),
+                                     (0x11, chm_ac_codelens, chm_ac_symbols)]:
+        headers += _segment(0xc4, bytes([tc_th] + codelens + symbols))
+    headers += _segment(0xda, bytes([3, 0, 0x00, 1, 0x11, 2, 0x11, 0, 63, 0]))
+    return headers
+
+
+class FrameAssembler:
+    """Rebuild JFIF frames from in order RTP/JPEG packets
+
+    A frame is delivered to on_frame(frame, packets) when its last packet
+    (marker bit) is received and all its fragments are contiguous. Frames
+    with lost fragments are dropped.
+    """
+    def __init__(self, on_frame):
+        self.on_frame = on_frame
+        self.packets = []
+        self.timestamp = None
+        self.complete = True
+
+        self.frames = 0
+        self.incomplete = 0
+        self.sizes = []
+        self.latencies = []
+
+    def _reset(self):
+        self.packets = []
+        self.timestamp = None
+        self.complete = True
+
+    def push(self, packet):
+        if packet is None:
+            self.complete = False
+            return
+        if self.timestamp is not None and packet.timestamp != self.timestamp:
+            # end of the previous frame lost
+            self.incomplete += 1
+            self._reset()
+        if packet.offset == 0 and self.packets:
+            self.incomplete += 1
+            self._reset()
+        if not self.packets:
+            self.complete = packet.offset == 0
+        self.timestamp = packet.timestamp
+        self.packets.append(packet)
+        if packet.marker:
+            self._end_frame()
+
+    def _end_frame(self):
+        packets = self.packets
+        offset = 0
+        for packet in packets:
+            if packet.offset != offset:
+                self.complete = False
+                break
+            offset += len(packet.payload)
+        first = packets[0]
+        if first.q >= 128:
+            qtables = first.qtables
+        else:
+            qtables = make_qtables(first.q)
+        if not self.complete or qtables is None:
+            self.incomplete += 1
+        else:
+            frame = b"".join([make_headers(first.type, first.width, first.height, qtables)] +
+                             [packet.payload for packet in packets] +
+                             [b"\xff\xd9"])
+            self.frames += 1
+            self.sizes.append(len(frame))
+            self.latencies.append(packets[-1].arrival - first.arrival)
+            self.on_frame(frame, packets)
+        self._reset()
+
+
+class RTPJPEGReceiver:
+    """Jitter buffer (with its resync and jitter estimate) and frame
+    assembler for each SSRC"""
+    def __init__(self, on_frame, depth=64):
+        self.on_frame = on_frame
+        self.depth = depth
+        self.sources = {}
+        self.invalid = 0
+
+    def _source(self, ssrc):
+        if ssrc not in self.sources:
+            def on_frame(frame, packets):
+                self.on_frame(ssrc, frame, packets)
+            self.sources[ssrc] = (JitterBuffer(self.depth), FrameAssembler(on_frame))
+        return self.sources[ssrc]
+
+    def push(self, data, arrival):
+        packet = parse_packet(data, arrival)
+        if packet is None:
+            self.invalid += 1
+            return
+        jitter_buffer, assembler = self._source(packet.ssrc)
+        jitter_buffer.push(packet)
+        for packet in jitter_buffer.pop():
+            assembler.push(packet)
+
+    def flush(self):
+        for jitter_buffer, assembler in self.sources.values():
+            for packet in jitter_buffer.flush():
+                assembler.push(packet)
+
+    def stats(self):
+        s = {"received": 0, "lost": 0, "reordered": 0, "late": 0, "duplicates": 0, "resyncs": 0,
+             "jitter": 0., "frames": 0, "incomplete": 0, "sizes": [], "latencies": []}
+        for jitter_buffer, assembler in self.sources.values():
+            for k in "received", "lost", "reordered", "late", "duplicates", "resyncs":
+                s[k] += getattr(jitter_buffer, k)
+            # worst source
+            s["jitter"] = max(s["jitter"], jitter_buffer.jitter)
+            for k in "frames", "incomplete", "sizes", "latencies":
+                s[k] += getattr(assembler, k)
+        return s
+
+
+def distribution(values):
+    """min/median/p95/max of a list"""
+    if not values:
+        return "-"
+    values = sorted(values)
+    return "{}/{}/{}/{}".format(values[0], values[len(values)//2],
+                                values[(len(values)*95)//100], values[-1])
+
+
+def receive(args):
+    if args.container is not None:
+        writer = ContainerWriter(args.container, args.container_size*1024*1024)
+    elif args.output is not None:
+        writer = FilesWriter(args.output)
+    else:
+        writer = None
+
+    def on_frame(ssrc, frame, packets):
+        if writer is not None:
+            writer.write(frame)
+
+    receiver = RTPJPEGReceiver(on_frame, args.depth)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8*1024*1024)
+    sock.bind((args.ip_address, args.port))
+    sock.setblocking(False)
+
+    buf = bytearray(2048)
+    view = memoryview(buf)
+    start = time.time()
+    last_report = start
+    last = receiver.stats()
+    try:
+        while True:
+            select.select([sock], [], [], 0.1)
+            while True:
+                try:
+                    n = sock.recv_into(buf)
+                except BlockingIOError:
+                    break
+                receiver.push(view[:n], time.time())
+
+            now = time.time()
+            if now - last_report >= 1.0:
+                s = receiver.stats()
+                elapsed = now - last_report
+                sizes = s["sizes"][len(last["sizes"]):]
+                latencies = [int(l*1e6) for l in s["latencies"][len(last["latencies"]):]]
+                print("{:6d} frames  {:5.1f} fps  lost: {}  reordered: {}  late: {}  resyncs: {}  incomplete: {}  "
+                      "jitter: {:.2f}ms  size (min/med/p95/max): {}  latency (us): {}".format(
+                    s["frames"],
+                    (s["frames"] - last["frames"])/elapsed,
+                    s["lost"], s["reordered"], s["late"], s["resyncs"], s["incomplete"],
+                    s["jitter"]*1000/rtp_clock_freq,
+                    distribution(sizes),
+                    distribution(latencies)), flush=True)
+                last_report = now
+                last = s
+            if args.frames is not None and receiver.stats()["frames"] >= args.frames:
+                break
+            if args.duration is not None and now - start >= args.duration:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sock.close()
+        receiver.flush()
+        if writer is not None:
+            writer.close()
+    s = receiver.stats()
+    print("received {} frames ({} packets, {} lost, {} reordered, {} incomplete frames)".format(
+        s["frames"], s["received"], s["lost"], s["reordered"], s["incomplete"]))
+
+
+# loopback generator
+
+def parse_jpeg(data):
+    """Type, width, height (8-pixel units), quantization tables and scan data of a baseline JFIF"""
+    offset = 2
+    qtables = {}
+    _type = width = height = None
+    while offset < len(data):
+        marker = data[offset + 1]
+        length = struct.unpack_from(">H", data, offset + 2)[0]
+        segment = data[offset + 4:offset + 2 + length]
+        if marker == 0xdb:
+            i = 0
+            while i < len(segment):
+                qtables[segment[i] & 0x0f] = segment[i + 1:i + 65]
+                i += 65
+        elif marker == 0xc0:
+            height, width = struct.unpack_from(">HH", segment, 1)
+            _type = 0 if segment[7] == 0x21 else 1
+        elif marker == 0xda:
+            scan = data[offset + 2 + length:]
+            if scan.endswith(b"\xff\xd9"):
+                scan = scan[:-2]
+            return _type, width//8, height//8, qtables[0] + qtables.get(1, qtables[0]), scan
+        offset += 2 + length
+    raise ValueError("No scan in JPEG frame")
+
+
+def packetize(data, sequence_number, timestamp, ssrc, payload_size=1472):
+    """RTP/JPEG packets of a JFIF frame, as sent by the RTPJPEGSender"""
+    _type, width, height, qtables, scan = parse_jpeg(data)
+    packets = []
+    offset = 0
+    while True:
+        header = jpeg_header.pack(offset, _type, jpeg_q_dynamic, width, height)
+        if offset == 0:
+            header += jpeg_qtable_header.pack(0, 0, len(qtables)) + qtables
+        chunk = payload_size - rtp_header_length - len(header)
+        last = offset + chunk >= len(scan)
+        packets.append(rtp_header.pack(rtp_version << 6,
+                                       (last << 7) | rtp_payload_type_jpeg,
+                                       sequence_number, timestamp, ssrc) +
+                       header + scan[offset:offset + chunk])
+        sequence_number = (sequence_number + 1) & 0xffff
+        offset += chunk
+        if last:
+            return packets
+
+
+def generate(args):
+    frames = list(replay_frames(args.source))
+    if not frames:
+        raise ValueError("No frames in {}".format(args.source))
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    destination = (args.ip_address, args.port)
+
+    sequence_number = random.randrange(2**16)
+    start = time.time()
+    sent = 0
+    for n in range(args.loops*len(frames)):
+        timestamp = int(n*rtp_clock_freq/args.fps) & 0xffffffff
+        packets = packetize(frames[n % len(frames)], sequence_number, timestamp,
+                            args.ssrc, args.payload_size)
+        sequence_number = (sequence_number + len(packets)) & 0xffff
+        # simulated network
+        packets = [p for p in packets if random.random() >= args.loss]
+        for i in range(len(packets) - 1):
+            if random.random() < args.reorder:
+                packets[i], packets[i + 1] = packets[i + 1], packets[i]
+        for packet in packets:
+            sock.sendto(packet, destination)
+            sent += 1
+        wait = start + (n + 1)/args.fps - time.time()
+        if wait > 0:
+            time.sleep(wait)
+    print("sent {} frames ({} packets)".format(args.loops*len(frames), sent))
+
+
+def _get_args():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command")
+
+    parser_receive = subparsers.add_parser("receive", help="receive frames")
+    parser_receive.add_argument("--ip_address", default="", help="local address to bind")
+    parser_receive.add_argument("--port", default=8000, type=int, help="UDP port")
+    parser_receive.add_argument("--depth", default=64, type=int, help="jitter buffer depth (packets)")
+    parser_receive.add_argument("--output", default=None, help="directory of per-frame files")
+    parser_receive.add_argument("--container", default=None, help="container file")
+    parser_receive.add_argument("--container_size", default=1024, type=int, help="container size (MB)")
+    parser_receive.add_argument("--frames", default=None, type=int, help="number of frames to receive")
+    parser_receive.add_argument("--duration", default=None, type=float, help="receive duration (s)")
+
+    parser_generate = subparsers.add_parser("generate", help="send jpg files as RTP/JPEG")
+    parser_generate.add_argument("--ip_address", default="127.0.0.1", help="destination address")
+    parser_generate.add_argument("--port", default=8000, type=int, help="UDP port")
+    parser_generate.add_argument("--fps", default=30, type=float, help="frame rate")
+    parser_generate.add_argument("--ssrc", default=0, type=int, help="RTP SSRC")
+    parser_generate.add_argument("--payload_size", default=1472, type=int, help="packet payload size")
+    parser_generate.add_argument("--loops", default=1, type=int, help="number of replays")
+    parser_generate.add_argument("--loss", default=0., type=float, help="packet loss probability")
+    parser_generate.add_argument("--reorder", default=0., type=float, help="packet swap probability")
+    parser_generate.add_argument("source", help="directory of jpg files or container")
+
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = _get_args()
+    if args.command == "receive":
+        receive(args)
+    elif args.command == "generate":
+        generate(args)
+    else:
+        print("Specify a command (receive or generate)")
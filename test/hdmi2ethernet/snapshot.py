@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""Delta framebuffer snapshots over Etherbone
+
+The latest framebuffer captured by an HDMI input is fetched at a fixed
+rate. Only the lines that changed since the previous snapshot are read:
+changes are found with the table of line crcs written by the DMA after each
+frame (see gateware/hdmi_in/dma.py), or, on gateware without it, with a
+hash of each line computed on the host (the whole frame is then read).
+
+The framebuffer read may be reused by the DMA during a long transfer: the
+frames written to memory are counted before and after the transfer and the
+snapshot is dropped (torn) when the framebuffer may have been written again.
+The sdram layout comes from firmware/lm32/framebuffer.h.
+
+The latest frame is kept in a shared memory buffer (see SharedFramebuffer)
+for other tools. Run "./snapshot.py read out.png" to save it.
+"""
+import argparse
+import os
+import re
+import struct
+import sys
+import time
+import zlib
+from array import array
+from multiprocessing import shared_memory
+
+import framebuffer
+
+SDRAM_BASE = 0x40000000
+FRAMEBUFFER_H = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "..", "..", "firmware", "lm32", "framebuffer.h")
+MAX_WIDTH = 1920
+MAX_HEIGHT = 2048
+
+
+def read_layout(filename=FRAMEBUFFER_H):
+    """Integer constants (#define) of the sdram layout header"""
+    defines = {}
+    with open(filename) as f:
+        for line in f:
+            m = re.match(r"#define\s+(\w+)\s+([^/]+?)\s*(/\*.*)?$", line)
+            if m is None:
+                continue
+            try:
+                defines[m.group(1)] = int(eval(m.group(2), {"__builtins__": {}}, dict(defines)))
+            except (NameError, SyntaxError, TypeError):
+                pass
+    return defines
+
+
+class SharedFramebuffer:
+    """Latest frame in shared memory
+
+    Layout: header (magic, width, height, sequence, frame number, timestamp),
+    frame number of the last change of each line (u32), then the frame
+    (hres*vres 16-bit pixels, as in SDRAM). The sequence is odd while the
+    frame is updated: readers retry when it is odd or changed during a read.
+    """
+    header = struct.Struct("<4sIIIQd")
+    magic = b"FBSH"
+
+    def __init__(self, name, create=False):
+        size = self.header.size + 4*MAX_HEIGHT + 2*MAX_WIDTH*MAX_HEIGHT
+        if create:
+            try:
+                shared_memory.SharedMemory(name).unlink()
+            except FileNotFoundError:
+                pass
+            self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+            self.header.pack_into(self.shm.buf, 0, self.magic, 0, 0, 0, 0, 0.)
+        else:
+            self.shm = shared_memory.SharedMemory(name)
+            if self.header.unpack_from(self.shm.buf, 0)[0] != self.magic:
+                raise ValueError("Invalid shared framebuffer {}".format(name))
+        self.buf = self.shm.buf
+        self.lines_offset = self.header.size
+        self.frame_offset = self.lines_offset + 4*MAX_HEIGHT
+
+    def close(self, unlink=False):
+        self.buf.release()
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+    def update(self, width, height, lines, frame):
+        """Write the changed lines ({line: big endian bytes})"""
+        magic, w, h, sequence, _, _ = self.header.unpack_from(self.buf, 0)
+        self.header.pack_into(self.buf, 0, magic, width, height, sequence + 1, frame, time.time())
+        line_size = 2*width
+        changed = array("I")
+        changed.frombytes(self.buf[self.lines_offset:self.lines_offset + 4*height])
+        for line, data in lines.items():
+            offset = self.frame_offset + line*line_size
+            self.buf[offset:offset + line_size] = data
+            changed[line] = frame & 0xffffffff
+        self.buf[self.lines_offset:self.lines_offset + 4*height] = changed.tobytes()
+        self.header.pack_into(self.buf, 0, magic, width, height, sequence + 2, frame, time.time())
+
+    def read(self):
+        """(frame number, width, height, frame bytes) of a consistent frame"""
+        while True:
+            magic, width, height, sequence, frame, timestamp = self.header.unpack_from(self.buf, 0)
+            if sequence & 1:
+                time.sleep(0.001)
+                continue
+            data = bytes(self.buf[self.frame_offset:self.frame_offset + 2*width*height])
+            if self.header.unpack_from(self.buf, 0)[3] == sequence:
+                return frame, width, height, data
+
+
+def _ranges(lines):
+    """Contiguous (first, count) ranges of a sorted list of lines"""
+    ranges = []
+    for line in lines:
+        if ranges and ranges[-1][0] + ranges[-1][1] == line:
+            ranges[-1][1] += 1
+        else:
+            ranges.append([line, 1])
+    return ranges
+
+
+def _be_bytes(words):
+    if sys.byteorder == "little":
+        words = array("I", words)
+        words.byteswap()
+    return words.tobytes()
+
+
+class SnapshotService:
+    def __init__(self, wb, hdmi_in=0, line_crcs=None, layout=None):
+        self.regs = wb.regs
+        self.bulk = wb.bulk
+        self.prefix = "hdmi_in{}_".format(hdmi_in)
+        if layout is None:
+            layout = read_layout()
+        self.framebuffers_base = layout["HDMI_IN{}_FRAMEBUFFERS_BASE".format(hdmi_in)]
+        self.framebuffers_size = layout["HDMI_IN{}_FRAMEBUFFERS_SIZE".format(hdmi_in)]
+        self.framebuffer_count = layout["FRAMEBUFFER_COUNT"]
+        self.base = SDRAM_BASE + self.framebuffers_base
+        if line_crcs is None:
+            line_crcs = hasattr(self.regs, self.prefix + "dma_line_size")
+        self.line_crcs = line_crcs
+
+        self.width = self.height = 0
+        self.signatures = []
+        self.frame = 0
+        self.last_change = time.time()
+
+        self.bytes = 0
+        self.torn = 0
+
+    def _reg(self, name):
+        return getattr(self.regs, self.prefix + name).read()
+
+    def slot_framebuffers(self):
+        """Framebuffers loaded in the DMA slots"""
+        in_slots = set()
+        for slot in range(2):
+            address = self._reg("dma_slot{}_address".format(slot)) & 0x0fffffff
+            in_slots.add((address - self.framebuffers_base)//self.framebuffers_size)
+        return in_slots
+
+    def latest_framebuffer(self, in_slots):
+        """Index of the latest complete framebuffer
+
+        The firmware loads the DMA slots with consecutive framebuffers (in
+        rotation), the latest complete one is the free framebuffer that
+        precedes them.
+        """
+        for n in range(self.framebuffer_count):
+            if n not in in_slots and (n + 1) % self.framebuffer_count in in_slots:
+                return n
+        return 0
+
+    def frame_count(self):
+        if hasattr(self.regs, self.prefix + "dma_frame_count"):
+            return self._reg("dma_frame_count")
+        return None
+
+    def reused(self, fb, frames, in_slots):
+        """Whether framebuffer fb, latest when frames had been written,
+        may have been written again since
+
+        On each completed frame the firmware reloads the slot with the
+        framebuffer that follows the slots: the latest framebuffer is loaded
+        again after framebuffer_count - 2 completed frames. Without the frame
+        counter, only a framebuffer found in the slots after the transfer can
+        be detected.
+        """
+        reuse = self.framebuffer_count - 2
+        if frames is not None:
+            return (self.frame_count() - frames) & 0xffffffff >= reuse
+        in_slots_after = self.slot_framebuffers()
+        if in_slots_after == in_slots:
+            return False
+        latest = self.latest_framebuffer(in_slots_after)
+        return fb in in_slots_after or (latest - fb) % self.framebuffer_count >= reuse
+
+    def snapshot(self):
+        """Fetch the changed lines of the latest frame, returns {line: bytes}"""
+        width = self._reg("resdetection_hres")
+        height = self._reg("resdetection_vres")
+        if (width, height) != (self.width, self.height):
+            self.width, self.height = width, height
+            self.signatures = [None]*height
+        if width == 0 or height == 0 or width > MAX_WIDTH or height > MAX_HEIGHT:
+            return {}
+        line_words = width//2
+        frames = self.frame_count()
+        in_slots = self.slot_framebuffers()
+        fb = self.latest_framebuffer(in_slots)
+        address = self.base + fb*self.framebuffers_size
+
+        if self.line_crcs:
+            table_address = address + 2*width*height
+            table = self.bulk.read_block(table_address, height)
+            changed = [l for l in range(height) if table[l] != self.signatures[l]]
+            blocks = self.bulk.read_blocks([(address + 4*line_words*first, line_words*count)
+                                            for first, count in _ranges(changed)])
+            self.bytes += 4*(height + line_words*len(changed))
+            if self.reused(fb, frames, in_slots):
+                self.torn += 1
+                return {}
+            lines = {}
+            for (first, count), data in zip(_ranges(changed), blocks):
+                data = _be_bytes(data)
+                for i in range(count):
+                    lines[first + i] = data[4*line_words*i:4*line_words*(i + 1)]
+            for line in changed:
+                self.signatures[line] = table[line]
+        else:
+            data = _be_bytes(self.bulk.read_block(address, line_words*height))
+            self.bytes += len(data)
+            if self.reused(fb, frames, in_slots):
+                self.torn += 1
+                return {}
+            lines = {}
+            for line in range(height):
+                line_data = data[4*line_words*line:4*line_words*(line + 1)]
+                signature = zlib.crc32(line_data)
+                if signature != self.signatures[line]:
+                    self.signatures[line] = signature
+                    lines[line] = line_data
+        return lines
+
+    def run(self, shared, rate=5., duration=None, link_rate=100e6):
+        start = time.time()
+        last_report = start
+        last_bytes = 0
+        n = 0
+        while duration is None or time.time() - start < duration:
+            lines = self.snapshot()
+            now = time.time()
+            if lines:
+                self.frame += 1
+                self.last_change = now
+                shared.update(self.width, self.height, lines, self.frame)
+            if now - last_report >= 1.:
+                elapsed = now - last_report
+                bandwidth = (self.bytes - last_bytes)*8/elapsed
+                print("{}x{}  frame {}  changed lines: {}  {:.2f} Mbit/s ({:.1f}% of link)  torn: {}{}".format(
+                    self.width, self.height, self.frame, len(lines), bandwidth/1e6,
+                    100*bandwidth/link_rate, self.torn,
+                    "  frozen for {:.0f}s".format(now - self.last_change) if now - self.last_change > 2 else ""),
+                    flush=True)
+                last_report = now
+                last_bytes = self.bytes
+            n += 1
+            wait = start + n/rate - time.time()
+            if wait > 0:
+                time.sleep(wait)
+
+
+def main(wb):
+    wb.open()
+    # # #
+    shared = SharedFramebuffer("hdmi2eth_snapshot", create=True)
+    try:
+        SnapshotService(wb).run(shared)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        shared.close(unlink=True)
+    # # #
+    wb.close()
+
+
+def _get_args():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command")
+
+    parser_run = subparsers.add_parser("run", help="run the snapshot service")
+    parser_run.add_argument("--ip_address", default="192.168.1.42", help="Etherbone IP address")
+    parser_run.add_argument("--udp_port", default=20000, type=int, help="Etherbone UDP port")
+    parser_run.add_argument("--busword", default=8, type=int, help="CSR busword")
+    parser_run.add_argument("--hdmi_in", default=0, type=int, help="HDMI input")
+    parser_run.add_argument("--rate", default=5., type=float, help="snapshots per second")
+    parser_run.add_argument("--host_hash", action="store_true", help="do not use the line crcs of the gateware")
+    parser_run.add_argument("--name", default="hdmi2eth_snapshot", help="shared memory name")
+
+    parser_read = subparsers.add_parser("read", help="save the latest snapshot")
+    parser_read.add_argument("--name", default="hdmi2eth_snapshot", help="shared memory name")
+    parser_read.add_argument("output", help="png file")
+
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = _get_args()
+    if args.command == "run":
+        from misoclib.com.liteeth.software.wishbone import LiteEthWishboneBridgeDriver
+        from etherbone import EtherboneClient
+        wb = LiteEthWishboneBridgeDriver(args.ip_address, args.udp_port, "../csr.csv", args.busword, debug=False)
+        # shares the socket of the driver (bound to udp_port)
+        wb.bulk = EtherboneClient(args.ip_address, args.udp_port, driver=wb)
+        wb.open()
+        shared = SharedFramebuffer(args.name, create=True)
+        service = SnapshotService(wb, args.hdmi_in, False if args.host_hash else None)
+        try:
+            service.run(shared, args.rate)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            shared.close(unlink=True)
+            wb.close()
+    elif args.command == "read":
+        shared = SharedFramebuffer(args.name)
+        frame, width, height, data = shared.read()
+        framebuffer.write(args.output, data, width, height)
+        shared.close()
+        print("frame {} ({}x{}) saved to {}".format(frame, width, height, args.output))
+    else:
+        print("Specify a command (run or read)")
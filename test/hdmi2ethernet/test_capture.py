@@ -1,44 +1,354 @@
+#!/usr/bin/env python3
+"""Capture the JPEG frames streamed over UDP by the hdmi2eth targets
+
+capture: receive the datagrams in a preallocated ring of buffers, split the
+         frames on SOI/EOI markers and write them to per-frame files or to a
+         mmapped container. fps, bitrate and drops are reported every second.
+replay:  send frames (jpg files or a container) over UDP the way the
+         UDPStreamer does (datagrams closed on EOI), to test the capture.
+extract: write the frames of a container to per-frame files.
+"""
+import argparse
+import glob
+import mmap
 import os
-import subprocess
+import select
 import socket
+import struct
+import time
+
+SOI = b"\xff\xd8"
+EOI = b"\xff\xd9"
+
+# encoder markers (REPEAT/UPDATE) are 16-byte jpeg streams with a COM segment
+marker_length = 16
+marker_header = b"\xff\xd8\xff\xfe\x00\x0a"
+
+# container: records of (magic, length, timestamp in ns) + frame
+container_record = struct.Struct("<4sIQ")
+container_magic = b"FRM0"
+
+max_datagram_size = 2048
+max_frame_size = 16*1024*1024
+
+
+class FrameSplitter:
+    """Incremental SOI/EOI splitter
 
-capture_dir = "./captures/"
-capture_filename = "capture.bin"
-jpg_filename = "capture_{}.jpg"
-capture_size = 10*1024*1024
-
-sock  = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-sock.bind(("", 8000))
-
-# clean capture_dir
-subprocess.call(["rm", "-rf", capture_dir + "/*"])
-
-# capture data
-data_size = 0
-f = open(os.path.join(capture_dir, capture_filename), "wb")
-while data_size <= capture_size:
-    data, addr = sock.recvfrom(8192)
-    data_size += len(data)
-    f.write(data)
-f.close()
-
-# split data in jpg files
-def split_capture(f):
-    c = bytearray()
-    while True:
-        b = f.read(1048)
-        if not b: # end-of-file
-            yield data
+    Datagrams are fed as memoryviews, frames are assembled in a preallocated
+    buffer and given to on_frame (as a memoryview only valid during the call).
+    A SOI found in the middle of a frame means that the end of the previous
+    frame has been lost: the frame is dropped.
+    """
+    def __init__(self, on_frame, on_marker=None):
+        self.on_frame = on_frame
+        self.on_marker = on_marker
+        self.frame = bytearray(max_frame_size)
+        self.frame_view = memoryview(self.frame)
+        self.length = 0
+        self.in_frame = False
+        self.last_ff = False
+
+        self.frames = 0
+        self.markers = 0
+        self.dropped = 0
+        self.discarded_bytes = 0
+
+    def _append(self, view):
+        n = len(view)
+        if self.length + n > max_frame_size:
+            self.dropped += 1
+            self.in_frame = False
             return
-        c += b
+        self.frame_view[self.length:self.length + n] = view
+        self.length += n
+
+    def _end_frame(self):
+        frame = self.frame_view[:self.length]
+        if self.length == marker_length and self.frame.startswith(marker_header):
+            self.markers += 1
+            if self.on_marker is not None:
+                self.on_marker(frame)
+        else:
+            self.frames += 1
+            self.on_frame(frame)
+        self.in_frame = False
+
+    def feed(self, buf, n):
+        view = memoryview(buf)
+        pos = 0
+        # marker split between two datagrams
+        if n and self.last_ff:
+            if self.in_frame and buf[0] == EOI[1]:
+                self._append(view[:1])
+                self._end_frame()
+                pos = 1
+            elif buf[0] == SOI[1]:
+                if self.in_frame:
+                    self.dropped += 1
+                    self.length -= 1
+                self.in_frame = True
+                self.frame[0] = SOI[0]
+                self.length = 1
+        while pos < n:
+            if not self.in_frame:
+                start = buf.find(SOI, pos, n)
+                if start < 0:
+                    self.discarded_bytes += n - pos
+                    break
+                self.discarded_bytes += start - pos
+                self.in_frame = True
+                self.length = 0
+                pos = start
+            end = buf.find(EOI, pos, n)
+            restart = buf.find(SOI, pos + 2 if self.length == 0 else pos, n)
+            if restart >= 0 and (end < 0 or restart < end):
+                self.dropped += 1
+                self.in_frame = False
+                pos = restart
+                continue
+            if end < 0:
+                self._append(view[pos:n])
+                break
+            self._append(view[pos:end + 2])
+            if self.in_frame:
+                self._end_frame()
+            pos = end + 2
+        self.last_ff = n > 0 and buf[n - 1] == 0xff
+
+
+class FilesWriter:
+    def __init__(self, directory):
+        self.directory = directory
+        self.n = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, frame):
+        filename = os.path.join(self.directory, "capture_{}.jpg".format(self.n))
+        fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.write(fd, frame)
+        finally:
+            os.close(fd)
+        self.n += 1
+
+    def close(self):
+        pass
+
+
+class ContainerWriter:
+    """Frames appended to a preallocated mmapped file, truncated on close"""
+    def __init__(self, filename, size):
+        self.f = open(filename, "w+b")
+        self.f.truncate(size)
+        self.mm = mmap.mmap(self.f.fileno(), size)
+        self.size = size
+        self.offset = 0
+        self.full = False
+
+    def write(self, frame):
+        n = len(frame)
+        end = self.offset + container_record.size + n
+        if end > self.size:
+            self.full = True
+            return
+        container_record.pack_into(self.mm, self.offset, container_magic, n, time.time_ns())
+        self.mm[self.offset + container_record.size:end] = frame
+        self.offset = end
+
+    def close(self):
+        self.mm.flush()
+        self.mm.close()
+        self.f.truncate(self.offset)
+        self.f.close()
+
+
+def read_container(filename):
+    with open(filename, "rb") as f:
+        data = f.read()
+    offset = 0
+    while offset + container_record.size <= len(data):
+        magic, n, timestamp = container_record.unpack_from(data, offset)
+        if magic != container_magic:
+            raise ValueError("Invalid container record at {}".format(offset))
+        offset += container_record.size
+        yield timestamp, data[offset:offset + n]
+        offset += n
+
+
+def udp_rcvbuf_errors():
+    # kernel drops (receive buffer full), linux only
+    try:
+        with open("/proc/net/snmp") as f:
+            lines = [l.split() for l in f if l.startswith("Udp:")]
+        fields = dict(zip(lines[0][1:], lines[1][1:]))
+        return int(fields.get("RcvbufErrors", 0))
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+def capture(args):
+    if args.container is not None:
+        writer = ContainerWriter(args.container, args.container_size*1024*1024)
+    elif args.output is not None:
+        writer = FilesWriter(args.output)
+    else:
+        writer = None
+
+    def on_frame(frame):
+        if writer is not None:
+            writer.write(frame)
+
+    splitter = FrameSplitter(on_frame)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, args.rcvbuf*1024*1024)
+    sock.bind((args.ip_address, args.port))
+    sock.setblocking(False)
+
+    # receive ring: datagrams are received in batches then processed
+    ring = [bytearray(max_datagram_size) for i in range(args.ring)]
+    sizes = [0]*args.ring
+
+    nbytes = 0
+    kernel_drops_start = udp_rcvbuf_errors()
+    start = time.time()
+    last_report = start
+    last_frames = 0
+    last_nbytes = 0
+    try:
         while True:
-            pos = c.find(bytearray(b"\xff\xd9"))
-            if pos < 0:
+            select.select([sock], [], [], 0.1)
+            batch = 0
+            while batch < args.ring:
+                try:
+                    sizes[batch] = sock.recv_into(ring[batch])
+                except BlockingIOError:
+                    break
+                batch += 1
+            for i in range(batch):
+                nbytes += sizes[i]
+                splitter.feed(ring[i], sizes[i])
+
+            now = time.time()
+            if now - last_report >= 1.0:
+                elapsed = now - last_report
+                print("{:6d} frames  {:5.1f} fps  {:6.2f} Mbit/s  markers: {}  dropped: {}  kernel drops: {}  discarded: {} bytes".format(
+                    splitter.frames,
+                    (splitter.frames - last_frames)/elapsed,
+                    (nbytes - last_nbytes)*8/elapsed/1e6,
+                    splitter.markers,
+                    splitter.dropped,
+                    udp_rcvbuf_errors() - kernel_drops_start,
+                    splitter.discarded_bytes), flush=True)
+                last_report = now
+                last_frames = splitter.frames
+                last_nbytes = nbytes
+            if args.frames is not None and splitter.frames >= args.frames:
+                break
+            if args.duration is not None and now - start >= args.duration:
                 break
-            yield c[:pos]
-            c = c[pos + 2:]
+            if isinstance(writer, ContainerWriter) and writer.full:
+                print("container full")
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sock.close()
+        if writer is not None:
+            writer.close()
+    print("captured {} frames ({} bytes in {:.1f}s)".format(splitter.frames, nbytes, time.time() - start))
+
+
+def replay_frames(source):
+    if os.path.isdir(source):
+        filenames = sorted(glob.glob(os.path.join(source, "*.jpg")),
+                           key=lambda f: (len(f), f))
+        for filename in filenames:
+            with open(filename, "rb") as f:
+                yield f.read()
+    else:
+        for timestamp, frame in read_container(source):
+            yield frame
+
+
+def replay(args):
+    frames = list(replay_frames(args.source))
+    if not frames:
+        raise ValueError("No frames in {}".format(args.source))
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4*1024*1024)
+    destination = (args.ip_address, args.port)
+
+    # datagrams of up to payload_size bytes closed on each EOI
+    byte_period = 8/(args.rate*1e6) if args.rate > 0 else 0
+    nbytes = 0
+    start = time.time()
+    for loop in range(args.loops):
+        for frame in frames:
+            view = memoryview(frame)
+            for offset in range(0, len(frame), args.payload_size):
+                datagram = view[offset:offset + args.payload_size]
+                while True:
+                    try:
+                        sock.sendto(datagram, destination)
+                        break
+                    except BlockingIOError:
+                        time.sleep(0.0001)
+                nbytes += len(datagram)
+                # rate limiting
+                wait = start + nbytes*byte_period - time.time()
+                if wait > 0:
+                    time.sleep(wait)
+    elapsed = time.time() - start
+    print("sent {} frames ({:.2f} Mbit/s)".format(len(frames)*args.loops, nbytes*8/elapsed/1e6))
+
+
+def extract(args):
+    writer = FilesWriter(args.output)
+    for timestamp, frame in read_container(args.container):
+        writer.write(frame)
+    print("extracted {} frames".format(writer.n))
+
+
+def _get_args():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command")
+
+    parser_capture = subparsers.add_parser("capture", help="capture frames")
+    parser_capture.add_argument("--ip_address", default="", help="local address to bind")
+    parser_capture.add_argument("--port", default=8000, type=int, help="UDP port")
+    parser_capture.add_argument("--output", default=None, help="directory of per-frame files")
+    parser_capture.add_argument("--container", default=None, help="container file")
+    parser_capture.add_argument("--container_size", default=1024, type=int, help="container size (MB)")
+    parser_capture.add_argument("--frames", default=None, type=int, help="number of frames to capture")
+    parser_capture.add_argument("--duration", default=None, type=float, help="capture duration (s)")
+    parser_capture.add_argument("--ring", default=256, type=int, help="receive ring size (datagrams)")
+    parser_capture.add_argument("--rcvbuf", default=8, type=int, help="socket receive buffer (MB)")
+
+    parser_replay = subparsers.add_parser("replay", help="replay frames over UDP")
+    parser_replay.add_argument("--ip_address", default="127.0.0.1", help="destination address")
+    parser_replay.add_argument("--port", default=8000, type=int, help="UDP port")
+    parser_replay.add_argument("--rate", default=100, type=float, help="rate (Mbit/s, 0: unlimited)")
+    parser_replay.add_argument("--payload_size", default=1472, type=int, help="datagram payload size")
+    parser_replay.add_argument("--loops", default=1, type=int, help="number of replays")
+    parser_replay.add_argument("source", help="directory of jpg files or container")
+
+    parser_extract = subparsers.add_parser("extract", help="extract the frames of a container")
+    parser_extract.add_argument("container", help="container file")
+    parser_extract.add_argument("output", help="output directory")
+
+    return parser.parse_args()
 
-for i, capture in enumerate(split_capture(open(os.path.join(capture_dir, capture_filename), 'rb'))):
-    f = open(os.path.join(capture_dir, jpg_filename.format(str(i))), "wb")
-    f.write(capture)
-    f.close()
+if __name__ == "__main__":
+    args = _get_args()
+    if args.command == "capture":
+        capture(args)
+    elif args.command == "replay":
+        replay(args)
+    elif args.command == "extract":
+        extract(args)
+    else:
+        print("Specify a command (capture, replay or extract)")
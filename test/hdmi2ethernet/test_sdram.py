@@ -46,16 +46,13 @@ def main(wb):
     # # #
     errors = 0
     print("writing...")
-    seed = 0
-    for n in range(TEST_SIZE//(WORDS_PER_PACKET *4)):
-        data, seed = generate_packet(seed, WORDS_PER_PACKET)
-        wb.write(SDRAM_BASE + n*WORDS_PER_PACKET *4, data)
+    data, seed = generate_packet(0, TEST_SIZE//4)
+    wb.bulk.write_block(SDRAM_BASE, data)
     print("reading...")
-    seed = 0
-    for n in range(TEST_SIZE//(WORDS_PER_PACKET *4)):
-        ref, seed = generate_packet(seed, WORDS_PER_PACKET )
-        data = wb.read(SDRAM_BASE + n*WORDS_PER_PACKET *4, WORDS_PER_PACKET)
-        s, l, e = check(ref, data)
+    ref = data
+    data = list(wb.bulk.read_block(SDRAM_BASE, TEST_SIZE//4))
+    for n in range(0, TEST_SIZE//4, WORDS_PER_PACKET):
+        s, l, e = check(ref[n:n+WORDS_PER_PACKET], data[n:n+WORDS_PER_PACKET])
         errors += e
     print("errors: " + str(errors))
     # # #